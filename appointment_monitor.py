@@ -1,13 +1,14 @@
-import subprocess
-import json
-import time
 import os
-import re
-import requests
-from datetime import datetime
-
-# Configuration file path
-CONFIG_FILE = "telegram_config.json"
+import sys
+from login import run_check
+from check_config import load_check_config
+from artifact_store import (apply_retention, rotate_check_logs, flush as flush_artifacts,
+                            wait_for as wait_for_artifact)
+from notifier import get_notifier, CONFIG_FILE
+from history import get_history
+from clock import get_clock
+from thread_stdout import current_stdout, redirect_thread_stdout
+from leader_lease import ALERT_DUPLICATE, ALERT_REPEATED, claim_alert
 # Artifacts directory
 ARTIFACTS_DIR = "artifacts"
 
@@ -17,237 +18,275 @@ def ensure_artifacts_dir():
         os.makedirs(ARTIFACTS_DIR)
         print(f"Created artifacts directory: {ARTIFACTS_DIR}")
 
-def load_telegram_config():
-    """Load Telegram bot token and chat ID from config file"""
-    try:
-        with open(CONFIG_FILE, 'r') as file:
-            config = json.load(file)
-            return config.get('bot_token'), config.get('chat_id')
-    except FileNotFoundError:
-        print(f"Error: Config file '{CONFIG_FILE}' not found.")
-        return None, None
-    except json.JSONDecodeError:
-        print(f"Error: Config file '{CONFIG_FILE}' is not valid JSON.")
-        return None, None
-    except Exception as e:
-        print(f"Error reading config: {e}")
-        return None, None
-
-def send_telegram_message(bot_token, chat_id, message):
-    """Send message to Telegram chat"""
-    if not bot_token or not chat_id:
-        print("ERROR: Missing bot token or chat ID")
+def send_notification(message):
+    """Queue a message for every configured channel; delivery happens in the background"""
+    notifier = get_notifier()
+    if not notifier.channels:
+        print("ERROR: No notification channels configured")
         return False
-    
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": message,
-        "parse_mode": "HTML"
-    }
-    
-    try:
-        response = requests.post(url, data=payload)
-        if response.status_code == 200:
-            print(f"Message sent successfully to Telegram at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            return True
-        else:
-            print(f"Failed to send message. Status code: {response.status_code}, Response: {response.text}")
-            return False
-    except Exception as e:
-        print(f"Error sending Telegram message: {e}")
+    notifier.notify(message)
+    return True
+
+def send_alert(key, message, window=None):
+    """Send a message unless another node sent the same alert within the dedup window.
+
+    Returns True if the message was queued, False if it was not, and None
+    if another node already sent it. This node's own repeats are sent.
+    """
+    claim = claim_alert(key, window)
+    if claim == ALERT_DUPLICATE:
+        print(f"Alert '{key}' was already sent by another node")
+        return None
+    if claim == ALERT_REPEATED:
+        print(f"Alert '{key}' repeats one this node sent recently, sending it again")
+    return send_notification(message)
+
+def availability_message(record, detected_at):
+    message = (f"🎉 <b>APPOINTMENT AVAILABLE!</b> 🎉\n\nService: {record['service_name']} (code {record['service_id']})\n"
+               f"Detected at: {detected_at}\n\n⚡ Book immediately at {record['url']}")
+    if record.get("status") == "unknown":
+        # Not confirmed by a calendar: the page has a layout not labelled yet and no booked marker
+        message += "\n\nThe page has an unrecognised layout without the booked marker, so slots may be open."
+    return message
+
+def send_screenshot(record):
+    """Send the screenshot of a page that may have open slots as a follow-up photo message"""
+    screenshots = [path for path in record["artifacts"] if path.endswith(".png")]
+    if not screenshots:
         return False
+    # The screenshot is written in the background; wait for it alone, not the whole queue.
+    # If it is late, delivery is retried until the file is there.
+    if not wait_for_artifact(screenshots[0]):
+        print(f"Screenshot {screenshots[0]} is not written yet, sending it when it is")
+    caption = f"Booking page of {record['service_name']} (code {record['service_id']})"
+    for path in record["artifacts"]:
+        if path.endswith(".html.gz"):
+            caption += f"\nHTML file saved: {path}"
+    get_notifier().notify(caption, photo=screenshots[0])
+    return True
 
-def check_log_for_appointments(log_file):
-    """Check the log file for appointment availability messages"""
-    try:
-        with open(log_file, 'r') as file:
-            log_content = file.read()
-            
-            # Check for availability messages
-            if "Appointments might be available for service 1151" in log_content:
-                return 1151, True
-            elif "Appointments might be available for service 1258" in log_content:
-                return 1258, True
-            else:
-                # Check both services are fully booked
-                service1151_checked = "No appointments available for service 1151" in log_content
-                service1258_checked = "No appointments available for service 1258" in log_content
-                
-                if service1151_checked and service1258_checked:
-                    return None, False
-                else:
-                    # Script may have failed before checking all services
-                    return None, None
-    except FileNotFoundError:
-        print(f"Log file {log_file} not found.")
-        return None, None
-    except Exception as e:
-        print(f"Error reading log file: {e}")
+class TeeOutput:
+    """Write output to a log file as well as the original stream"""
+
+    def __init__(self, log_file, stream):
+        self.log_file = log_file
+        self.stream = stream
+
+    def write(self, data):
+        self.log_file.write(data)
+        self.stream.write(data)
+
+    def flush(self):
+        self.log_file.flush()
+        self.stream.flush()
+
+class CheckRecordStream:
+    """Consume the result records of a running check as they are emitted.
+
+    The alert for open slots goes out from here, while the check is still
+    running: first the text, as soon as the page is classified, then the
+    screenshot once the page's service record arrives.
+    """
+
+    def __init__(self):
+        self.service_records = []
+        self.check_record = None
+        # Services this node sent the alert for, and those another node already alerted
+        self.alerted = set()
+        self.alerted_elsewhere = set()
+
+    def __call__(self, record):
+        if record["type"] == "availability":
+            print(f"Service {record['service_id']} may have slots, sending the alert now")
+            try:
+                sent = send_alert(f"available:{record['service_id']}",
+                                  availability_message(record, record["detected_at"]))
+                if sent:
+                    self.alerted.add(record["service_id"])
+                elif sent is None:
+                    self.alerted_elsewhere.add(record["service_id"])
+            except Exception as e:
+                # The alert is sent again after the check
+                print(f"Error sending the alert: {e}")
+        elif record["type"] == "service":
+            self.service_records.append(record)
+            print(f"Service {record['service_id']}: {record['status']} "
+                  f"in {record['duration']}s (error: {record['error_class']})")
+            if record["status"] in ("available", "unknown") and record["service_id"] in self.alerted:
+                try:
+                    send_screenshot(record)
+                except Exception as e:
+                    print(f"Error sending the screenshot: {e}")
+        elif record["type"] == "check":
+            self.check_record = record
+
+    def outcome(self):
+        """Return (service record, is_available) for the finished check.
+
+        is_available is True if a service has slots, False if every service
+        was checked and fully booked, and None if the check did not complete.
+        """
+        for record in self.service_records:
+            if record["status"] == "available":
+                return record, True
+        if self.check_record is not None and self.check_record["completed"]:
+            return None, False
         return None, None
 
-def run_appointment_check():
-    """Run the login.py script and capture output to a log file"""
+def run_appointment_check(browser=None, on_record=None, check=run_check):
+    """Run the appointment check in-process, capturing output to a log file.
+
+    ``check`` is called like login.run_check(); simulate.py passes a stub.
+    """
     ensure_artifacts_dir()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = get_clock().now().strftime("%Y%m%d_%H%M%S")
     log_file = os.path.join(ARTIFACTS_DIR, f"appointment_check_{timestamp}.log")
     
-    print(f"Starting appointment check at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Starting appointment check at {get_clock().now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Log will be saved to {log_file}")
     
     try:
-        # Run the login.py script and redirect output to log file
+        # Run the check and copy its output to the log file
         with open(log_file, 'w') as f:
-            process = subprocess.Popen(['python3', 'login.py'], 
-                                      stdout=f, 
-                                      stderr=subprocess.STDOUT)
-            process.wait()
+            with redirect_thread_stdout(TeeOutput(f, current_stdout())):
+                result = check(browser=browser, on_record=on_record)
         
-        print(f"Appointment check completed with exit code {process.returncode}")
-        return log_file
+        print(f"Appointment check completed (completed={result['completed']}, attempts={result['attempts']})")
+        return log_file, result
     except Exception as e:
         print(f"Error running appointment check: {e}")
-        return None
+        return log_file, None
 
-def update_daily_status(available=False):
-    """Update the daily status file to track if appointments were available today"""
-    status_file = os.path.join(ARTIFACTS_DIR, "daily_status.json")
-    today = datetime.now().strftime("%Y-%m-%d")
-    
+def record_check_history(result):
+    """Store the finished check in the check history"""
     try:
-        # Read existing data if file exists
-        if os.path.exists(status_file):
-            with open(status_file, 'r') as f:
-                status_data = json.load(f)
-        else:
-            status_data = {"last_available_date": None, "checks_today": 0, "date": today}
-        
-        # Update the date if it's a new day
-        if status_data.get("date") != today:
-            status_data = {"last_available_date": status_data.get("last_available_date"), "checks_today": 0, "date": today}
-        
-        # Increment the checks counter
-        status_data["checks_today"] = status_data.get("checks_today", 0) + 1
-        
-        # Update the last available date if appointments are available
-        if available:
-            status_data["last_available_date"] = today
-        
-        # Save updated data
-        with open(status_file, 'w') as f:
-            json.dump(status_data, f)
-            
-        return status_data
+        get_history().record_check(result)
     except Exception as e:
-        print(f"Error updating daily status: {e}")
-        return None
-
-def is_summary_time():
-    """Check if it's time to send the daily summary (around 17:00)"""
-    now = datetime.now()
-    return now.hour == 17 and 0 <= now.minute < 10  # Between 17:00 and 17:10
+        print(f"Error recording check history: {e}")
 
-def send_daily_summary(bot_token, chat_id):
+def send_daily_summary():
     """Send a daily summary message if no appointments were available today"""
-    status_file = os.path.join(ARTIFACTS_DIR, "daily_status.json")
-    
     try:
-        if not os.path.exists(status_file):
+        today = get_clock().now().strftime("%Y-%m-%d")
+        summary = get_history().daily_summary(today)
+        if summary["checks"] == 0:
             return False
-            
-        with open(status_file, 'r') as f:
-            status_data = json.load(f)
         
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Only send summary if it's for today and we haven't found appointments today
-        if status_data.get("date") == today and status_data.get("last_available_date") != today:
-            checks_today = status_data.get("checks_today", 0)
-            last_available = status_data.get("last_available_date", "never")
+        # Only send summary if we haven't found appointments today
+        if summary["last_available_date"] != today:
+            last_available = summary["last_available_date"]
             
-            message = f"📊 <b>DAILY SUMMARY</b>\n\n"
+            message = "📊 <b>DAILY SUMMARY</b>\n\n"
             message += f"Date: {today}\n"
-            message += f"Checks performed today: {checks_today}\n"
-            message += f"Result: No appointments were available today\n"
+            message += f"Checks performed today: {summary['completed']}"
+            if summary["failed"]:
+                message += f" ({summary['failed']} more failed)"
+            message += "\n"
+            if summary["mean_duration"] is not None:
+                message += f"Average check time: {summary['mean_duration']:.1f}s\n"
+            message += "Result: No appointments were available today\n"
             
-            if last_available and last_available != "never":
+            if last_available:
                 message += f"Last time appointments were available: {last_available}"
             else:
                 message += "No appointments have been available since monitoring began."
             
-            # Send the summary message
-            send_telegram_message(bot_token, chat_id, message)
-            return True
+            # Send the summary message, once a day across all nodes
+            return bool(send_alert(f"summary:{today}", message, window=24 * 3600))
     
     except Exception as e:
         print(f"Error sending daily summary: {e}")
     
     return False
 
-def main():
+def run_artifact_maintenance():
+    """Apply the artifact retention and check log rotation policies"""
+    config = load_check_config()
+    try:
+        flush_artifacts()
+        removed = apply_retention(config["artifact_retention_days"], config["artifact_max_mb"])
+        if removed:
+            print(f"Removed {removed} old artifacts")
+        rotate_check_logs(config["check_logs_keep"], config["artifact_retention_days"])
+    except Exception as e:
+        print(f"Error during artifact maintenance: {e}")
+
+def main(browser=None, check=run_check):
     """Main monitoring function"""
     # Ensure artifacts directory exists
     ensure_artifacts_dir()
     
-    # Load Telegram configuration
-    bot_token, chat_id = load_telegram_config()
-    if not bot_token or not chat_id:
-        print("ERROR: Telegram configuration missing or invalid. Please check telegram_config.json")
+    # Load notification channels
+    notifier = get_notifier()
+    if not notifier.channels:
+        print(f"ERROR: Notification configuration missing or invalid. Please check {CONFIG_FILE}")
         print("Example format: {\"bot_token\": \"YOUR_BOT_TOKEN\", \"chat_id\": \"YOUR_CHAT_ID\"}")
         return
     
-    print("Telegram configuration loaded successfully")
-    
-    # Check if it's time for the daily summary
-    if is_summary_time():
-        print("It's summary time. Checking if we need to send a daily summary...")
-        summary_sent = send_daily_summary(bot_token, chat_id)
-        if summary_sent:
-            print("Daily summary sent successfully")
-    
-    # Get HTML files before running check (to compare after)
-    existing_html_files = set([f for f in os.listdir(ARTIFACTS_DIR) if f.startswith("booking_page_") and f.endswith(".html")])
+    print(f"Notification channels loaded: {', '.join(notifier.channels)}")
     
-    # Run appointment check
-    log_file = run_appointment_check()
-    if not log_file:
+    # Run appointment check, consuming its result records as they arrive
+    stream = CheckRecordStream()
+    log_file, result = run_appointment_check(browser, on_record=stream, check=check)
+    if result is None:
         message = "⚠️ Error running appointment check script! Please check the system."
-        send_telegram_message(bot_token, chat_id, message)
+        send_alert("check_error", message)
         return
     
-    # New HTML files after check
-    new_html_files = set([f for f in os.listdir(ARTIFACTS_DIR) if f.startswith("booking_page_") and f.endswith(".html")])
-    new_files = new_html_files - existing_html_files
-    
     # Check results
-    service_code, is_available = check_log_for_appointments(log_file)
+    record_check_history(result)
+    service_record, is_available = stream.outcome()
     
     if is_available is True:
-        # Appointments available! Update daily status and send notification
-        update_daily_status(available=True)
-        
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        message = f"🎉 <b>APPOINTMENT AVAILABLE!</b> 🎉\n\nService code: {service_code}\nDetected at: {timestamp}\n\n⚡ Book immediately at https://prenotami.esteri.it/Services/Booking/{service_code}"
-        
-        # Add HTML file info if available
-        html_file = f"booking_page_{service_code}.html"
-        if html_file in new_files:
-            message += f"\n\nHTML file saved: {os.path.join(ARTIFACTS_DIR, html_file)}"
-        
-        # Send notification
-        send_telegram_message(bot_token, chat_id, message)
+        # Appointments available! The alert normally went out during the check
+        if service_record["service_id"] not in stream.alerted | stream.alerted_elsewhere:
+            timestamp = get_clock().now().strftime("%Y-%m-%d %H:%M:%S")
+            message = availability_message(service_record, timestamp)
+            for path in service_record["artifacts"]:
+                if path.endswith(".html.gz"):
+                    message += f"\n\nHTML file saved: {path}"
+            send_alert(f"available:{service_record['service_id']}", message)
         
     elif is_available is False:
-        # No appointments available - update daily status but DON'T send notification
-        update_daily_status(available=False)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"No appointments available at {timestamp}. Both services checked and fully booked.")
+        # No appointments available - DON'T send notification
+        timestamp = get_clock().now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"No appointments available at {timestamp}. All services checked and fully booked.")
+        
+    elif result["error_class"] == "UnknownPage":
+        # A page could not be classified; the layout alert below says which
+        print(f"Not every booking page could be classified: {result['error']}")
         
     else:
         # Script may have failed to check all services - this is an error condition, so send notification
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        message = f"⚠️ Script may not have completed successfully at {timestamp}. Please check log file: {log_file}"
-        send_telegram_message(bot_token, chat_id, message)
+        timestamp = get_clock().now().strftime("%Y-%m-%d %H:%M:%S")
+        message = f"⚠️ Script may not have completed successfully at {timestamp}. Error: {result['error_class']} ({result['error']}). Please check log file: {log_file}"
+        send_alert(f"check_failed:{result['error_class']}", message)
+    
+    # A booking page that could not be classified may be a redesign hiding slots
+    for record in stream.service_records:
+        if record["status"] != "unknown":
+            continue
+        if record.get("fingerprint_new"):
+            problem = "has a layout not seen before"
+        else:
+            problem = "no longer shows the booked marker"
+        message = (f"⚠️ The booking page of {record['service_name']} (code {record['service_id']}) {problem}. "
+                   f"Please check {record['url']} and label it with "
+                   f"python classifier.py --label {record['fingerprint']} booked|available")
+        for path in record["artifacts"]:
+            if path.endswith(".html.gz"):
+                message += f"\n\nHTML file saved: {path}"
+        send_alert(f"new_layout:{record['fingerprint']}", message)
+    
+    # Housekeeping happens after any notification has been sent
+    run_artifact_maintenance()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--summary" in sys.argv[1:]:
+        # The scheduler sends the summary on its own; this is for cron-style setups
+        if send_daily_summary():
+            print("Daily summary sent successfully")
+    else:
+        main()
+    # Give queued notifications a chance to go out; undelivered ones stay in the outbox
+    get_notifier().flush()
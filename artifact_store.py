@@ -0,0 +1,247 @@
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# Content-addressed storage for screenshots and HTML
+STORE_DIR = os.path.join(ARTIFACTS_DIR, "store")
+# Index of every captured artifact, one JSON object per line
+MANIFEST_FILE = os.path.join(ARTIFACTS_DIR, "manifest.jsonl")
+# Touched whenever the check logs are rotated
+ROTATION_STAMP_FILE = os.path.join(ARTIFACTS_DIR, "check_logs_rotated")
+# Check logs are rotated once a day, not after every check (seconds)
+ROTATION_INTERVAL = 24 * 60 * 60
+
+# always: every step; on_error: errors and availability; on_availability: availability only
+CAPTURE_POLICIES = ("always", "on_error", "on_availability")
+# Artifact kinds, from least to most important
+ARTIFACT_KINDS = ("step", "error", "availability")
+
+# Capture context of the check that is currently running
+_policy = "always"
+_check_id = None
+# Background writer, started on first use
+_writer = None
+
+def should_capture(policy, kind):
+    """Decide whether an artifact of the given kind is kept under a capture policy"""
+    if policy == "always":
+        return True
+    if policy == "on_error":
+        return kind in ("error", "availability")
+    return kind == "availability"
+
+def begin_check(check_id, policy):
+    """Set the check id and capture policy used by the capture functions"""
+    global _policy, _check_id
+    if policy not in CAPTURE_POLICIES:
+        print(f"Unknown capture policy '{policy}', using 'always'")
+        policy = "always"
+    _policy, _check_id = policy, check_id
+
+def store_path(digest, suffix):
+    """Path of a stored artifact, sharded by the first two hex digits of its hash"""
+    return os.path.join(STORE_DIR, digest[:2], digest + suffix)
+
+class ArtifactWriter:
+    """Write artifacts to the store in a background thread, off the check's hot path"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="artifact-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, data, suffix, compress, entry):
+        """Queue an artifact and return the path it will be stored at"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = store_path(digest, suffix)
+        entry.update({"sha256": digest, "path": path, "size": len(data)})
+        self.queue.put((data, path, compress, entry))
+        return path
+
+    def run(self):
+        while True:
+            data, path, compress, entry = self.queue.get()
+            try:
+                self.write(data, path, compress, entry)
+            except Exception as e:
+                print(f"Error writing artifact {path}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def write(self, data, path, compress, entry):
+        # Identical content is stored once
+        entry["duplicate"] = os.path.exists(path)
+        if not entry["duplicate"]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + ".tmp"
+            if compress:
+                with gzip.open(temp_path, "wb", compresslevel=6) as f:
+                    f.write(data)
+            else:
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+            os.replace(temp_path, path)
+        entry["stored_size"] = os.path.getsize(path)
+        with open(MANIFEST_FILE, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def flush(self):
+        """Wait until every queued artifact has been written"""
+        self.queue.join()
+
+def get_writer():
+    """Return the shared background writer, starting it on first use"""
+    global _writer
+    if _writer is None:
+        _writer = ArtifactWriter()
+    return _writer
+
+def flush():
+    """Wait for queued artifacts; call before the process exits"""
+    if _writer is not None:
+        _writer.flush()
+
+def wait_for(path, timeout=5.0):
+    """Wait until one queued artifact is on disk; True if it is.
+
+    Unlike flush(), this does not wait for the rest of the queue. Stored
+    files appear atomically, so an existing path is complete.
+    """
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def new_entry(name, kind, info):
+    entry = {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "timestamp": time.time(),
+        "check_id": _check_id,
+        "name": name,
+        "kind": kind,
+    }
+    entry.update(info)
+    return entry
+
+def capture_screenshot(driver, name, kind="step", **info):
+    """Capture a screenshot if the policy allows it; returns its stored path or None"""
+    if not should_capture(_policy, kind):
+        return None
+    png = driver.get_screenshot_as_png()
+    return get_writer().submit(png, ".png", False, new_entry(name, kind, info))
+
+def capture_html(page_source, name, kind="step", **info):
+    """Capture page HTML (gzip-compressed) if the policy allows it; returns its stored path or None"""
+    if not should_capture(_policy, kind):
+        return None
+    data = page_source.encode("utf-8")
+    return get_writer().submit(data, ".html.gz", True, new_entry(name, kind, info))
+
+def read_manifest(path=MANIFEST_FILE):
+    """Return every manifest entry, oldest first"""
+    entries = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+def find_artifacts(kind=None, check_id=None, service_id=None, since=None):
+    """Query the manifest instead of listing the artifacts directory"""
+    matches = []
+    for entry in read_manifest():
+        if kind is not None and entry.get("kind") != kind:
+            continue
+        if check_id is not None and entry.get("check_id") != check_id:
+            continue
+        if service_id is not None and entry.get("service_id") != service_id:
+            continue
+        if since is not None and entry.get("timestamp", 0) < since:
+            continue
+        matches.append(entry)
+    return matches
+
+def apply_retention(max_age_days, max_total_mb):
+    """Drop manifest entries older than max_age_days, then the oldest until under max_total_mb.
+
+    Stored files are deleted once no remaining entry refers to them. The
+    manifest is rewritten atomically.
+    """
+    flush()
+    entries = read_manifest()
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    kept = [e for e in entries if e.get("timestamp", 0) >= cutoff]
+
+    # Count each stored file once, then drop the oldest entries until under the cap
+    sizes = {}
+    for entry in kept:
+        sizes[entry["path"]] = entry.get("stored_size", 0)
+    total = sum(sizes.values())
+    while kept and total > max_total_mb * 1024 * 1024:
+        oldest = kept.pop(0)
+        if not any(e["path"] == oldest["path"] for e in kept):
+            total -= sizes.pop(oldest["path"], 0)
+
+    kept_paths = {e["path"] for e in kept}
+    removed = 0
+    for entry in entries:
+        path = entry["path"]
+        if path not in kept_paths and os.path.exists(path):
+            os.remove(path)
+            kept_paths.add(path)  # only try each file once
+            removed += 1
+
+    if len(kept) != len(entries):
+        temp_file = MANIFEST_FILE + ".tmp"
+        with open(temp_file, 'w') as f:
+            for entry in kept:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temp_file, MANIFEST_FILE)
+    return removed
+
+def rotation_due(interval):
+    """Whether the check logs were last rotated ``interval`` seconds ago or more"""
+    try:
+        return time.time() - os.path.getmtime(ROTATION_STAMP_FILE) >= interval
+    except OSError:
+        return True
+
+def rotate_check_logs(keep_uncompressed, max_age_days, interval=ROTATION_INTERVAL):
+    """Compress all but the newest check logs and delete compressed logs past max_age_days.
+
+    Listing the artifacts directory gets slow as it fills up, so this only
+    runs once per ``interval`` seconds; returns False when it was skipped.
+    """
+    if not rotation_due(interval):
+        return False
+    logs = sorted(f for f in os.listdir(ARTIFACTS_DIR)
+                  if f.startswith("appointment_check_") and (f.endswith(".log") or f.endswith(".log.gz")))
+    plain = [f for f in logs if f.endswith(".log")]
+    for name in plain[:max(0, len(plain) - keep_uncompressed)]:
+        path = os.path.join(ARTIFACTS_DIR, name)
+        with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as target:
+            target.write(source.read())
+        os.remove(path)
+
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    for name in logs:
+        path = os.path.join(ARTIFACTS_DIR, name + ("" if name.endswith(".gz") else ".gz"))
+        if os.path.exists(path) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+    with open(ROTATION_STAMP_FILE, 'w'):
+        pass
+    return True
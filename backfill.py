@@ -0,0 +1,220 @@
+import argparse
+import bisect
+import gzip
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from artifact_store import read_manifest, MANIFEST_FILE
+from check_config import load_check_config, get_services, FULLY_BOOKED_MESSAGE
+from classifier import classify_page
+from history import get_history, HistoryStore, HISTORY_DB, LEGACY_STATUS_FILE
+
+# Bulk backfill of the check history from the artifacts archive:
+#
+#   appointment_check_*.log[.gz]   one check each, read from its RESULT lines
+#   booking_page_<id>.html         pages saved by older versions, re-classified
+#   store/**/*.html.gz             pages in the artifact store, re-classified
+#   daily_status.json              imported by the history store itself
+#
+# Files are parsed in a process pool; only the main process writes to the
+# history. Processed files are remembered by size and mtime, so a re-run
+# only reads new or changed files (--all re-reads everything, e.g. after a
+# classifier change).
+
+ARTIFACTS_DIR = "artifacts"
+LOG_NAME = re.compile(r"^appointment_check_(\d{8}_\d{6})\.log(\.gz)?$")
+LEGACY_HTML_NAME = re.compile(r"^booking_page_(\d+)\.html$")
+BOOKED_LINE = re.compile(r"RESULT: No appointments available for service (\d+)")
+AVAILABLE_LINE = re.compile(r"RESULT: Appointments might be available for service (\d+)")
+UNKNOWN_LINE = re.compile(r"RESULT: Booking page for service (\d+) has an unknown layout")
+MAINTENANCE_LINE = "RESULT: The site is under maintenance"
+# A log this close to a live check is the same check, already in the history
+LIVE_MATCH_SECONDS = 120
+
+def read_text(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+def parse_log(path, service_ids):
+    """Turn one check log into a check result like run_check() returns"""
+    stamp = LOG_NAME.match(os.path.basename(path)).group(1)
+    started_at = datetime.strptime(stamp, "%Y%m%d_%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    statuses = {}
+    maintenance = False
+    for line in read_text(path).splitlines():
+        for pattern, status in ((BOOKED_LINE, "booked"), (AVAILABLE_LINE, "available"), (UNKNOWN_LINE, "unknown")):
+            match = pattern.search(line)
+            if match:
+                # The last result of a service wins, as in the live retry loop
+                statuses[match.group(1)] = status
+        if MAINTENANCE_LINE in line:
+            maintenance = True
+
+    available = next((int(s) for s, status in statuses.items() if status == "available"), None)
+    # Like the live check, a page that could not be classified leaves the check incomplete
+    classified = {s for s, status in statuses.items() if status != "unknown"}
+    completed = available is not None or (bool(statuses) and set(service_ids) <= classified)
+    error_class = None
+    if not completed:
+        if maintenance:
+            error_class = "SiteMaintenance"
+        elif set(service_ids) <= set(statuses):
+            error_class = "UnknownPage"
+        else:
+            error_class = "Incomplete"
+    return {
+        "check_id": f"log_{stamp}",
+        "started_at": started_at,
+        "duration": None,
+        "completed": completed,
+        "available_service": available,
+        "error_class": error_class,
+        "records": [{"service_id": service_id, "status": status, "started_at": started_at, "duration": None,
+                     "method": "log", "error_class": None} for service_id, status in statuses.items()],
+    }
+
+def parse_html(path, service, check_id, checked_at):
+    """Classify one saved booking page with the live classifier, without learning from it"""
+    state, fingerprint, is_new = classify_page(read_text(path), service, learn=False)
+    return {"service_id": service["id"], "state": state, "fingerprint": fingerprint, "new_layout": is_new,
+            "check_id": check_id, "checked_at": checked_at}
+
+def run_task(task):
+    """Process-pool entry point; returns (task, result or None, error or None)"""
+    try:
+        if task["kind"] == "log":
+            return task, parse_log(task["path"], task["service_ids"]), None
+        return task, parse_html(task["path"], task["service"], task["check_id"], task["checked_at"]), None
+    except Exception as e:
+        return task, None, f"{type(e).__name__}: {e}"
+
+def collect_tasks(artifacts_dir, services):
+    """List every archive file as a task dict with its source key, size and mtime"""
+    by_id = {str(s["id"]): s for s in services}
+    service_ids = list(by_id)
+
+    def service_for(service_id):
+        return by_id.get(str(service_id), {"id": service_id, "booked_marker": FULLY_BOOKED_MESSAGE})
+
+    def file_task(kind, path, source=None, **extra):
+        stat = os.stat(path)
+        task = {"kind": kind, "path": path, "source": source or path, "size": stat.st_size, "mtime": stat.st_mtime}
+        task.update(extra)
+        return task
+
+    tasks = []
+    for name in sorted(os.listdir(artifacts_dir)):
+        path = os.path.join(artifacts_dir, name)
+        if LOG_NAME.match(name):
+            tasks.append(file_task("log", path, service_ids=service_ids))
+        elif LEGACY_HTML_NAME.match(name):
+            mtime = datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M:%S")
+            tasks.append(file_task("html", path, service=service_for(LEGACY_HTML_NAME.match(name).group(1)),
+                                   check_id=None, checked_at=mtime))
+
+    # Pages in the artifact store; the same stored file may belong to several checks
+    for entry in read_manifest(os.path.join(artifacts_dir, os.path.basename(MANIFEST_FILE))):
+        if not entry["path"].endswith(".html.gz") or entry.get("service_id") is None:
+            continue
+        # Stored paths start with the live artifacts directory; look for them in this one
+        path = os.path.join(artifacts_dir, os.path.relpath(entry["path"], ARTIFACTS_DIR))
+        if not os.path.exists(path):
+            continue
+        tasks.append(file_task("html", path, f"{path}#{entry['check_id']}",
+                               service=service_for(entry["service_id"]), check_id=entry["check_id"],
+                               checked_at=entry["time"]))
+    return tasks
+
+def is_live_check(live_starts, started_at):
+    """Whether a live check started within LIVE_MATCH_SECONDS of the given time"""
+    moment = datetime.strptime(started_at, "%Y-%m-%d %H:%M:%S")
+    low = (moment - timedelta(seconds=LIVE_MATCH_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    high = (moment + timedelta(seconds=LIVE_MATCH_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    index = bisect.bisect_left(live_starts, low)
+    return index < len(live_starts) and live_starts[index] <= high
+
+def open_history(artifacts_dir=ARTIFACTS_DIR, db=None):
+    """Return the history store kept in an artifacts directory, or the one at ``db``"""
+    db = db or os.path.join(artifacts_dir, os.path.basename(HISTORY_DB))
+    if os.path.abspath(db) == os.path.abspath(HISTORY_DB):
+        return get_history()
+    return HistoryStore(db, os.path.join(artifacts_dir, os.path.basename(LEGACY_STATUS_FILE)))
+
+def backfill(artifacts_dir=ARTIFACTS_DIR, workers=None, reprocess=False, store=None):
+    """Backfill the history from the archive and return a throughput report"""
+    start = time.monotonic()
+    store = store or open_history(artifacts_dir)
+    services = get_services(load_check_config())
+    tasks = collect_tasks(artifacts_dir, services)
+    if not reprocess:
+        done = store.backfilled_sources()
+        tasks = [t for t in tasks if done.get(t["source"]) != (t["size"], t["mtime"])]
+    scan_seconds = time.monotonic() - start
+
+    checks, pages, failed = [], [], {}
+    if tasks:
+        # Large chunks keep the pickling overhead low; eight per worker keep the load even
+        chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for task, result, error in pool.map(run_task, tasks, chunksize=chunksize):
+                if error is not None:
+                    failed[task["source"]] = error
+                elif task["kind"] == "log":
+                    checks.append(result)
+                else:
+                    pages.append(result)
+    parse_seconds = time.monotonic() - start - scan_seconds
+
+    # Logs of checks recorded live are already in the history
+    live_starts = store.check_start_times("live")
+    new_checks = [c for c in checks if not is_live_check(live_starts, c["started_at"])]
+    store.record_checks(new_checks, source="backfill")
+    # Pages are applied after the checks they belong to
+    reclassified = sum(1 for page in sorted(pages, key=lambda p: p["checked_at"])
+                       if store.reclassify_service(page["service_id"], page["state"], page["check_id"], page["checked_at"]))
+    # Files that failed are left out, so the next run tries them again
+    store.mark_backfilled([(t["source"], t["size"], t["mtime"]) for t in tasks if t["source"] not in failed])
+
+    elapsed = time.monotonic() - start
+    total_bytes = sum(t["size"] for t in tasks)
+    return {
+        "files": len(tasks),
+        "logs": len(checks),
+        "pages": len(pages),
+        "checks_recorded": len(new_checks),
+        "checks_already_live": len(checks) - len(new_checks),
+        "services_reclassified": reclassified,
+        "new_layouts": sum(1 for p in pages if p["new_layout"]),
+        "errors": [f"{source}: {error}" for source, error in failed.items()],
+        "megabytes": round(total_bytes / (1024 * 1024), 2),
+        "scan_seconds": round(scan_seconds, 3),
+        "parse_seconds": round(parse_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_second": round(len(tasks) / elapsed, 1) if elapsed else None,
+        "megabytes_per_second": round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else None,
+    }
+
+def main():
+    """Run the backfill from the command line and print the report"""
+    parser = argparse.ArgumentParser(description="Backfill the check history from the artifacts archive")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--all", action="store_true", help="re-process files already backfilled")
+    parser.add_argument("--artifacts-dir", default=ARTIFACTS_DIR)
+    parser.add_argument("--db", default=None, help="history database (default: history.db in the artifacts directory)")
+    args = parser.parse_args()
+
+    report = backfill(args.artifacts_dir, args.workers, args.all, open_history(args.artifacts_dir, args.db))
+    print(f"Processed {report['files']} files ({report['megabytes']} MB): {report['logs']} logs, {report['pages']} pages")
+    print(f"Recorded {report['checks_recorded']} checks ({report['checks_already_live']} were already recorded live), "
+          f"re-classified {report['services_reclassified']} service results, {report['new_layouts']} pages with new layouts")
+    print(f"Took {report['elapsed_seconds']}s (scan {report['scan_seconds']}s, parse {report['parse_seconds']}s): "
+          f"{report['files_per_second']} files/s, {report['megabytes_per_second']} MB/s")
+    for error in report["errors"]:
+        print(f"Error: {error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from browser_service import BrowserService
+from check_config import load_check_config
+from fake_prenotami import start_fake_server, FakeSiteState
+from metrics import percentile
+from process_tree import tree_cpu_seconds, tree_rss_bytes
+from session_store import clear_session
+import login
+
+# Latency benchmark of the full check against the local fake site.
+#
+#   cold     new browser and no saved session for every run
+#   warm     one browser and saved session reused between runs
+#   failure  homepage times out, so every attempt fails
+
+SCENARIOS = ["cold", "warm", "failure"]
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "benchmark"
+
+class PeakRssSampler(threading.Thread):
+    """Sample the RSS of this process tree in the background and keep the peak"""
+
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, tree_rss_bytes(os.getpid()))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, tree_rss_bytes(os.getpid()))
+
+def cpu_snapshot():
+    """CPU seconds used by this process tree, including children that already exited"""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return tree_cpu_seconds(os.getpid()) + children.ru_utime + children.ru_stime
+
+def measure(check):
+    """Run one check and return its wall time, CPU time, peak RSS and result"""
+    sampler = PeakRssSampler()
+    sampler.start()
+    cpu_start = cpu_snapshot()
+    wall_start = time.monotonic()
+    result = check()
+    wall = time.monotonic() - wall_start
+    cpu = cpu_snapshot() - cpu_start
+    sampler.stop()
+    return {"wall": wall, "cpu": cpu, "peak_rss": sampler.peak, "completed": result["completed"],
+            "bytes": result.get("bytes_transferred", 0)}
+
+def run_scenario(name, runs, config, state):
+    """Run one scenario and return the per-run measurements"""
+    print(f"Running scenario '{name}' ({runs} runs)...")
+    samples = []
+
+    if name == "cold":
+        for _ in range(runs):
+            clear_session()
+            browser = BrowserService(lean=config["lean_mode"])
+
+            def cold_check():
+                try:
+                    return login.run_check(BENCH_EMAIL, BENCH_PASSWORD, browser=browser, config=config)
+                finally:
+                    browser.shutdown()
+            samples.append(measure(cold_check))
+        return samples
+
+    browser = BrowserService(lean=config["lean_mode"])
+    try:
+        if name == "warm":
+            # Untimed first run starts the browser and saves the session
+            login.run_check(BENCH_EMAIL, BENCH_PASSWORD, browser=browser, config=config)
+        else:
+            state.update({"home": "timeout", "reset_sessions": "1"})
+        for _ in range(runs):
+            samples.append(measure(lambda: login.run_check(BENCH_EMAIL, BENCH_PASSWORD, browser=browser, config=config)))
+    finally:
+        state.update({"home": "ok"})
+        browser.shutdown()
+    return samples
+
+def summarize(samples):
+    """Reduce per-run measurements to p50/p95 latency, CPU and peak RSS"""
+    walls = [s["wall"] for s in samples]
+    cpus = [s["cpu"] for s in samples]
+    return {
+        "runs": len(samples),
+        "completed": sum(1 for s in samples if s["completed"]),
+        "p50_seconds": round(percentile(walls, 50), 3),
+        "p95_seconds": round(percentile(walls, 95), 3),
+        "cpu_p50_seconds": round(percentile(cpus, 50), 3),
+        "cpu_p95_seconds": round(percentile(cpus, 95), 3),
+        "peak_rss_mb": round(max(s["peak_rss"] for s in samples) / (1024 * 1024), 1),
+        "kb_p50": round(percentile([s["bytes"] for s in samples], 50) / 1024, 1),
+    }
+
+def main():
+    """Run the benchmark and print a report"""
+    parser = argparse.ArgumentParser(description="End-to-end check latency benchmark against a local fake site")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per scenario")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--page-timeout", type=int, default=5, help="page load timeout used by the check")
+    parser.add_argument("--lean", action="store_true", help="run the check in lean mode")
+    parser.add_argument("--output", default=os.path.join("artifacts", "benchmark_results.json"))
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    state = FakeSiteState(timeout_delay=args.page_timeout * 2)
+    server = start_fake_server(state=state)
+
+    config = load_check_config()
+    config["base_url"] = f"http://127.0.0.1:{server.server_port}"
+    config["page_timeout"] = args.page_timeout
+    config["lean_mode"] = args.lean
+
+    # Work in a scratch directory so the real artifacts and session are untouched
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="prenotami_bench_")
+    os.chdir(work_dir)
+    report = {"started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "lean_mode": args.lean, "scenarios": {}}
+    try:
+        for name in args.scenarios:
+            report["scenarios"][name] = summarize(run_scenario(name, args.runs, config, state))
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        server.shutdown()
+
+    print(f"{'scenario':<10} {'runs':>4} {'ok':>4} {'p50 s':>8} {'p95 s':>8} {'cpu p50':>8} {'cpu p95':>8} {'rss MB':>8} {'KB p50':>8}")
+    for name, row in report["scenarios"].items():
+        print(f"{name:<10} {row['runs']:>4} {row['completed']:>4} {row['p50_seconds']:>8} {row['p95_seconds']:>8} "
+              f"{row['cpu_p50_seconds']:>8} {row['cpu_p95_seconds']:>8} {row['peak_rss_mb']:>8} {row['kb_p50']:>8}")
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+from selenium_stealth import stealth
+from browser_supervisor import (TEMP_PROFILE_PREFIX, claim_profile, is_process_alive, kill_leftovers,
+                                process_tree_pids, reap_orphans, service_pid)
+from process_tree import tree_rss_bytes
+from check_config import load_check_config
+from metrics import span
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import time
+import urllib.request
+from datetime import datetime
+from tempfile import mkdtemp
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# Cached chromedriver location, so later starts do not need the network
+DRIVER_CACHE_FILE = os.path.join(ARTIFACTS_DIR, "chromedriver_cache.json")
+# State file published by the daemon so checks can attach to the warm browser
+SERVICE_STATE_FILE = os.path.join(ARTIFACTS_DIR, "browser_service.json")
+# Held shared by every attached check and exclusively by the daemon while it recycles the browser
+SERVICE_LOCK_FILE = os.path.join(ARTIFACTS_DIR, "browser_service.lock")
+# One byte per check attached to the daemon's current browser
+SERVICE_CHECKS_FILE = os.path.join(ARTIFACTS_DIR, "browser_service_checks")
+# Persistent profile (and HTTP cache) used in lean mode
+PROFILE_DIR = os.path.join(ARTIFACTS_DIR, "chrome_profile")
+
+# Remote debugging port used by the warm browser
+DEBUG_PORT = 9222
+# Recycle the browser after this many seconds
+MAX_BROWSER_AGE = 6 * 60 * 60
+# Recycle the browser after this many checks
+MAX_CHECKS_PER_BROWSER = 50
+# Recycle the browser when its process tree uses more memory than this (MB)
+MAX_BROWSER_RSS_MB = 1500
+# How often the daemon health-checks the browser (seconds)
+HEALTH_CHECK_INTERVAL = 60
+
+# Lean mode: HTTP disk cache size, and the profile size above which it is trimmed
+LEAN_DISK_CACHE_MB = 100
+LEAN_PROFILE_MAX_MB = 300
+# Resources the check never needs to read a page's text
+LEAN_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.css", "*.mp4", "*.webm",
+    "*google-analytics.com*", "*googletagmanager.com*",
+]
+# Profile subdirectories that only hold caches, removed first when trimming
+PROFILE_CACHE_DIRS = ["Default/Cache", "Default/Code Cache", "Default/GPUCache", "GrShaderCache", "ShaderCache"]
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.6943.53 Safari/537.36"
+
+# Function to ensure the artifacts directory exists
+def ensure_artifacts_dir():
+    """Ensure the artifacts directory exists"""
+    if not os.path.exists(ARTIFACTS_DIR):
+        os.makedirs(ARTIFACTS_DIR)
+        print(f"Created artifacts directory: {ARTIFACTS_DIR}")
+
+def read_driver_cache():
+    """Read the cached chromedriver path and version"""
+    try:
+        with open(DRIVER_CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def get_chromedriver_version(driver_path):
+    """Return the version string reported by a chromedriver binary"""
+    try:
+        output = subprocess.run([driver_path, "--version"], capture_output=True,
+                                text=True, timeout=10).stdout
+        return output.strip()
+    except Exception:
+        return None
+
+def get_chromedriver_path():
+    """Resolve the chromedriver path, using the cache when the binary still exists"""
+    cache = read_driver_cache()
+    cached_path = cache.get("path")
+    if cached_path and os.access(cached_path, os.X_OK):
+        print(f"Using cached ChromeDriver {cache.get('version')} from: {cached_path}")
+        return cached_path
+
+    print("Installing ChromeDriver...")
+    with span("chromedriver_install"):
+        driver_path = ChromeDriverManager().install()
+    ensure_artifacts_dir()
+    cache = {
+        "path": driver_path,
+        "version": get_chromedriver_version(driver_path),
+        "resolved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(DRIVER_CACHE_FILE, 'w') as f:
+        json.dump(cache, f)
+    print(f"Using ChromeDriver {cache['version']} from: {driver_path}")
+    return driver_path
+
+def enable_performance_log(chrome_options):
+    """Have chromedriver record DevTools Network events in its "performance" log"""
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+
+def build_chrome_options(user_data_dir=None, debug_port=None, lean=False, profiling=False):
+    """Build the Chrome options shared by every driver"""
+    chrome_options = Options()
+
+    # Add headless mode
+    chrome_options.add_argument("--headless=new")  # Use the new headless implementation
+
+    # Anti-bot detection measures
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option("useAutomationExtension", False)
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+
+    # Other options
+    if user_data_dir:
+        chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
+    if debug_port:
+        chrome_options.add_argument(f"--remote-debugging-port={debug_port}")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    if lean:
+        # Pages are only scanned for text: small viewport, no images, capped cache
+        chrome_options.add_argument("--window-size=1280,800")
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument(f"--disk-cache-size={LEAN_DISK_CACHE_MB * 1024 * 1024}")
+    else:
+        chrome_options.add_argument("--window-size=1920,1080")
+    if profiling:
+        enable_performance_log(chrome_options)
+    return chrome_options
+
+def apply_stealth(driver):
+    """Apply selenium-stealth settings to a driver"""
+    stealth(driver,
+          languages=["en-US", "en"],
+          vendor="Google Inc.",
+          platform="Win32",
+          webgl_vendor="Intel Inc.",
+          renderer="Intel Iris OpenGL Engine",
+          fix_hairline=True,
+    )
+    print("Selenium-stealth applied")
+
+def apply_lean(driver, blocked_urls=LEAN_BLOCKED_URLS):
+    """Block resource types the check does not need, through the DevTools protocol"""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+    except Exception as e:
+        print(f"Could not block resources: {e}")
+
+def directory_size(path):
+    """Total size of the files under a directory, in bytes"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def is_profile_in_use(profile_dir):
+    """Check whether a running Chrome holds the profile's lock"""
+    try:
+        # Chrome's lock is a symlink to "<hostname>-<pid>"
+        target = os.readlink(os.path.join(profile_dir, "SingletonLock"))
+        return is_process_alive(int(target.rsplit("-", 1)[-1]))
+    except (OSError, ValueError):
+        return False
+
+def trim_profile(profile_dir, max_mb=LEAN_PROFILE_MAX_MB):
+    """Keep the persistent profile under max_mb, dropping caches first and the whole profile last"""
+    if directory_size(profile_dir) <= max_mb * 1024 * 1024:
+        return
+    print(f"Browser profile exceeds {max_mb} MB, clearing its caches")
+    for cache_dir in PROFILE_CACHE_DIRS:
+        shutil.rmtree(os.path.join(profile_dir, cache_dir), ignore_errors=True)
+    if directory_size(profile_dir) > max_mb * 1024 * 1024:
+        print("Browser profile is still too large, starting a new one")
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+def prepare_profile(lean=False):
+    """Return (user_data_dir, temp_dir) for a new browser.
+
+    Lean browsers reuse PROFILE_DIR so the HTTP cache survives between
+    checks; temp_dir is then None because the profile must be kept. If
+    another browser holds the persistent profile, a temporary one is used.
+    """
+    if lean:
+        profile_dir = os.path.abspath(PROFILE_DIR)
+        if not is_profile_in_use(profile_dir):
+            trim_profile(profile_dir)
+            os.makedirs(profile_dir, exist_ok=True)
+            return profile_dir, None
+        print("Persistent browser profile is in use, using a temporary one")
+    temp_dir = mkdtemp(prefix=TEMP_PROFILE_PREFIX)
+    return temp_dir, temp_dir
+
+def start_driver(debug_port=None, lean=False, profiling=False):
+    """Start a new Chrome driver, with a fresh temporary profile unless lean"""
+    user_data_dir, temp_dir = prepare_profile(lean)
+    chrome_options = build_chrome_options(user_data_dir, debug_port, lean, profiling)
+
+    # Claim the profile before Chrome starts, so a concurrent reaper never takes it for a leftover
+    claim_profile(user_data_dir)
+    service = Service(get_chromedriver_path())
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+    claim_profile(user_data_dir, service_pid(service))
+    apply_stealth(driver)
+    if lean:
+        apply_lean(driver)
+    return driver, service, temp_dir
+
+def page_transfer_bytes(driver):
+    """Bytes transferred over the network for the current page and its resources.
+
+    Uses the Resource Timing API: cache hits and blocked requests count as
+    0, and cross-origin resources without Timing-Allow-Origin are not
+    counted.
+    """
+    try:
+        return int(driver.execute_script(
+            "return performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'))"
+            ".reduce((total, entry) => total + (entry.transferSize || 0), 0)") or 0)
+    except Exception:
+        return 0
+
+def is_driver_healthy(driver):
+    """Check that the browser behind a driver still responds"""
+    try:
+        driver.execute_script("return document.readyState")
+        return len(driver.window_handles) > 0
+    except Exception as e:
+        print(f"Browser health check failed: {e}")
+        return False
+
+def is_debug_port_alive(port):
+    """Check that a Chrome remote debugging endpoint answers"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/json/version", timeout=2) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+class BrowserService:
+    """Keeps one Chrome driver warm between checks and recycles it when needed"""
+
+    def __init__(self, debug_port=None, max_age=MAX_BROWSER_AGE, max_checks=MAX_CHECKS_PER_BROWSER, lean=False,
+                 max_rss_mb=MAX_BROWSER_RSS_MB, profiling=False):
+        self.debug_port = debug_port
+        self.lean = lean
+        self.profiling = profiling
+        self.max_age = max_age
+        self.max_checks = max_checks
+        self.max_rss_mb = max_rss_mb
+        self.driver = None
+        self.service = None
+        self.temp_dir = None
+        self.started_at = None
+        self.checks_served = 0
+
+    def is_stale(self):
+        """Check whether the browser has outlived its age, check budget or memory ceiling"""
+        if self.driver is None:
+            return False
+        if time.time() - self.started_at > self.max_age:
+            return True
+        if self.pid() and tree_rss_bytes(self.pid()) > self.max_rss_mb * 1024 * 1024:
+            return True
+        return self.checks_served + self.attached_checks() >= self.max_checks
+
+    def attached_checks(self):
+        """Number of checks other processes ran on this browser (daemon mode only)"""
+        if not self.debug_port:
+            return 0
+        try:
+            return os.path.getsize(SERVICE_CHECKS_FILE)
+        except OSError:
+            return 0
+
+    def start(self):
+        """Start a fresh browser"""
+        print("Starting warm browser...")
+        self.driver, self.service, self.temp_dir = start_driver(self.debug_port, self.lean, self.profiling)
+        self.started_at = time.time()
+        self.checks_served = 0
+        self.write_state()
+
+    def ensure_healthy(self):
+        """Recycle the browser if it is stale or has crashed, starting one if needed"""
+        if self.driver is not None:
+            if self.is_stale():
+                print("Warm browser is stale, recycling...")
+                self.shutdown()
+            elif not is_driver_healthy(self.driver):
+                print("Warm browser crashed, recycling...")
+                self.shutdown()
+        if self.driver is None:
+            self.start()
+
+    def pid(self):
+        """Return the pid of the chromedriver process (Chrome runs under it), or None"""
+        return service_pid(self.service)
+
+    def acquire(self):
+        """Return a healthy driver for one check"""
+        self.ensure_healthy()
+        self.checks_served += 1
+        return self.driver
+
+    def release(self):
+        """Leave the browser on a blank page between checks"""
+        if self.driver is None:
+            return
+        try:
+            self.driver.get("about:blank")
+        except Exception as e:
+            print(f"Error resetting warm browser: {e}")
+            self.shutdown()
+
+    def write_state(self):
+        """Publish the debugging endpoint so other processes can attach"""
+        if not self.debug_port:
+            return
+        ensure_artifacts_dir()
+        state = {
+            "pid": os.getpid(),
+            "debug_port": self.debug_port,
+            "started_at": datetime.fromtimestamp(self.started_at).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(SERVICE_STATE_FILE, 'w') as f:
+            json.dump(state, f)
+        # A new browser starts with no attached checks
+        open(SERVICE_CHECKS_FILE, 'w').close()
+
+    def shutdown(self):
+        """Quit the browser and remove its temporary profile (a lean profile is kept)"""
+        if self.driver is not None:
+            pids = process_tree_pids(self.pid())
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print(f"Error quitting warm browser: {e}")
+            # Whatever survived quit() would leak until the host runs out of memory
+            kill_leftovers(pids)
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+        self.driver = None
+        self.service = None
+        self.temp_dir = None
+
+class ServiceLock:
+    """A lock on the daemon's warm browser, held for as long as it is in use.
+
+    Attached checks hold it shared, so several can run at once; the
+    daemon only recycles the browser while it holds it exclusively.
+    """
+
+    def __init__(self, exclusive=False, blocking=True):
+        ensure_artifacts_dir()
+        self.file = open(SERVICE_LOCK_FILE, 'a')
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(self.file, flags if blocking else flags | fcntl.LOCK_NB)
+            self.locked = True
+        except BlockingIOError:
+            self.locked = False
+
+    def release(self):
+        # Closing the file drops the lock
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def attach_to_browser_service(profiling=False):
+    """Attach to the warm browser published by the daemon.
+
+    Returns (driver, service, lock) or None. The check must release the
+    lock when it is done with the browser.
+    """
+    try:
+        with open(SERVICE_STATE_FILE, 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    port = state.get("debug_port")
+    if not is_process_alive(state.get("pid")) or not is_debug_port_alive(port):
+        print("Browser service is not running, starting a cold browser")
+        return None
+
+    # Waits while the daemon is recycling the browser
+    lock = ServiceLock()
+    try:
+        chrome_options = Options()
+        chrome_options.debugger_address = f"127.0.0.1:{port}"
+        if profiling:
+            # The performance log belongs to this chromedriver session, not the browser
+            enable_performance_log(chrome_options)
+        service = Service(get_chromedriver_path())
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+        apply_stealth(driver)
+        with open(SERVICE_CHECKS_FILE, 'ab') as f:
+            f.write(b".")
+        print(f"Attached to warm browser on port {port}")
+        return driver, service, lock
+    except Exception as e:
+        print(f"Could not attach to browser service: {e}")
+        lock.release()
+        return None
+
+def main():
+    """Run the warm browser as a long-lived daemon"""
+    config = load_check_config()
+    reap_orphans(os.path.abspath(PROFILE_DIR))
+    browser = BrowserService(debug_port=DEBUG_PORT, lean=config["lean_mode"], max_rss_mb=config["browser_max_rss_mb"])
+    with ServiceLock(exclusive=True):
+        browser.ensure_healthy()
+    print(f"Browser service running on port {DEBUG_PORT}")
+
+    try:
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            # Never recycle the browser under a running check; try again next interval
+            with ServiceLock(exclusive=True, blocking=False) as lock:
+                if lock.locked:
+                    browser.ensure_healthy()
+                else:
+                    print("Warm browser is in use, health check postponed")
+    except KeyboardInterrupt:
+        print("Browser service stopping...")
+    finally:
+        browser.shutdown()
+        if os.path.exists(SERVICE_STATE_FILE):
+            os.remove(SERVICE_STATE_FILE)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from process_tree import command_line, kill_processes, kill_tree, list_descendants, list_processes, tree_rss_bytes
+
+# Temporary Chrome profiles are created with this prefix, so leftovers can be found
+TEMP_PROFILE_PREFIX = "prenotami_chrome_"
+# Written into every profile: the pid of the process that owns the browser
+OWNER_FILE = "prenotami_owner.json"
+# How often the supervisor samples the browser's process tree (seconds)
+SAMPLE_INTERVAL = 2
+# The browser is killed at once when it uses this many times the RSS ceiling
+HARD_RSS_FACTOR = 2
+# A profile without an owner file is still being set up for this long (seconds)
+PROFILE_SETUP_GRACE = 3600
+
+def is_process_alive(pid):
+    """Check whether a process with the given pid exists"""
+    try:
+        os.kill(pid, 0)
+        return True
+    except (OSError, TypeError):
+        return False
+
+def is_browser_process(pid):
+    """Whether a pid belongs to Chrome or chromedriver (guards against reused pids)"""
+    args = command_line(pid)
+    return bool(args) and "chrom" in os.path.basename(args[0]).lower()
+
+def claim_profile(profile_dir, driver_pid=None):
+    """Record this process (and its chromedriver) as the owner of a Chrome profile"""
+    owner = {"owner_pid": os.getpid(), "driver_pid": driver_pid, "claimed_at": time.time()}
+    with open(os.path.join(profile_dir, OWNER_FILE), 'w') as f:
+        json.dump(owner, f)
+
+def read_owner(profile_dir):
+    try:
+        with open(os.path.join(profile_dir, OWNER_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def profile_of(pid):
+    """Return the --user-data-dir of a Chrome process, or None"""
+    for arg in command_line(pid):
+        if arg.startswith("--user-data-dir="):
+            return arg.split("=", 1)[1]
+    return None
+
+def is_our_profile(profile_dir, persistent_profile=None):
+    if os.path.basename(profile_dir.rstrip("/")).startswith(TEMP_PROFILE_PREFIX):
+        return True
+    return persistent_profile is not None and os.path.abspath(profile_dir) == os.path.abspath(persistent_profile)
+
+def is_owned(profile_dir):
+    """Whether a profile's owner is still running"""
+    owner = read_owner(profile_dir)
+    return owner is not None and is_process_alive(owner.get("owner_pid"))
+
+def is_being_set_up(profile_dir):
+    """Whether a profile is too new to have its owner file yet"""
+    try:
+        return read_owner(profile_dir) is None and time.time() - os.path.getmtime(profile_dir) < PROFILE_SETUP_GRACE
+    except OSError:
+        return False
+
+def reap_orphans(persistent_profile=None, temp_root=None):
+    """Kill leftover Chrome and chromedriver processes of earlier runs and remove their temp profiles.
+
+    A browser is left over when the process that started it has exited,
+    or its profile directory has already been deleted. Browsers whose
+    owner is still running are never touched. Returns (processes killed,
+    profiles removed).
+    """
+    temp_root = temp_root or tempfile.gettempdir()
+    orphans = []
+    for pid in list_processes():
+        profile_dir = profile_of(pid)
+        if profile_dir is None or not is_our_profile(profile_dir, persistent_profile):
+            continue
+        if not os.path.isdir(profile_dir):
+            orphans.append(pid)
+        elif not is_owned(profile_dir) and not is_being_set_up(profile_dir):
+            orphans.append(pid)
+
+    # chromedrivers recorded by owners that have exited
+    profiles = [os.path.join(temp_root, name) for name in os.listdir(temp_root) if name.startswith(TEMP_PROFILE_PREFIX)]
+    if persistent_profile and os.path.isdir(persistent_profile):
+        profiles.append(persistent_profile)
+    stale = [p for p in profiles if not is_owned(p)]
+    for profile_dir in stale:
+        driver_pid = (read_owner(profile_dir) or {}).get("driver_pid")
+        if driver_pid and is_browser_process(driver_pid):
+            orphans.append(driver_pid)
+
+    if orphans:
+        print(f"Reaping {len(orphans)} leftover browser processes")
+        # Renderer and GPU processes hang below the main browser process
+        kill_processes([child for pid in orphans for child in reversed(list_descendants(pid))] + orphans)
+    removed = 0
+    for profile_dir in stale:
+        if profile_dir == persistent_profile:
+            continue
+        if is_being_set_up(profile_dir):
+            continue
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        removed += 1
+    if removed:
+        print(f"Removed {removed} stale browser profiles")
+    return len(orphans), removed
+
+def service_pid(service):
+    """Return the pid of a chromedriver Service's process, or None"""
+    process = getattr(service, "process", None)
+    return process.pid if process is not None else None
+
+def process_tree_pids(pid):
+    """Return a process and its descendants, to clean up after them later"""
+    return [pid] + list_descendants(pid) if pid else []
+
+def kill_leftovers(pids):
+    """Kill the browser processes among ``pids`` that are still running"""
+    leftovers = [pid for pid in set(pids) if is_process_alive(pid) and is_browser_process(pid)]
+    if leftovers:
+        print(f"Killing {len(leftovers)} browser processes left after quitting")
+        kill_processes(leftovers)
+    return len(leftovers)
+
+class BrowserSupervisor:
+    """Watch the process tree of one browser during a check.
+
+    A background thread samples the tree's RSS. Above ``max_rss_mb`` the
+    browser is marked for recycling after the check; above twice that, or
+    once ``deadline`` seconds have passed, the whole tree is killed so a
+    hung WebDriver call returns at once. ``cleanup()`` kills whatever is
+    left of the tree after the driver has quit.
+    """
+
+    def __init__(self, root_pid, deadline, max_rss_mb):
+        self.root_pid = root_pid
+        self.deadline = time.monotonic() + deadline
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.peak_rss = 0
+        self.pids = set()
+        self.limit_hit = None
+        self.killed = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="browser-supervisor", daemon=True)
+
+    def start(self):
+        if self.root_pid:
+            self.thread.start()
+        return self
+
+    def sample(self):
+        self.pids.update(list_descendants(self.root_pid))
+        rss = tree_rss_bytes(self.root_pid)
+        self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            rss = self.sample()
+            if time.monotonic() > self.deadline:
+                self.kill("deadline")
+                return
+            if rss > self.max_rss * HARD_RSS_FACTOR:
+                self.kill("rss")
+                return
+            if rss > self.max_rss and self.limit_hit is None:
+                print(f"Browser uses {rss // (1024 * 1024)} MB, above the {self.max_rss // (1024 * 1024)} MB ceiling; "
+                      f"it will be recycled after this check")
+                self.limit_hit = "rss"
+
+    def kill(self, reason):
+        print(f"Killing the browser ({reason} limit reached)")
+        self.limit_hit = reason
+        self.killed = True
+        kill_tree(self.root_pid)
+
+    def stop(self):
+        """Stop watching; returns the reason a limit was hit, or None"""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        return self.limit_hit
+
+    def cleanup(self):
+        """Kill every process of the tree that outlived the driver"""
+        return kill_leftovers(list(self.pids) + process_tree_pids(self.root_pid))
@@ -0,0 +1,109 @@
+import json
+import os
+
+from pacing import DEFAULT_PACING
+
+# Optional configuration file for the appointment check
+CHECK_CONFIG_FILE = "check_config.json"
+
+# Message shown on a booking page when there are no slots
+FULLY_BOOKED_MESSAGE = "Sorry, all appointments for this service are currently booked"
+
+# Services checked when the configuration file does not list any
+DEFAULT_SERVICES = [
+    {"id": 1151, "name": "Service 1151", "booked_marker": FULLY_BOOKED_MESSAGE, "priority": 1},
+    {"id": 1258, "name": "Service 1258", "booked_marker": FULLY_BOOKED_MESSAGE, "priority": 2},
+]
+
+DEFAULT_CONFIG = {
+    # Prenotami website (point this at fake_prenotami.py for local testing)
+    "base_url": "https://prenotami.esteri.it",
+    # Page load timeout in seconds
+    "page_timeout": 30,
+    # Hard limit on one check, in seconds
+    "check_deadline": 600,
+    # Limit per phase, in seconds; the booking limit applies to each booking page
+    "phase_deadlines": {"session": 90, "login": 150, "services": 60, "booking": 60},
+    # Backoff between retries: up to base * 2^(failures - 1) seconds, capped at max, with full jitter
+    "retry_backoff_base": 2,
+    "retry_backoff_max": 30,
+    # How long to wait for a loaded page to show what the check needs, in seconds
+    "ready_timeout": 15,
+    # A loaded booking page with neither the booked marker nor a calendar is
+    # classified after this many seconds
+    "booking_settle_seconds": 1.0,
+    # Block images, fonts and stylesheets and keep a persistent, size-capped
+    # browser profile so the HTTP cache survives between checks
+    "lean_mode": False,
+    # The browser is recycled above this memory use (MB); at twice this it is killed mid-check
+    "browser_max_rss_mb": 1500,
+    # Grace period past check_deadline before a hung browser is killed, in seconds
+    "browser_kill_grace": 60,
+    # Record a network waterfall and page metrics of every page load (see waterfall.py)
+    "profiling": False,
+    # Shared SQLite file for leader election between redundant schedulers (null: run alone)
+    "lease_db": None,
+    # Name of this node in the lease (default: host:pid)
+    "node_id": None,
+    # A dead leader is replaced within about 4/3 of this many seconds
+    "lease_ttl": 60,
+    # The same alert is sent by only one node within this many seconds
+    "alert_dedup_seconds": 900,
+    # Local HTTP endpoint of the scheduler with /healthz and /metrics (port 0 disables it)
+    "health_host": "127.0.0.1",
+    "health_port": 8787,
+    # Human-like pauses per step as [min, max] seconds (see pacing.py)
+    "pacing": DEFAULT_PACING,
+    "services": DEFAULT_SERVICES,
+    # Stop checking as soon as one service has slots
+    "stop_at_first_available": True,
+    # Booking pages loaded at once, each in its own tab of the logged-in browser (1: one after another)
+    "booking_tabs": 1,
+    # Fetch booking pages over plain HTTP with the browser's cookies,
+    # using the browser only when the response looks abnormal
+    "probe_mode": False,
+    # Which screenshots and HTML to keep: "always", "on_error" or "on_availability"
+    "capture_policy": "always",
+    # Artifacts older than this many days are deleted
+    "artifact_retention_days": 30,
+    # Stored artifacts are trimmed, oldest first, to this size
+    "artifact_max_mb": 500,
+    # Newest check logs kept uncompressed; older ones are gzipped
+    "check_logs_keep": 24,
+    # "fixed": every hour ±10 minutes; "adaptive": follow planner.py's plan
+    "cadence": "fixed",
+    # Checks per day for the adaptive cadence
+    "daily_check_budget": 24,
+    # Share of the budget spread evenly over the day, whatever the history says
+    "planner_uniform_share": 0.3,
+    # Days of history the planner learns from
+    "planner_history_days": 56,
+}
+
+def load_check_config(file_path=CHECK_CONFIG_FILE):
+    """Load the check configuration, falling back to the defaults for missing keys"""
+    config = dict(DEFAULT_CONFIG)
+    if not os.path.exists(file_path):
+        return config
+    try:
+        with open(file_path, 'r') as file:
+            config.update(json.load(file))
+        config["base_url"] = config["base_url"].rstrip("/")
+    except json.JSONDecodeError:
+        print(f"Error: Config file '{file_path}' is not valid JSON, using defaults.")
+    except Exception as e:
+        print(f"Error reading check config: {e}")
+    return config
+
+def get_services(config):
+    """Return the configured services ordered by priority (lowest number first)"""
+    services = []
+    for entry in config.get("services") or DEFAULT_SERVICES:
+        service = {
+            "id": entry["id"],
+            "name": entry.get("name", f"Service {entry['id']}"),
+            "booked_marker": entry.get("booked_marker", FULLY_BOOKED_MESSAGE),
+            "priority": entry.get("priority", 100),
+        }
+        services.append(service)
+    return sorted(services, key=lambda service: service["priority"])
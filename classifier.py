@@ -0,0 +1,271 @@
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from html.parser import HTMLParser
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# Known page fingerprints and the state each one stands for
+FINGERPRINTS_FILE = os.path.join(ARTIFACTS_DIR, "page_fingerprints.json")
+# Skeleton and diff of every new fingerprint
+FINGERPRINTS_DIR = os.path.join(ARTIFACTS_DIR, "fingerprints")
+
+PAGE_STATES = ("booked", "available", "login", "maintenance", "unknown")
+# A page whose skeleton is at least this similar to a known one gets its state
+SIMILARITY_THRESHOLD = 0.9
+
+# Elements whose contents say nothing about the page's structure
+SKIPPED_TAGS = {"script", "style", "noscript", "svg", "template"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Attributes kept in the skeleton; everything else (values, hrefs, tokens) varies between fetches
+KEPT_ATTRIBUTES = ("id", "type", "name")
+MAINTENANCE_PATTERN = re.compile(r"maintenance|manutenzione|temporarily unavailable|service unavailable", re.I)
+# Calendar and booking form elements confirm open slots. They only cover the layouts seen
+# so far; a page without them and without the booked marker is "unknown" and is still
+# alerted as possibly available.
+AVAILABILITY_IDS = {"datetimepicker", "booking-form"}
+AVAILABILITY_CLASSES = {"calendar", "datepicker"}
+
+# Shared store, loaded on first use
+_store = None
+
+class DomSkeleton(HTMLParser):
+    """Reduce an HTML page to its element structure and visible text.
+
+    Each element becomes one line: its depth, tag, kept attributes and
+    sorted classes. Digits are folded so ids, dates and counters do not
+    change the skeleton.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.stack = []
+        self.skipping = 0
+        self.text = []
+        self.ids = set()
+        self.classes = set()
+
+    def handle_starttag(self, tag, attrs):
+        if self.skipping:
+            if tag in SKIPPED_TAGS:
+                self.skipping += 1
+            return
+        if tag in SKIPPED_TAGS:
+            self.skipping = 1
+            return
+        attrs = dict(attrs)
+        parts = [tag]
+        for name in KEPT_ATTRIBUTES:
+            if attrs.get(name):
+                parts.append(f"{name}={fold_digits(attrs[name])}")
+        classes = sorted(fold_digits(c) for c in (attrs.get("class") or "").split())
+        if classes:
+            parts.append("." + ".".join(classes))
+        self.lines.append(f"{len(self.stack)} {' '.join(parts)}")
+        if attrs.get("id"):
+            self.ids.add(attrs["id"])
+        self.classes.update(classes)
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if self.skipping:
+            if tag in SKIPPED_TAGS:
+                self.skipping -= 1
+            return
+        # Tolerate unclosed elements by popping back to the matching tag
+        if tag in self.stack:
+            while self.stack.pop() != tag:
+                pass
+
+    def handle_data(self, data):
+        if not self.skipping and data.strip():
+            self.text.append(data.strip())
+
+def fold_digits(value):
+    return re.sub(r"\d+", "0", value)
+
+def parse_page(page_source):
+    skeleton = DomSkeleton()
+    skeleton.feed(page_source)
+    skeleton.close()
+    return skeleton
+
+def fingerprint_of(lines):
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()[:16]
+
+def similarity(lines_a, lines_b):
+    """Jaccard similarity of two skeletons"""
+    a, b = set(lines_a), set(lines_b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def is_inheritable(entry):
+    """Whether a page without a matching rule may take this known page's state"""
+    if entry["state"] == "unknown":
+        return False
+    return entry["state"] != "booked" or entry.get("labelled", False)
+
+def classify_by_rules(skeleton, page_source, service):
+    """Classify a page from its content alone; None when no rule applies"""
+    if any("type=password" in line or "name=Password" in line for line in skeleton.lines):
+        return "login"
+    if service["booked_marker"] in page_source:
+        return "booked"
+    if skeleton.ids & AVAILABILITY_IDS or set(skeleton.classes) & AVAILABILITY_CLASSES:
+        return "available"
+    if MAINTENANCE_PATTERN.search(" ".join(skeleton.text)):
+        return "maintenance"
+    return None
+
+class FingerprintStore:
+    """Known page fingerprints, each labelled with a page state.
+
+    Only new fingerprints are written: the skeleton of the page and a
+    diff against the most similar known page, so a redesign shows up as
+    a small delta instead of another full HTML copy.
+    """
+
+    def __init__(self, path=FINGERPRINTS_FILE, snapshot_dir=FINGERPRINTS_DIR):
+        self.path = path
+        self.snapshot_dir = snapshot_dir
+        self.lock = threading.Lock()
+        self.skeletons = {}
+        try:
+            with open(path, 'r') as f:
+                self.fingerprints = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.fingerprints = {}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_file = self.path + ".tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(self.fingerprints, f, indent=2)
+        os.replace(temp_file, self.path)
+
+    def skeleton_path(self, fingerprint):
+        return os.path.join(self.snapshot_dir, f"{fingerprint}.skeleton")
+
+    def skeleton(self, fingerprint):
+        if fingerprint not in self.skeletons:
+            try:
+                with open(self.skeleton_path(fingerprint), 'r') as f:
+                    self.skeletons[fingerprint] = f.read().splitlines()
+            except FileNotFoundError:
+                self.skeletons[fingerprint] = []
+        return self.skeletons[fingerprint]
+
+    def nearest(self, lines, service_id):
+        """Return (fingerprint, similarity) of the most similar known page, preferring the same service"""
+        best, best_score = None, 0.0
+        for fingerprint, entry in self.fingerprints.items():
+            score = similarity(lines, self.skeleton(fingerprint))
+            if entry.get("service_id") == service_id:
+                score += 1e-6
+            if score > best_score:
+                best, best_score = fingerprint, score
+        return best, min(best_score, 1.0)
+
+    def classify(self, page_source, service, learn=True):
+        """Classify a page and learn its fingerprint.
+
+        Returns (state, fingerprint, is_new). Content rules decide first;
+        otherwise a page close enough to a known one takes its state, and
+        anything else is "unknown". A page is only called booked without
+        the marker if its layout was labelled so by hand: a booked layout
+        whose marker has disappeared may well be offering slots. With
+        ``learn`` False nothing is written, so several processes can
+        classify against the same store.
+        """
+        skeleton = parse_page(page_source)
+        fingerprint = fingerprint_of(skeleton.lines)
+        service_id = service.get("id")
+        with self.lock:
+            state = classify_by_rules(skeleton, page_source, service)
+            entry = self.fingerprints.get(fingerprint)
+            if state is None and entry is not None and is_inheritable(entry):
+                state = entry["state"]
+            nearest = None
+            if state is None or entry is None:
+                nearest, score = self.nearest(skeleton.lines, service_id)
+                if state is None:
+                    known = self.fingerprints.get(nearest)
+                    if known and is_inheritable(known) and score >= SIMILARITY_THRESHOLD:
+                        state = known["state"]
+                    else:
+                        state = "unknown"
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            is_new = entry is None
+            if not learn:
+                return state, fingerprint, is_new
+            if is_new:
+                entry = {"state": state, "service_id": service_id, "first_seen": now, "seen": 0,
+                         "nearest": nearest, "lines": len(skeleton.lines)}
+                self.fingerprints[fingerprint] = entry
+                self.write_snapshot(fingerprint, skeleton.lines, nearest)
+                print(f"New {state} page layout {fingerprint} for service {service_id}")
+            entry["seen"] += 1
+            entry["last_seen"] = now
+            self.save()
+        return state, fingerprint, is_new
+
+    def write_snapshot(self, fingerprint, lines, nearest):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with open(self.skeleton_path(fingerprint), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        self.skeletons[fingerprint] = lines
+        if nearest:
+            diff = difflib.unified_diff(self.skeleton(nearest), lines, nearest, fingerprint, lineterm="")
+            with open(os.path.join(self.snapshot_dir, f"{fingerprint}.diff"), 'w') as f:
+                f.write("\n".join(diff) + "\n")
+
+    def label(self, fingerprint, state):
+        """Set the state of a known fingerprint, e.g. after inspecting an unknown page"""
+        with self.lock:
+            self.fingerprints[fingerprint]["state"] = state
+            self.fingerprints[fingerprint]["labelled"] = True
+            self.save()
+
+def get_fingerprint_store():
+    """Return the shared fingerprint store, loading it on first use"""
+    global _store
+    if _store is None:
+        _store = FingerprintStore()
+    return _store
+
+def classify_page(page_source, service, learn=True):
+    """Classify a booking page; returns (state, fingerprint, is_new)"""
+    return get_fingerprint_store().classify(page_source, service, learn)
+
+def classify_booking_page(page_source, service):
+    """Classify a booking page as one of PAGE_STATES"""
+    return classify_page(page_source, service)[0]
+
+def main():
+    """List the known page fingerprints, or label one"""
+    parser = argparse.ArgumentParser(description="Known booking page fingerprints")
+    parser.add_argument("--label", nargs=2, metavar=("FINGERPRINT", "STATE"), help="set the state of a fingerprint")
+    args = parser.parse_args()
+
+    store = get_fingerprint_store()
+    if args.label:
+        fingerprint, state = args.label
+        if fingerprint not in store.fingerprints or state not in PAGE_STATES:
+            parser.error(f"unknown fingerprint or state (states: {', '.join(PAGE_STATES)})")
+        store.label(fingerprint, state)
+    for fingerprint, entry in sorted(store.fingerprints.items(), key=lambda item: item[1]["first_seen"]):
+        print(f"{fingerprint}  {entry['state']:<12} service {entry['service_id']}  "
+              f"seen {entry['seen']}x  {entry['first_seen']} .. {entry.get('last_seen')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import threading
+import time
+from datetime import datetime
+
+# The clock the scheduler and monitor read. The system clock is used in
+# production; simulate.py swaps in a SimulatedClock to run months of
+# scheduling in seconds.
+
+class SystemClock:
+    """Real time, with jobs running in threads"""
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        """Block until ``event`` is set or ``timeout`` seconds have passed"""
+        event.wait(timeout)
+
+    def start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
+
+class SimulatedClock:
+    """Time that only moves when something waits or sleeps.
+
+    Waiting advances the clock by the full timeout at once, and jobs run
+    inline instead of in threads, so a run is deterministic and takes no
+    real time.
+    """
+
+    def __init__(self, start):
+        self.current = start.timestamp() if isinstance(start, datetime) else float(start)
+
+    def time(self):
+        return self.current
+
+    def now(self):
+        return datetime.fromtimestamp(self.current)
+
+    def sleep(self, seconds):
+        self.current += max(0.0, seconds)
+
+    def wait(self, event, timeout):
+        if timeout is not None:
+            self.sleep(timeout)
+
+    def start_thread(self, target, name):
+        target()
+        return None
+
+# Clock in use, SystemClock unless replaced
+_clock = SystemClock()
+
+def get_clock():
+    """Return the clock in use"""
+    return _clock
+
+def set_clock(clock):
+    """Replace the clock, e.g. with a SimulatedClock; returns the previous one"""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
@@ -0,0 +1,241 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import secrets
+import threading
+import time
+
+from check_config import FULLY_BOOKED_MESSAGE
+
+# Local stand-in for prenotami.esteri.it, used for benchmarks and manual testing.
+#
+#   GET  /                          homepage with the login form
+#   POST /Account/Login             sets the session cookie
+#   GET  /Services                  services list (redirects to / when logged out)
+#   GET  /Services/Booking/<id>     booking page: booked, available or timeout
+#   GET  /Account/LogOff            ends the session
+#   GET  /__control?...             change variants at runtime (see FakeSiteState.update)
+
+DEFAULT_PORT = 8765
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title} - Prenot@Mi</title>
+<link rel="stylesheet" href="/static/site.css">
+</head>
+<body>
+<header><img src="/static/logo.png" alt="Prenot@Mi"><nav>{nav}</nav></header>
+<main>
+{content}
+</main>
+<footer>Ministero degli Affari Esteri e della Cooperazione Internazionale</footer>
+</body>
+</html>
+"""
+
+LOGIN_FORM = """<h1>Login</h1>
+<form method="post" action="/Account/Login">
+<label for="Email">Email</label><input type="email" id="Email" name="Email">
+<label for="Password">Password</label><input type="password" id="Password" name="Password">
+<button type="submit" class="btn btn-primary">FORWARD</button>
+</form>
+"""
+
+SERVICES_LIST = """<h1>Services</h1>
+<table id="dataTableServices">
+{rows}
+</table>
+"""
+
+BOOKED_CONTENT = """<h1>Booking</h1>
+<div class="alert">{message}</div>
+"""
+
+AVAILABLE_CONTENT = """<h1>Booking</h1>
+<form id="booking-form" method="post">
+<div id="datetimepicker" class="calendar">
+<div class="day available" data-date="2025-04-07">7</div>
+<div class="day available" data-date="2025-04-08">8</div>
+</div>
+<button type="submit" class="btn btn-primary">BOOK</button>
+</form>
+"""
+
+LOGGED_IN_NAV = '<a href="/Services">Services</a> <a href="/Account/LogOff">Logout</a>'
+
+# Static assets, sized roughly like the real site's so lean mode has something to block
+STATIC_ASSETS = {
+    "/static/site.css": ("text/css", b"body{font-family:sans-serif}\n" * 2000),
+    "/static/logo.png": ("image/png", b"\x89PNG\r\n\x1a\n" + b"\x00" * 60000),
+}
+
+class FakeSiteState:
+    """Mutable behaviour of the fake site, shared by all request handlers"""
+
+    def __init__(self, default_variant="booked", latency=0.0, timeout_delay=60.0):
+        self.lock = threading.Lock()
+        self.sessions = set()
+        # Booking page variant per service id; others use default_variant
+        self.booking_variants = {}
+        self.default_variant = default_variant
+        # "ok" or "timeout" for the homepage
+        self.home_variant = "ok"
+        # Extra delay added to every page, in seconds
+        self.latency = latency
+        # How long "timeout" pages hang before answering
+        self.timeout_delay = timeout_delay
+        self.request_count = 0
+
+    def booking_variant(self, service_id):
+        with self.lock:
+            return self.booking_variants.get(service_id, self.default_variant)
+
+    def update(self, params):
+        """Apply control parameters: default, service=<id>&variant=<v>, home, latency, reset_sessions"""
+        with self.lock:
+            if "default" in params:
+                self.default_variant = params["default"]
+            if "service" in params and "variant" in params:
+                self.booking_variants[params["service"]] = params["variant"]
+            if "home" in params:
+                self.home_variant = params["home"]
+            if "latency" in params:
+                self.latency = float(params["latency"])
+            if "reset_sessions" in params:
+                self.sessions.clear()
+
+class FakePrenotamiHandler(BaseHTTPRequestHandler):
+    """Serve the fake site; the state lives on the server object"""
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def session_token(self):
+        for part in self.headers.get("Cookie", "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "session":
+                return value
+        return None
+
+    def is_logged_in(self):
+        return self.session_token() in self.state.sessions
+
+    def send_page(self, title, content, logged_in=False, status=200):
+        body = PAGE_TEMPLATE.format(title=title, content=content,
+                                    nav=LOGGED_IN_NAV if logged_in else "").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location, cookie=None):
+        self.send_response(302)
+        self.send_header("Location", location)
+        if cookie is not None:
+            self.send_header("Set-Cookie", cookie)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        with self.state.lock:
+            self.state.request_count += 1
+        url = urlparse(self.path)
+        path = url.path.rstrip("/") or "/"
+
+        if path in STATIC_ASSETS:
+            content_type, body = STATIC_ASSETS[path]
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "max-age=86400")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if path == "/__control":
+            self.state.update({k: v[0] for k, v in parse_qs(url.query).items()})
+            self.send_page("Control", "<p>ok</p>")
+            return
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if path == "/":
+            if self.state.home_variant == "timeout":
+                time.sleep(self.state.timeout_delay)
+            if self.is_logged_in():
+                self.send_page("Home", "<h1>Welcome</h1>", logged_in=True)
+            else:
+                self.send_page("Home", LOGIN_FORM)
+        elif path == "/Account/LogOff":
+            with self.state.lock:
+                self.state.sessions.discard(self.session_token())
+            self.redirect("/", cookie="session=; Path=/; Max-Age=0")
+        elif not self.is_logged_in():
+            self.redirect("/")
+        elif path == "/Services":
+            rows = "\n".join(f'<tr><td>Service {i}</td><td><a href="/Services/Booking/{i}">BOOK</a></td></tr>'
+                             for i in (1151, 1258))
+            self.send_page("Services", SERVICES_LIST.format(rows=rows), logged_in=True)
+        elif path.startswith("/Services/Booking/"):
+            variant = self.state.booking_variant(path.rsplit("/", 1)[-1])
+            if variant == "timeout":
+                time.sleep(self.state.timeout_delay)
+                self.send_page("Booking", BOOKED_CONTENT.format(message=FULLY_BOOKED_MESSAGE), logged_in=True)
+            elif variant == "available":
+                self.send_page("Booking", AVAILABLE_CONTENT, logged_in=True)
+            else:
+                self.send_page("Booking", BOOKED_CONTENT.format(message=FULLY_BOOKED_MESSAGE), logged_in=True)
+        else:
+            self.send_page("Not found", "<h1>Not found</h1>", status=404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if url.path == "/Account/Login" and form.get("Email") and form.get("Password"):
+            token = secrets.token_hex(16)
+            with self.state.lock:
+                self.state.sessions.add(token)
+            self.redirect("/Services", cookie=f"session={token}; Path=/; HttpOnly")
+        else:
+            self.send_page("Login", LOGIN_FORM, status=200)
+
+def start_fake_server(port=0, state=None):
+    """Start the fake site in a background thread and return the server.
+
+    The base URL is ``f"http://127.0.0.1:{server.server_port}"``.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakePrenotamiHandler)
+    server.daemon_threads = True
+    server.state = state or FakeSiteState()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    """Run the fake site from the command line"""
+    parser = argparse.ArgumentParser(description="Local stand-in for prenotami.esteri.it")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--variant", default="booked", choices=["booked", "available", "timeout"],
+                        help="booking page variant for every service")
+    parser.add_argument("--latency", type=float, default=0.0, help="extra delay per page in seconds")
+    args = parser.parse_args()
+
+    server = start_fake_server(args.port, FakeSiteState(args.variant, args.latency))
+    print(f"Fake prenotami running at http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
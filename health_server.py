@@ -0,0 +1,177 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from history import get_history
+from metrics import read_recent_metrics, phase_percentiles
+from notifier import get_notifier
+from process_tree import tree_rss_bytes
+
+# Local health and metrics endpoint of the scheduler.
+#
+#   GET /healthz   JSON status; 200 when ok, 503 when stalled or degraded
+#   GET /metrics   the same figures in the Prometheus text format
+
+# A check is stalled when it runs this long past its deadline, or the
+# next check is this late
+STALL_GRACE = 5 * 60
+# Degraded when fewer checks than this succeeded over the window
+MIN_SUCCESS_RATE = 0.5
+SUCCESS_WINDOW_HOURS = 24
+# Degraded when this many notifications are waiting to be delivered
+MAX_QUEUE_DEPTH = 20
+# Checks from the metrics file used for the phase percentiles
+PERCENTILE_CHECKS = 200
+
+class HealthMonitor:
+    """Collect the health of a running CheckScheduler"""
+
+    def __init__(self, scheduler, browser, check_deadline):
+        self.scheduler = scheduler
+        self.browser = browser
+        self.check_deadline = check_deadline
+
+    def chrome_rss_bytes(self):
+        pid = self.browser.pid() if self.browser is not None else None
+        return tree_rss_bytes(pid) if pid else 0
+
+    def health(self):
+        """Return the health report as a dict"""
+        now = time.time()
+        state = self.scheduler.state
+        running = self.scheduler.check_lock.locked()
+        history = get_history()
+        last_check = history.last_check()
+        since = (datetime.now() - timedelta(hours=SUCCESS_WINDOW_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+        stats = history.check_stats(since)
+        success_rate = stats["completed"] / stats["checks"] if stats["checks"] else None
+        queue_depth = get_notifier().queue_depth()
+
+        role = self.scheduler.role()
+        problems = []
+        stalled = False
+        last_check_at = state.get("last_check_at")
+        next_check_at = state.get("next_check_at")
+        if role == "standby":
+            # A standby runs no checks; only its own liveness matters
+            last_check, stats, success_rate = None, {"checks": 0}, None
+        if running and last_check_at and now - last_check_at > self.check_deadline + STALL_GRACE:
+            stalled = True
+            problems.append(f"check running for {int(now - last_check_at)}s")
+        if not running and next_check_at and now - next_check_at > STALL_GRACE:
+            stalled = True
+            problems.append(f"next check overdue by {int(now - next_check_at)}s")
+        if last_check is not None and not last_check["completed"]:
+            problems.append(f"last check failed ({last_check['error_class']})")
+        if success_rate is not None and stats["checks"] >= 2 and success_rate < MIN_SUCCESS_RATE:
+            problems.append(f"success rate {success_rate:.0%} over {SUCCESS_WINDOW_HOURS}h")
+        if queue_depth > MAX_QUEUE_DEPTH:
+            problems.append(f"{queue_depth} notifications waiting")
+
+        return {
+            "status": "stalled" if stalled else ("degraded" if problems else "ok"),
+            "problems": problems,
+            "role": role,
+            "check_running": running,
+            "last_check": last_check,
+            "last_check_started_at": last_check_at,
+            "next_check_at": next_check_at,
+            "checks_window_hours": SUCCESS_WINDOW_HOURS,
+            "checks_in_window": stats["checks"],
+            "success_rate": success_rate,
+            "notifier_queue_depth": queue_depth,
+            "chrome_rss_bytes": self.chrome_rss_bytes(),
+            "phase_latency_seconds": phase_percentiles(read_recent_metrics(PERCENTILE_CHECKS)),
+        }
+
+    def prometheus(self, health=None):
+        """Return the health report in the Prometheus text format"""
+        health = health or self.health()
+        last_check = health["last_check"] or {}
+        lines = []
+
+        def gauge(name, help_text, value, labels=None):
+            if value is None:
+                return
+            if not labels:
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+            label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+            lines.append(f"{name}{label_text} {value}")
+
+        gauge("prenotami_scheduler_healthy", "1 when the scheduler is neither stalled nor degraded.",
+              1 if health["status"] == "ok" else 0)
+        gauge("prenotami_scheduler_stalled", "1 when a check is stuck or overdue.",
+              1 if health["status"] == "stalled" else 0)
+        gauge("prenotami_scheduler_check_running", "1 while a check is running.", int(health["check_running"]))
+        gauge("prenotami_scheduler_leader", "1 when this node runs the checks (leader or running alone).",
+              0 if health["role"] == "standby" else 1)
+        if last_check.get("started_at"):
+            started = datetime.strptime(last_check["started_at"], "%Y-%m-%d %H:%M:%S").timestamp()
+            gauge("prenotami_scheduler_last_check_timestamp_seconds", "Unix time the last recorded check started.",
+                  int(started))
+            gauge("prenotami_scheduler_last_check_completed", "Whether the last recorded check completed.",
+                  last_check["completed"])
+            gauge("prenotami_scheduler_last_check_available", "Whether the last recorded check found slots.",
+                  last_check["available"])
+        if health["next_check_at"]:
+            gauge("prenotami_scheduler_next_check_timestamp_seconds", "Unix time of the next scheduled check.",
+                  int(health["next_check_at"]))
+        gauge("prenotami_scheduler_checks_window", "Checks recorded in the success-rate window.",
+              health["checks_in_window"])
+        if health["success_rate"] is not None:
+            gauge("prenotami_scheduler_success_ratio", "Share of completed checks in the success-rate window.",
+                  round(health["success_rate"], 4))
+        gauge("prenotami_notifier_queue_depth", "Notifications waiting to be delivered.",
+              health["notifier_queue_depth"])
+        gauge("prenotami_chrome_rss_bytes", "Resident memory of the warm browser's process tree.",
+              health["chrome_rss_bytes"])
+
+        lines += [
+            "# HELP prenotami_check_phase_latency_seconds Phase duration percentiles over recent checks.",
+            "# TYPE prenotami_check_phase_latency_seconds gauge",
+        ]
+        for phase, stats in sorted(health["phase_latency_seconds"].items()):
+            for key, value in stats.items():
+                if key.startswith("p") and value is not None:
+                    quantile = int(key[1:]) / 100
+                    gauge("prenotami_check_phase_latency_seconds", "", value, {"phase": phase, "quantile": quantile})
+        return "\n".join(lines) + "\n"
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """Serve /healthz and /metrics; the monitor lives on the server object"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, content_type, body):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        try:
+            if path == "/healthz":
+                health = self.server.monitor.health()
+                self.send_body(200 if health["status"] == "ok" else 503, "application/json",
+                               json.dumps(health, default=str))
+            elif path == "/metrics":
+                self.send_body(200, "text/plain; version=0.0.4", self.server.monitor.prometheus())
+            else:
+                self.send_body(404, "text/plain", "not found\n")
+        except Exception as e:
+            self.send_body(500, "text/plain", f"{type(e).__name__}: {e}\n")
+
+def start_health_server(monitor, host="127.0.0.1", port=8787):
+    """Serve the monitor's health in a background thread and return the server"""
+    server = ThreadingHTTPServer((host, port), HealthHandler)
+    server.daemon_threads = True
+    server.monitor = monitor
+    thread = threading.Thread(target=server.serve_forever, name="health", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,249 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# Check history database
+HISTORY_DB = os.path.join(ARTIFACTS_DIR, "history.db")
+# Legacy counters file, imported once
+LEGACY_STATUS_FILE = os.path.join(ARTIFACTS_DIR, "daily_status.json")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checks (
+    check_id TEXT PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    day TEXT NOT NULL,
+    duration REAL,
+    completed INTEGER NOT NULL,
+    available INTEGER NOT NULL,
+    error_class TEXT,
+    source TEXT NOT NULL DEFAULT 'live'
+);
+CREATE INDEX IF NOT EXISTS idx_checks_day ON checks(day);
+
+CREATE TABLE IF NOT EXISTS service_results (
+    check_id TEXT NOT NULL REFERENCES checks(check_id),
+    service_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    checked_at TEXT NOT NULL,
+    day TEXT NOT NULL,
+    duration REAL,
+    method TEXT,
+    error_class TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_service_results_service_day ON service_results(service_id, day);
+CREATE INDEX IF NOT EXISTS idx_service_results_day ON service_results(day);
+
+CREATE TABLE IF NOT EXISTS legacy_days (
+    day TEXT PRIMARY KEY,
+    checks INTEGER NOT NULL,
+    last_available_date TEXT
+);
+
+CREATE TABLE IF NOT EXISTS backfill_files (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    processed_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Shared store, opened on first use
+_history = None
+
+class HistoryStore:
+    """Every check and per-service result, stored in SQLite.
+
+    Each operation opens its own connection, so the store can be used from
+    any thread. Writes happen in a single transaction each, and WAL mode
+    keeps readers from blocking the writer.
+    """
+
+    def __init__(self, path=HISTORY_DB, legacy_status_file=LEGACY_STATUS_FILE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self.import_legacy_status(legacy_status_file)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def import_legacy_status(self, status_file=LEGACY_STATUS_FILE):
+        """Import the old daily_status.json counters the first time the store is opened"""
+        with closing(self.connect()) as conn, conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return
+            try:
+                with open(status_file, 'r') as f:
+                    status = json.load(f)
+                if status.get("date"):
+                    conn.execute("INSERT OR REPLACE INTO legacy_days (day, checks, last_available_date) VALUES (?, ?, ?)",
+                                 (status["date"], status.get("checks_today", 0), status.get("last_available_date")))
+                    print(f"Imported {status_file} into the check history")
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+            conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', '1')")
+
+    def record_check(self, result, source="live"):
+        """Store a finished check (a run_check() result) and its service records atomically"""
+        self.record_checks([result], source)
+
+    def record_checks(self, results, source="live"):
+        """Store several finished checks in one transaction"""
+        with closing(self.connect()) as conn, conn:
+            for result in results:
+                self.insert_check(conn, result, source)
+
+    def insert_check(self, conn, result, source):
+        day = result["started_at"][:10]
+        conn.execute(
+            "INSERT OR REPLACE INTO checks (check_id, started_at, day, duration, completed, available, error_class, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (result["check_id"], result["started_at"], day, result["duration"], int(result["completed"]),
+             int(result["available_service"] is not None), result["error_class"], source))
+        conn.execute("DELETE FROM service_results WHERE check_id = ?", (result["check_id"],))
+        conn.executemany(
+            "INSERT INTO service_results (check_id, service_id, status, checked_at, day, duration, method, error_class) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(result["check_id"], str(r["service_id"]), r["status"], r["started_at"], r["started_at"][:10],
+              r["duration"], r.get("method"), r["error_class"]) for r in result["records"]])
+
+    def checks_on(self, day):
+        """Return the checks of one day, oldest first"""
+        with closing(self.connect()) as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM checks WHERE day = ? ORDER BY started_at", (day,))]
+
+    def check_start_times(self, source="live"):
+        """Return the start times of all checks from one source, oldest first"""
+        with closing(self.connect()) as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT started_at FROM checks WHERE source = ? ORDER BY started_at", (source,))]
+
+    def reclassify_service(self, service_id, status, check_id=None, checked_at=None, window_seconds=900):
+        """Change the status of a service result after re-reading its page.
+
+        The result is found by ``check_id``, or else as the latest result of
+        the service that claimed slots in the ``window_seconds`` up to
+        ``checked_at``. The check's ``available`` flag follows. Returns
+        True when a result changed.
+        """
+        with closing(self.connect()) as conn, conn:
+            if check_id is not None:
+                row = conn.execute("SELECT rowid, check_id, status FROM service_results WHERE check_id = ? AND service_id = ?",
+                                   (check_id, str(service_id))).fetchone()
+            else:
+                since = (datetime.strptime(checked_at, "%Y-%m-%d %H:%M:%S")
+                         - timedelta(seconds=window_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+                row = conn.execute(
+                    "SELECT rowid, check_id, status FROM service_results WHERE service_id = ? AND checked_at BETWEEN ? AND ? "
+                    "AND status IN ('available', 'unknown') ORDER BY checked_at DESC LIMIT 1",
+                    (str(service_id), since, checked_at)).fetchone()
+            if row is None or row["status"] == status:
+                return False
+            conn.execute("UPDATE service_results SET status = ? WHERE rowid = ?", (status, row["rowid"]))
+            conn.execute("UPDATE checks SET available = EXISTS (SELECT 1 FROM service_results "
+                         "WHERE check_id = ? AND status = 'available') WHERE check_id = ?",
+                         (row["check_id"], row["check_id"]))
+            return True
+
+    def backfilled_sources(self):
+        """Return {source: (size, mtime)} for every archive file already backfilled"""
+        with closing(self.connect()) as conn:
+            return {row["source"]: (row["size"], row["mtime"]) for row in conn.execute("SELECT * FROM backfill_files")}
+
+    def mark_backfilled(self, sources):
+        """Remember archive files as backfilled; ``sources`` holds (source, size, mtime) tuples"""
+        processed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with closing(self.connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO backfill_files (source, size, mtime, processed_at) VALUES (?, ?, ?, ?)",
+                             [(source, size, mtime, processed_at) for source, size, mtime in sources])
+
+    def last_check(self):
+        """Return the most recent check, or None"""
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT * FROM checks ORDER BY started_at DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
+
+    def check_stats(self, since):
+        """Count checks, completed checks and checks with slots started at or after ``since``"""
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS checks, COALESCE(SUM(completed), 0) AS completed, "
+                "COALESCE(SUM(available), 0) AS available FROM checks WHERE started_at >= ?", (since,)).fetchone()
+        return dict(row)
+
+    def service_history(self, service_id, since_day=None):
+        """Return the results of one service, optionally from a given day on"""
+        with closing(self.connect()) as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM service_results WHERE service_id = ? AND day >= ? ORDER BY checked_at",
+                (str(service_id), since_day or ""))]
+
+    def availability_by_hour(self, since_day=None):
+        """Count checks and checks that found slots per (weekday, hour).
+
+        Weekdays follow SQLite's ``%w``: 0 is Sunday.
+        """
+        with closing(self.connect()) as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT CAST(strftime('%w', started_at) AS INTEGER) AS weekday, "
+                "CAST(strftime('%H', started_at) AS INTEGER) AS hour, "
+                "COUNT(*) AS checks, SUM(available) AS available "
+                "FROM checks WHERE completed = 1 AND day >= ? GROUP BY weekday, hour",
+                (since_day or "",))]
+
+    def last_available_date(self):
+        """Return the last day any service had slots, including the imported legacy date"""
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT MAX(day) FROM service_results WHERE status = 'available'").fetchone()
+            legacy = conn.execute("SELECT MAX(last_available_date) FROM legacy_days").fetchone()
+        dates = [d for d in (row[0], legacy[0]) if d]
+        return max(dates) if dates else None
+
+    def daily_summary(self, day):
+        """Compute the summary of one day from the recorded checks"""
+        with closing(self.connect()) as conn:
+            totals = conn.execute(
+                "SELECT COUNT(*) AS checks, COALESCE(SUM(completed), 0) AS completed, "
+                "COALESCE(SUM(available), 0) AS available, AVG(duration) AS mean_duration "
+                "FROM checks WHERE day = ?", (day,)).fetchone()
+            legacy = conn.execute("SELECT checks FROM legacy_days WHERE day = ?", (day,)).fetchone()
+            services = {}
+            for row in conn.execute(
+                    "SELECT service_id, status, COUNT(*) AS count FROM service_results "
+                    "WHERE day = ? GROUP BY service_id, status", (day,)):
+                services.setdefault(row["service_id"], {})[row["status"]] = row["count"]
+
+        legacy_checks = legacy["checks"] if legacy else 0
+        return {
+            "day": day,
+            "checks": totals["checks"] + legacy_checks,
+            "completed": totals["completed"] + legacy_checks,
+            "failed": totals["checks"] - totals["completed"],
+            "available_checks": totals["available"],
+            "mean_duration": totals["mean_duration"],
+            "services": services,
+            "last_available_date": self.last_available_date(),
+        }
+
+def get_history():
+    """Return the shared history store, opening it on first use"""
+    global _history
+    if _history is None:
+        _history = HistoryStore()
+    return _history
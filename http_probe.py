@@ -0,0 +1,66 @@
+import requests
+from requests.adapters import HTTPAdapter
+from classifier import classify_booking_page
+
+# Number of keep-alive connections kept open to the site
+POOL_SIZE = 4
+
+# Reused between checks so the keep-alive connections survive in the scheduler
+_probe = None
+
+class HttpProbe:
+    """Fetch booking pages as plain HTTP using the browser's session cookies"""
+
+    def __init__(self, base_url, user_agent, timeout=15):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "User-Agent": user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9",
+        })
+
+    def load_cookies(self, driver):
+        """Copy the authenticated cookies from the browser"""
+        self.session.cookies.clear()
+        for cookie in driver.get_cookies():
+            self.session.cookies.set(cookie["name"], cookie["value"],
+                                     domain=cookie.get("domain"), path=cookie.get("path", "/"))
+
+    def check_booking_page(self, service_config):
+        """Classify a booking page over HTTP.
+
+        Returns "booked" when the page is a normal fully-booked page, or None
+        when the browser should check it instead: on errors, redirects (e.g.
+        to the login page), a login form in the body, or a possible
+        availability, which is always confirmed in the browser.
+        """
+        url = f"{self.base_url}/Services/Booking/{service_config['id']}"
+        try:
+            response = self.session.get(url, timeout=self.timeout, allow_redirects=False)
+        except requests.RequestException as e:
+            print(f"HTTP probe of {url} failed: {e}")
+            return None
+
+        if response.status_code != 200:
+            print(f"HTTP probe of {url} returned {response.status_code}, falling back to the browser")
+            return None
+        body = response.text
+        if "name=\"Password\"" in body or "id=\"Password\"" in body:
+            print(f"HTTP probe of {url} landed on the login form, falling back to the browser")
+            return None
+        if classify_booking_page(body, service_config) != "booked":
+            print(f"HTTP probe of {url} found no booked marker, confirming in the browser")
+            return None
+        return "booked"
+
+def get_http_probe(base_url, user_agent):
+    """Return the shared HTTP probe, creating it on first use"""
+    global _probe
+    if _probe is None or _probe.base_url != base_url:
+        _probe = HttpProbe(base_url, user_agent)
+    return _probe
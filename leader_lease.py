@@ -0,0 +1,301 @@
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+from check_config import load_check_config
+
+# Leader election between redundant schedulers through a lease in a shared
+# SQLite file. Only the node holding the lease runs checks; the others stay
+# on standby and try to take the lease over every renew interval (a third
+# of the TTL). The leader renews at the same interval, so a dead leader's
+# lease runs out after at most one TTL and a standby holds it one renew
+# interval later.
+#
+# The lease times are wall-clock times, so hosts sharing a lease must keep
+# their clocks in sync (NTP) to well within the TTL. The file must live on a
+# filesystem with working locks; SQLite over NFS is not one.
+#
+# The same file de-duplicates alerts: a node sends an alert only if it can
+# claim the alert's key, so redundant nodes never send the same message twice.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    term INTEGER NOT NULL,
+    acquired_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    value REAL,
+    updated_by TEXT,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS alert_claims (
+    key TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    claimed_at REAL NOT NULL
+);
+"""
+
+DEFAULT_LEASE_NAME = "scheduler"
+# Outcomes of claiming an alert: first claim, a repeat of this node's own alert, or sent by another node
+ALERT_CLAIMED = "claimed"
+ALERT_REPEATED = "repeated"
+ALERT_DUPLICATE = "duplicate"
+# A lease is treated as lost this long before it actually expires, to allow for a slow renewal
+SAFETY_MARGIN = 0.1
+
+# Shared lease built from the check configuration, created on first use
+_lease = None
+_lease_loaded = False
+
+def default_node_id():
+    """This host and process, unique among the nodes sharing a lease"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class LeaderLease:
+    """A named lease in a shared SQLite file; at most one node holds it.
+
+    ``try_acquire()`` takes the lease if it is free or expired and renews
+    it if this node already holds it. Every change of holder increments
+    the lease's term, so a node can tell whether it lost the lease in
+    between. All operations are single transactions that take the write
+    lock up front, so they are safe across processes and hosts.
+    """
+
+    def __init__(self, path, node_id=None, ttl=60, name=DEFAULT_LEASE_NAME):
+        self.path = path
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.name = name
+        self.renew_interval = ttl / 3
+        self.term = None
+        # Local monotonic time until which this node may act as leader
+        self.valid_until = 0.0
+        # The elector thread and the scheduler both renew the lease
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with closing(self.connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        # Autocommit mode, so BEGIN IMMEDIATE controls the transactions
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def try_acquire(self):
+        """Take or renew the lease; returns True if this node holds it afterwards"""
+        with self.lock:
+            return self.acquire_locked()
+
+    def acquire_locked(self):
+        started = time.monotonic()
+        now = time.time()
+        try:
+            with closing(self.connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute("SELECT * FROM leases WHERE name = ?", (self.name,)).fetchone()
+                    if row is not None and row["holder"] != self.node_id and row["expires_at"] > now:
+                        conn.execute("ROLLBACK")
+                        self.valid_until = 0.0
+                        return False
+                    if row is not None and row["holder"] == self.node_id and row["term"] == self.term:
+                        term, acquired_at = row["term"], row["acquired_at"]
+                    else:
+                        term, acquired_at = (row["term"] + 1 if row is not None else 1), now
+                    conn.execute("INSERT OR REPLACE INTO leases (name, holder, term, acquired_at, expires_at) "
+                                 "VALUES (?, ?, ?, ?, ?)", (self.name, self.node_id, term, acquired_at, now + self.ttl))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            # Without the shared file nobody can prove it leads; run out the lease we have
+            print(f"Could not reach the lease file {self.path}: {e}")
+            return self.is_leader()
+        self.term = term
+        self.valid_until = started + self.ttl * (1 - SAFETY_MARGIN)
+        return True
+
+    def is_leader(self):
+        """Whether this node holds an unexpired lease, by its own clock"""
+        return time.monotonic() < self.valid_until
+
+    def release(self):
+        """Give up the lease at once, so a standby need not wait for it to expire"""
+        with self.lock:
+            self.valid_until = 0.0
+            try:
+                with closing(self.connect()) as conn:
+                    # Expire rather than delete, so the term keeps counting up
+                    conn.execute("UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ? AND term = ?",
+                                 (self.name, self.node_id, self.term))
+            except sqlite3.Error as e:
+                print(f"Could not release the lease: {e}")
+
+    def holder(self):
+        """Return the current lease as a dict, or None if nobody holds it"""
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT * FROM leases WHERE name = ?", (self.name,)).fetchone()
+        if row is None or row["expires_at"] <= time.time():
+            return None
+        return dict(row)
+
+    def set_shared(self, key, value):
+        """Publish a value to every node, e.g. the next planned check"""
+        with closing(self.connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO shared_state (key, value, updated_by, updated_at) VALUES (?, ?, ?, ?)",
+                         (key, value, self.node_id, time.time()))
+
+    def get_shared(self, key):
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row is not None else None
+
+    def claim_alert(self, key, window):
+        """Claim the right to send an alert.
+
+        Returns ALERT_DUPLICATE if another node claimed the key in the last
+        ``window`` seconds, ALERT_REPEATED if this node did (its own
+        repeats are sent again), and ALERT_CLAIMED otherwise.
+        """
+        now = time.time()
+        try:
+            with closing(self.connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT node, claimed_at FROM alert_claims WHERE key = ?", (key,)).fetchone()
+                outcome = ALERT_CLAIMED
+                if row is not None and now - row["claimed_at"] < window:
+                    if row["node"] != self.node_id:
+                        conn.execute("ROLLBACK")
+                        return ALERT_DUPLICATE
+                    outcome = ALERT_REPEATED
+                conn.execute("INSERT OR REPLACE INTO alert_claims (key, node, claimed_at) VALUES (?, ?, ?)",
+                             (key, self.node_id, now))
+                # Old claims only matter within their window
+                conn.execute("DELETE FROM alert_claims WHERE claimed_at < ?", (now - 7 * 24 * 3600,))
+                conn.execute("COMMIT")
+                return outcome
+        except sqlite3.Error as e:
+            # A duplicate alert is better than a missed one
+            print(f"Could not claim alert {key}: {e}")
+            return ALERT_CLAIMED
+
+class LeaderElector:
+    """Keep trying to take or renew a lease in a background thread.
+
+    ``on_elected`` and ``on_demoted`` are called from the thread when this
+    node's role changes.
+    """
+
+    def __init__(self, lease, on_elected=None, on_demoted=None):
+        self.lease = lease
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.leader = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="leader-elector", daemon=True)
+
+    def start(self):
+        self.step()
+        self.thread.start()
+        return self
+
+    def step(self):
+        leader = self.lease.try_acquire()
+        if leader and not self.leader:
+            print(f"Node {self.lease.node_id} is now the leader (term {self.lease.term})")
+            if self.on_elected:
+                self.on_elected()
+        elif not leader and self.leader:
+            print(f"Node {self.lease.node_id} lost the lease, standing by")
+            if self.on_demoted:
+                self.on_demoted()
+        self.leader = leader
+
+    def run(self):
+        while not self.stopped.wait(self.lease.renew_interval):
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Leader election error: {e}")
+
+    def stop(self, release=True):
+        """Stop the elector, handing the lease over at once unless ``release`` is False"""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if release and self.leader:
+            self.lease.release()
+        self.leader = False
+
+def lease_from_config(config):
+    """Build the lease described by a check configuration, or None if coordination is off"""
+    if not config.get("lease_db"):
+        return None
+    return LeaderLease(config["lease_db"], config.get("node_id"), config["lease_ttl"])
+
+def get_lease():
+    """Return the shared lease from check_config.json, or None if coordination is off"""
+    global _lease, _lease_loaded
+    if not _lease_loaded:
+        _lease = lease_from_config(load_check_config())
+        _lease_loaded = True
+    return _lease
+
+def claim_alert(key, window=None):
+    """Claim the alert with the given key; see LeaderLease.claim_alert (always ALERT_CLAIMED without a lease)"""
+    lease = get_lease()
+    if lease is None:
+        return ALERT_CLAIMED
+    if window is None:
+        window = load_check_config()["alert_dedup_seconds"]
+    return lease.claim_alert(key, window)
+
+def main():
+    """Show the lease holder, or run a node that only takes part in the election (for testing)"""
+    parser = argparse.ArgumentParser(description="Leader lease shared by redundant schedulers")
+    parser.add_argument("--db", help="lease file (default: lease_db from check_config.json)")
+    parser.add_argument("--node", help="node id (default: host:pid)")
+    parser.add_argument("--ttl", type=float, default=None, help="lease TTL in seconds")
+    parser.add_argument("--run", action="store_true", help="join the election and print role changes until killed")
+    args = parser.parse_args()
+
+    config = load_check_config()
+    path = args.db or config["lease_db"]
+    if not path:
+        parser.error("no lease file: pass --db or set lease_db in check_config.json")
+    lease = LeaderLease(path, args.node or config["node_id"], args.ttl or config["lease_ttl"])
+    if not args.run:
+        holder = lease.holder()
+        if holder is None:
+            print("No node holds the lease")
+        else:
+            print(f"{holder['holder']} leads (term {holder['term']}) since "
+                  f"{datetime.fromtimestamp(holder['acquired_at']).strftime('%Y-%m-%d %H:%M:%S')}, "
+                  f"lease expires in {holder['expires_at'] - time.time():.1f}s")
+        return
+    elector = LeaderElector(lease).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elector.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,32 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium_stealth import stealth
+from browser_service import (attach_to_browser_service, start_driver, apply_stealth, apply_lean, page_transfer_bytes,
+                             PROFILE_DIR, USER_AGENT)
+from browser_supervisor import BrowserSupervisor, reap_orphans, service_pid
+from check_config import load_check_config, get_services
+from classifier import classify_page
+from http_probe import get_http_probe
+from artifact_store import begin_check, capture_screenshot, capture_html, flush as flush_artifacts
+from metrics import span, record_span, start_check_metrics, finish_check_metrics
+from pacing import configure as configure_pacing, pause
+from waterfall import begin_check as begin_profiling, start_page_load, capture_page_load
+from retry_policy import CheckBudget, backoff_delay, failure_action
+from readiness import (wait_for_login_result, wait_for_services_list, wait_for_booking_result, booking_condition,
+                       is_document_complete)
+from session_store import restore_session, save_session, clear_session, is_logged_in
+import shutil
 import time
+from contextlib import closing
 import json
-import random
-from tempfile import mkdtemp
 import os
+import sys
+from datetime import datetime
 
 # Define artifacts directory
 ARTIFACTS_DIR = "artifacts"
+# Machine-readable result records, one JSON object per line
+RESULTS_FILE = os.path.join(ARTIFACTS_DIR, "check_results.jsonl")
 
 # Function to ensure the artifacts directory exists
 def ensure_artifacts_dir():
@@ -22,45 +35,57 @@ def ensure_artifacts_dir():
         os.makedirs(ARTIFACTS_DIR)
         print(f"Created artifacts directory: {ARTIFACTS_DIR}")
 
-# Function to add random delays between actions
-def human_delay():
-    time.sleep(random.uniform(1.0, 3.0))
-
 # Function to navigate to a URL with timeout handling
-def navigate_with_timeout(driver, url, timeout=30):
+def navigate_with_timeout(driver, url, timeout=30, phase="navigate", **tags):
     """Navigate to a URL with timeout handling and retry mechanism"""
     print(f"Navigating to {url} with {timeout} second timeout...")
     
     # Set page load timeout
     driver.set_page_load_timeout(timeout)
+    start_page_load(driver)
+    start_time = time.monotonic()
     
-    try:
-        driver.get(url)
-        return True
-    except Exception as e:
-        print(f"Timeout or error accessing {url}: {e}")
-        # Try to cancel navigation by executing JavaScript
+    with span(phase, **tags) as phase_tags:
         try:
-            driver.execute_script("window.stop();")
-        except:
-            pass
-        return False
+            driver.get(url)
+            phase_tags["bytes"] = page_transfer_bytes(driver)
+            capture_page_load(driver, phase, url, time.monotonic() - start_time, **tags)
+            return True
+        except Exception as e:
+            print(f"Timeout or error accessing {url}: {e}")
+            phase_tags["timed_out"] = True
+            phase_tags["error_class"] = type(e).__name__
+            # Record which requests were still open before cancelling them
+            capture_page_load(driver, phase, url, time.monotonic() - start_time, True, **tags)
+            # Try to cancel navigation by executing JavaScript
+            try:
+                driver.execute_script("window.stop();")
+            except:
+                pass
+            return False
+
+# Function to capture a screenshot under the capture policy, returns its stored path or None
+def save_screenshot(driver, name, kind="step", **info):
+    with span("screenshot_write"):
+        return capture_screenshot(driver, name, kind, **info)
 
 # Function to attempt logout and re-login - now it just logs out without recreating driver
-def logout_and_retry(driver):
+def logout_and_retry(driver, config, timeout=15):
     """Attempt to logout without recreating the driver"""
     print("Attempting to logout...")
+    # The saved session is no longer valid after logging out
+    clear_session()
     
     try:
         # Cancel any ongoing requests
         driver.execute_script("window.stop();")
         
         # Navigate to logout page with timeout
-        logout_success = navigate_with_timeout(driver, "https://prenotami.esteri.it/Account/LogOff", 15)
+        logout_success = navigate_with_timeout(driver, f"{config['base_url']}/Account/LogOff", timeout, phase="logout")
         
         if logout_success:
             print("Logout successful")
-            human_delay()
+            pause("between_pages")
             return True
         else:
             print("Logout timed out")
@@ -78,279 +103,679 @@ def read_credentials(file_path="credentials.json"):
             return credentials.get('email'), credentials.get('password')
     except FileNotFoundError:
         print(f"Error: Credentials file '{file_path}' not found.")
-        exit(1)
+        return None, None
     except json.JSONDecodeError:
         print(f"Error: Credentials file '{file_path}' is not valid JSON.")
-        exit(1)
+        return None, None
     except Exception as e:
         print(f"Error reading credentials: {e}")
-        exit(1)
+        return None, None
+
+# Function to create a new driver, attaching to the warm browser service when it is running.
+# Returns (driver, service, temp_dir, service_lock); temp_dir is None for attached and lean
+# browsers, and service_lock (held until the check is done) is None unless attached.
+def create_new_driver(lean=False, profiling=False):
+    service_browser = attach_to_browser_service(profiling)
+    if service_browser:
+        # No temp dir: the profile belongs to the browser service
+        driver, service, service_lock = service_browser
+        return driver, service, None, service_lock
+    driver, service, temp_dir = start_driver(lean=lean, profiling=profiling)
+    return driver, service, temp_dir, None
+
+# Function to fill in the login form, returns False if the form could not be found
+def fill_login_form(driver, email, password, attempt):
+    print("Looking for email field...")
+    try:
+        email_field = WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.XPATH, "//input[@id='Email' or @name='Email']"))
+        )
+    except Exception as e:
+        print(f"Error finding email field: {e}")
+        save_screenshot(driver, f"login_error_attempt_{attempt}", "error")
+        return False
+        
+    print("Found email field, filling form...")
+    email_field.clear()
+    pause("typing")
+    # Type email character by character like a human
+    for char in email:
+        email_field.send_keys(char)
+        pause("keystroke")
+    
+    pause("typing")
+    
+    print("Looking for password field...")
+    password_field = WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.XPATH, "//input[@id='Password' or @name='Password']"))
+    )
+    password_field.clear()
+    pause("typing")
+    # Type password character by character
+    for char in password:
+        password_field.send_keys(char)
+        pause("keystroke")
+        
+    pause("typing")
+    
+    save_screenshot(driver, f"form_filled_attempt_{attempt}")
+    print("Form filled, saved screenshot")
+    return True
+
+# Function to click the FORWARD button, trying several strategies
+def click_login_button(driver):
+    print("Attempting to click login button...")
+    try:
+        # Find by JavaScript rather than Selenium
+        driver.execute_script("""
+            let buttons = document.querySelectorAll('button');
+            for (let btn of buttons) {
+                if (btn.textContent.includes('FORWARD') || btn.type === 'submit') {
+                    btn.click();
+                    return;
+                }
+            }
+        """)
+        print("Clicked button using JavaScript")
+        return True
+    except Exception as e:
+        print(f"JavaScript click failed: {e}")
+    
+    # Fall back to Selenium
+    locators = [
+        ((By.XPATH, "//button[contains(text(), 'FORWARD')]"), "Clicked FORWARD button by text"),
+        ((By.XPATH, "//button[@type='submit']"), "Clicked submit button by type"),
+        ((By.CSS_SELECTOR, ".btn-primary"), "Clicked button by class"),
+    ]
+    for locator, message in locators:
+        try:
+            forward_button = WebDriverWait(driver, 5).until(EC.element_to_be_clickable(locator))
+            forward_button.click()
+            print(message)
+            return True
+        except Exception as e:
+            print(f"Click attempt failed: {e}")
+    print("All click attempts failed")
+    return False
+
+# Function to record a result record in the results file and pass it on to the caller
+def emit_record(record, on_record=None):
+    with open(RESULTS_FILE, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    if on_record is not None:
+        on_record(record)
 
-# Function to create a new driver with the same configuration
-def create_new_driver():
-    # Configure Chrome options
-    chrome_options = Options()
+# Function to log in through the form, returns the failure class or None on success
+def login_with_form(driver, email, password, attempt, config, budget):
+    # Open the website directly to the English version
+    print("Opening the website directly in English...")
+    site_loaded = navigate_with_timeout(driver, config["base_url"], budget.timeout(config["page_timeout"]),
+                                        phase="homepage_load")
     
-    # Add headless mode
-    chrome_options.add_argument("--headless=new")  # Use the new headless implementation
+    if not site_loaded:
+        print("Initial site load timed out")
+        return "PageLoadTimeout"
+        
+    pause("between_pages")
     
-    # Anti-bot detection measures
-    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    chrome_options.add_experimental_option("useAutomationExtension", False)
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.6943.53 Safari/537.36")
+    print("Accessing login page...")
+    with span("login_form"):
+        form_filled = fill_login_form(driver, email, password, attempt)
+    if not form_filled:
+        return "LoginFormMissing"
     
-    # Other options
-    temp_dir = mkdtemp()
-    chrome_options.add_argument(f"--user-data-dir={temp_dir}")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--window-size=1920,1080")
+    # Click on the Forward button
+    with span("login_submit"):
+        if not click_login_button(driver):
+            return "LoginFormMissing"
+        
+        # Wait until the site has either accepted or rejected the credentials
+        login_state = wait_for_login_result(driver, budget.timeout(config["ready_timeout"]))
     
-    # Initialize the driver with the correct ChromeDriver version
-    print("Installing ChromeDriver...")
-    driver_path = ChromeDriverManager().install()
-    print(f"Using ChromeDriver from: {driver_path}")
-    service = Service(driver_path)
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+    if login_state != "logged_in":
+        print(f"Login was not accepted ({login_state or 'no response'})")
+        save_screenshot(driver, f"login_rejected_attempt_{attempt}", "error")
+        return "LoginRejected" if login_state == "rejected" else "PageNotReady"
     
-    # Apply stealth settings
-    stealth(driver,
-          languages=["en-US", "en"],
-          vendor="Google Inc.",
-          platform="Win32",
-          webgl_vendor="Intel Inc.",
-          renderer="Intel Iris OpenGL Engine",
-          fix_hairline=True,
-    )
+    # Check if we're logged in
+    save_screenshot(driver, f"after_login_attempt_{attempt}")
+    print("Login attempt completed, saved screenshot")
     
-    print("Selenium-stealth applied")
-    return driver, service, temp_dir
+    # Get all cookies
+    cookies = driver.get_cookies()
+    cookies_path = os.path.join(ARTIFACTS_DIR, f"prenotami_cookies_attempt_{attempt}.json")
+    with open(cookies_path, "w") as f:
+        json.dump(cookies, f)
+    
+    print(f"Cookies saved to {cookies_path}")
+    return None
+
+# Function to open the Services page after logging in, returns the failure class or None on success
+def open_services_page(driver, config, budget, attempt):
+    print("Navigating to the main Services page...")
+    services_loaded = navigate_with_timeout(driver, f"{config['base_url']}/Services",
+                                            budget.timeout(config["page_timeout"]), phase="services_load")
+    if not services_loaded:
+        print("Services page timed out")
+        return "PageLoadTimeout"
+    
+    services_state = wait_for_services_list(driver, budget.timeout(config["ready_timeout"]))
+    if services_state != "ready":
+        print(f"Services page is not usable ({services_state or 'no result'})")
+        save_screenshot(driver, f"services_error_attempt_{attempt}", "error")
+        return "SessionExpired" if services_state == "login" else "PageNotReady"
+    save_screenshot(driver, f"services_page_attempt_{attempt}")
+    print("Services page accessed, saved screenshot")
+    
+    # Keep the session for the next check if the login worked
+    if is_logged_in(driver):
+        save_session(driver)
+    return None
 
-# Ensure artifacts directory exists
-ensure_artifacts_dir()
+# Function to create an empty service result record
+def new_service_record(service_config, method, config):
+    return {
+        "type": "service",
+        "service_id": service_config["id"],
+        "service_name": service_config["name"],
+        "method": method,
+        "url": f"{config['base_url']}/Services/Booking/{service_config['id']}",
+        "status": None,
+        "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "duration": None,
+        "error_class": None,
+        "artifacts": [],
+    }
 
-# Read login credentials from external file
-EMAIL, PASSWORD = read_credentials()
+# Function to check one booking page over HTTP, returns None if the browser must check it
+def probe_booking_page(probe, service_config, config):
+    record = new_service_record(service_config, "http", config)
+    start_time = time.monotonic()
+    status = probe.check_booking_page(service_config)
+    if status is None:
+        return None
+    print(f"RESULT: No appointments available for service {service_config['id']} - all slots are booked.")
+    record["status"] = status
+    record["duration"] = round(time.monotonic() - start_time, 3)
+    return record
 
-if not EMAIL or not PASSWORD:
-    print("Error: Email or password missing in credentials file.")
-    exit(1)
+# Function to check one booking page in the browser, returns a service result record
+def check_booking_page(driver, service_config, config, budget, on_available=None):
+    service_id = service_config["id"]
+    record = new_service_record(service_config, "browser", config)
+    start_time = time.monotonic()
+    
+    booking_loaded = navigate_with_timeout(driver, record["url"], budget.timeout(config["page_timeout"]),
+                                           phase="booking_load", service_id=service_id)
+    if not booking_loaded:
+        record["status"] = "timeout"
+        record["error_class"] = "PageLoadTimeout"
+        record["duration"] = round(time.monotonic() - start_time, 3)
+        return record
+    
+    # Wait for the booked marker or the calendar instead of a fixed sleep
+    page_state = wait_for_booking_result(driver, service_config, budget.timeout(config["ready_timeout"]),
+                                         config["booking_settle_seconds"])
+    if page_state in (None, "login"):
+        return booking_page_not_ready(driver, record, start_time,
+                                      "SessionExpired" if page_state == "login" else "PageNotReady")
+    return finish_booking_page(driver, service_config, record, start_time, on_available)
 
-# Initialize the driver
-driver, service, temp_dir = create_new_driver()
+# Function to fail a booking page that did not show a result, returns the record
+def booking_page_not_ready(driver, record, start_time, error_class):
+    # Treated like a timeout: log out and retry with a fresh session
+    service_id = record["service_id"]
+    print(f"Booking page for service {service_id} did not become ready ({error_class})")
+    save_screenshot(driver, f"booking_not_ready_{service_id}", "error", service_id=service_id)
+    record["status"] = "timeout"
+    record["error_class"] = error_class
+    record["duration"] = round(time.monotonic() - start_time, 3)
+    return record
 
-try:
-    max_retries = 3
-    current_retry = 0
+# Function to classify a loaded booking page and keep its artifacts, returns the record
+def finish_booking_page(driver, service_config, record, start_time, on_available=None):
+    service_id = service_config["id"]
+    page_source = driver.page_source
+    with span("classify", service_id=service_id):
+        state, record["fingerprint"], record["fingerprint_new"] = classify_page(page_source, service_config)
+    if state == "booked":
+        print(f"RESULT: No appointments available for service {service_id} - all slots are booked.")
+        record["status"] = "booked"
+    elif state == "available":
+        print(f"RESULT: Appointments might be available for service {service_id}!")
+        record["status"] = "available"
+        # Raise the alert before anything else; the artifacts can follow
+        if on_available is not None:
+            on_available(record)
+    elif state == "login":
+        # The session is gone; retried like a timeout
+        print(f"Booking page for service {service_id} redirected to the login form")
+        record["status"] = "timeout"
+        record["error_class"] = "SessionExpired"
+    elif state == "maintenance":
+        print("RESULT: The site is under maintenance")
+        record["status"] = "maintenance"
+        record["error_class"] = "SiteMaintenance"
+    else:
+        # No booked marker, login form or maintenance message: the page may well offer slots
+        print(f"RESULT: Booking page for service {service_id} has an unknown layout ({record['fingerprint']}) "
+              "and might show available appointments!")
+        record["status"] = "unknown"
+        record["error_class"] = "UnknownPage"
+        if on_available is not None:
+            on_available(record)
     
-    while current_retry < max_retries:
-        # Open the website directly to the English version
-        print(f"Attempt {current_retry + 1}/{max_retries}")
-        
-       
-        print("Opening the website directly in English...")
-        site_loaded = navigate_with_timeout(driver, "https://prenotami.esteri.it", 30)
-        
-        if not site_loaded:
-            print("Initial site load timed out, retrying...")
-            current_retry += 1
-            continue
+    # Keep the full page for availability and for the first sighting of a layout that could not be classified
+    if state == "available" or (state == "unknown" and record["fingerprint_new"]):
+        kind = "availability" if state == "available" else "error"
+        screenshot_path = save_screenshot(driver, f"booking_page_{service_id}", kind, service_id=service_id)
+        with span("html_write"):
+            html_path = capture_html(page_source, f"booking_page_{service_id}", kind, service_id=service_id)
+        record["artifacts"] = [path for path in (screenshot_path, html_path) if path]
+    
+    record["duration"] = round(time.monotonic() - start_time, 3)
+    return record
+
+# Function to check booking pages in parallel tabs, yields each record as its page finishes
+def check_booking_pages_in_tabs(driver, service_configs, config, budget, on_available=None):
+    main_window = driver.current_window_handle
+    waiting = list(service_configs)
+    tabs = {}
+    try:
+        while waiting or tabs:
+            # Open a tab for every free slot; its page loads while the others are polled
+            while waiting and len(tabs) < config["booking_tabs"]:
+                service_config = waiting.pop(0)
+                driver.switch_to.new_window("tab")
+                # DevTools settings apply to the tab they were set up in, so repeat the main window's
+                apply_stealth(driver)
+                if config["lean_mode"]:
+                    apply_lean(driver)
+                record = new_service_record(service_config, "browser", config)
+                print(f"Opening the booking page for service {service_config['id']} in a new tab...")
+                start_time = time.monotonic()
+                # Unlike driver.get(), this returns without waiting for the page to load
+                driver.execute_script("window.location.href = arguments[0];", record["url"])
+                tabs[driver.current_window_handle] = {
+                    "service": service_config,
+                    "record": record,
+                    "start": start_time,
+                    "deadline": start_time + budget.timeout(config["page_timeout"] + config["ready_timeout"]),
+                    "condition": booking_condition(service_config, config["booking_settle_seconds"]),
+                }
             
-        human_delay()
+            for handle, tab in list(tabs.items()):
+                driver.switch_to.window(handle)
+                # The tab shows about:blank until its navigation has started
+                page_state = tab["condition"](driver) if driver.current_url != "about:blank" else False
+                timed_out = time.monotonic() > tab["deadline"]
+                if not page_state and not timed_out:
+                    continue
+                
+                del tabs[handle]
+                service_id = tab["service"]["id"]
+                loaded = is_document_complete(driver)
+                record_span("booking_load", time.monotonic() - tab["start"], service_id=service_id,
+                            bytes=page_transfer_bytes(driver), tab=True, timed_out=not loaded)
+                if page_state in ("booked", "available"):
+                    record = finish_booking_page(driver, tab["service"], tab["record"], tab["start"], on_available)
+                elif page_state == "login":
+                    record = booking_page_not_ready(driver, tab["record"], tab["start"], "SessionExpired")
+                else:
+                    record = booking_page_not_ready(driver, tab["record"], tab["start"],
+                                                    "PageNotReady" if loaded else "PageLoadTimeout")
+                driver.close()
+                driver.switch_to.window(main_window)
+                yield record
+            time.sleep(0.1)
+    finally:
+        for handle in tabs:
+            try:
+                driver.switch_to.window(handle)
+                driver.close()
+            except Exception:
+                pass
+        driver.switch_to.window(main_window)
+
+def run_check(email=None, password=None, browser=None, max_retries=3, on_record=None, config=None):
+    """Run one appointment check and return the result as a dict.
+
+    If ``browser`` (a BrowserService) is given, its warm driver is used and
+    left running afterwards; otherwise a driver is created and torn down.
+    ``config`` is a check configuration (see check_config.py); it is loaded
+    from check_config.json when not given. All configured services are
+    checked in one session, in priority order.
+
+    The check is bounded: it gives up after ``max_retries`` failures or
+    when ``check_deadline`` seconds have passed, and every page load and
+    wait is cut short at the deadline of its phase. Failures are handled
+    according to retry_policy.FAILURE_ACTIONS, with backoff in between.
+
+    Every booking page visit produces a ``"service"`` record and the check
+    ends with a ``"check"`` record. A page that may have open slots (status
+    "available", or "unknown" when it lacks the booked marker) first raises an
+    ``"availability"`` record, the moment it is classified and before its
+    artifacts are captured or the other services are checked. Records are appended to RESULTS_FILE as
+    JSON lines and passed to ``on_record`` as soon as they are produced.
+
+    The result has the keys ``check_id``, ``completed`` (all services were
+    checked and classified, or one was available with
+    stop_at_first_available),
+    ``services`` (service id -> "booked", "available" or "unknown"),
+    ``available_service`` (first available service id or None),
+    ``records``, ``attempts``, ``session_reused``, ``error``,
+    ``error_class``, ``started_at``, ``finished_at``, ``duration`` and
+    ``bytes_transferred`` (network bytes of every page loaded).
+    """
+    ensure_artifacts_dir()
+    start_time = time.monotonic()
+    if config is None:
+        config = load_check_config()
+    services = get_services(config)
+    configure_pacing(config["pacing"])
+    check_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    start_check_metrics(check_id)
+    begin_check(check_id, config["capture_policy"])
+    begin_profiling(check_id, config["profiling"])
+    result = {
+        "check_id": check_id,
+        "completed": False,
+        "services": {},
+        "available_service": None,
+        "records": [],
+        "attempts": 0,
+        "session_reused": False,
+        "error": None,
+        "error_class": None,
+        "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "finished_at": None,
+        "duration": None,
+        "bytes_transferred": 0,
+    }
+    
+    def record_service(record):
+        record["check_id"] = result["check_id"]
+        record["attempt"] = result["attempts"]
+        result["records"].append(record)
+        emit_record(record, on_record)
+        if record["status"] in ("booked", "available", "unknown"):
+            result["services"][record["service_id"]] = record["status"]
+        return record["status"]
+    
+    def announce_availability(record):
+        emit_record({
+            "type": "availability",
+            "check_id": result["check_id"],
+            "service_id": record["service_id"],
+            "service_name": record["service_name"],
+            "url": record["url"],
+            "method": record["method"],
+            "status": record["status"],
+            "fingerprint": record.get("fingerprint"),
+            "detected_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }, on_record)
+    
+    if email is None or password is None:
+        email, password = read_credentials()
+    if not email or not password:
+        print("Error: Email or password missing in credentials file.")
+        result["error"] = "Missing credentials"
+        result["error_class"] = "MissingCredentials"
+        return finish_check(result, start_time, on_record)
+    
+    # Set once the browser is up; a check that fails to start one has nothing to tear down
+    driver = service = temp_dir = service_lock = supervisor = None
+    budget = CheckBudget(config["check_deadline"], config["phase_deadlines"])
+    
+    def check_remaining_services():
+        """Check every service not yet classified, in priority order; returns a failure class or None"""
+        # In probe mode, booking pages are fetched over HTTP with the browser's cookies
+        probe = None
+        if config["probe_mode"]:
+            probe = get_http_probe(config["base_url"], USER_AGENT)
+            probe.load_cookies(driver)
         
-        print("Accessing login page...")
+        remaining = [s for s in services if s["id"] not in result["services"]]
+        if config["booking_tabs"] > 1 and probe is None and len(remaining) > 1:
+            # The pages load side by side and share one booking phase deadline
+            budget.start_phase("booking")
+            print(f"Checking {len(remaining)} booking pages, up to {config['booking_tabs']} tabs at once...")
+            with closing(check_booking_pages_in_tabs(driver, remaining, config, budget, announce_availability)) as records:
+                for record in records:
+                    status = record_service(record)
+                    if status in ("timeout", "maintenance"):
+                        return record["error_class"]
+                    if status == "available" and config["stop_at_first_available"]:
+                        print("Stopping at the first available service")
+                        break
+            return None
         
-        # Login process
-        try:
-            print("Looking for email field...")
-            try:
-                email_field = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, "//input[@id='Email' or @name='Email']"))
-                )
-            except Exception as e:
-                print(f"Error finding email field: {e}")
-                screenshot_path = os.path.join(ARTIFACTS_DIR, f"login_error_attempt_{current_retry}.png")
-                driver.save_screenshot(screenshot_path)
-                current_retry += 1
+        for service_config in services:
+            if service_config["id"] in result["services"]:
                 continue
-                
-            print("Found email field, filling form...")
-            email_field.clear()
-            human_delay()
-            # Type email character by character like a human
-            for char in EMAIL:
-                email_field.send_keys(char)
-                time.sleep(random.uniform(0.05, 0.15))
+            if result["services"]:
+                pause("between_services")
             
-            human_delay()
+            # Every booking page gets the booking phase deadline of its own
+            budget.start_phase("booking")
+            print(f"Navigating to the booking page for service {service_config['id']} ({service_config['name']})...")
+            record = probe_booking_page(probe, service_config, config) if probe is not None else None
+            if record is None:
+                record = check_booking_page(driver, service_config, config, budget, announce_availability)
+            status = record_service(record)
             
-            print("Looking for password field...")
-            password_field = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, "//input[@id='Password' or @name='Password']"))
-            )
-            password_field.clear()
-            human_delay()
-            # Type password character by character
-            for char in PASSWORD:
-                password_field.send_keys(char)
-                time.sleep(random.uniform(0.05, 0.15))
-                
-            human_delay()
-            
-            screenshot_path = os.path.join(ARTIFACTS_DIR, f"form_filled_attempt_{current_retry}.png")
-            driver.save_screenshot(screenshot_path)
-            print("Form filled, saved screenshot")
+            if status in ("timeout", "maintenance"):
+                return record["error_class"]
+            if status == "available" and config["stop_at_first_available"]:
+                print("Stopping at the first available service")
+                break
+        return None
+    
+    phase = "browser"
+    try:
+        # Initialize the driver
+        result["attempts"] = 1
+        budget.start_phase(phase)
+        with span("driver_creation", warm=browser is not None):
+            if browser is not None:
+                driver, service, temp_dir, service_lock = browser.acquire(), None, None, None
+            else:
+                # Browsers left behind by killed runs would otherwise pile up
+                reap_orphans(os.path.abspath(PROFILE_DIR))
+                driver, service, temp_dir, service_lock = create_new_driver(config["lean_mode"], config["profiling"])
+            if config["lean_mode"]:
+                # Blocking is per DevTools session, so apply it to warm and attached browsers too
+                apply_lean(driver)
+        
+        # Hard backstop behind the check's own deadlines: kill a hung or runaway browser
+        supervisor = BrowserSupervisor(service_pid(browser.service if browser is not None else service),
+                                       config["check_deadline"] + config["browser_kill_grace"],
+                                       config["browser_max_rss_mb"]).start()
+        
+        # The check runs through the phases session -> login -> services ->
+        # booking. A failure resumes from the failed phase (or from the login
+        # when the session is gone), so completed work is not repeated.
+        phase = "session"
+        failures = 0
+        
+        while phase != "done":
+            if budget.expired():
+                print(f"Check deadline of {config['check_deadline']}s reached, stopping")
+                result["error"] = f"Check deadline of {config['check_deadline']}s reached in phase {phase}"
+                result["error_class"] = "CheckDeadlineExceeded"
+                break
             
-            # Click on the Forward button
-            print("Attempting to click login button...")
+            budget.start_phase(phase)
             try:
-                # Find by JavaScript rather than Selenium
-                driver.execute_script("""
-                    let buttons = document.querySelectorAll('button');
-                    for (let btn of buttons) {
-                        if (btn.textContent.includes('FORWARD') || btn.type === 'submit') {
-                            btn.click();
-                            return;
-                        }
-                    }
-                """)
-                print("Clicked button using JavaScript")
-            except Exception as e:
-                print(f"JavaScript click failed: {e}")
-                # Fall back to Selenium
-                try:
-                    forward_button = WebDriverWait(driver, 5).until(
-                        EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'FORWARD')]"))
-                    )
-                    forward_button.click()
-                    print("Clicked FORWARD button by text")
-                except Exception as e:
-                    print(f"First attempt failed: {e}")
+                if phase == "session":
+                    # Try the saved session first; the login form is only needed when it has expired
                     try:
-                        forward_button = WebDriverWait(driver, 5).until(
-                            EC.element_to_be_clickable((By.XPATH, "//button[@type='submit']"))
-                        )
-                        forward_button.click()
-                        print("Clicked submit button by type")
+                        with span("session_restore"):
+                            restored = restore_session(driver, config["base_url"], navigate_with_timeout,
+                                                       budget.timeout(config["page_timeout"]))
                     except Exception as e:
-                        print(f"Second attempt failed: {e}")
-                        try:
-                            forward_button = WebDriverWait(driver, 5).until(
-                                EC.element_to_be_clickable((By.CSS_SELECTOR, ".btn-primary"))
-                            )
-                            forward_button.click()
-                            print("Clicked button by class")
-                        except Exception as e:
-                            print(f"All click attempts failed: {e}")
-                            current_retry += 1
-                            continue
-            
-            human_delay()
-            
-            # Check if we're logged in
-            screenshot_path = os.path.join(ARTIFACTS_DIR, f"after_login_attempt_{current_retry}.png")
-            driver.save_screenshot(screenshot_path)
-            print("Login attempt completed, saved screenshot")
-            
-            # Get all cookies
-            cookies = driver.get_cookies()
-            cookies_path = os.path.join(ARTIFACTS_DIR, f"prenotami_cookies_attempt_{current_retry}.json")
-            with open(cookies_path, "w") as f:
-                json.dump(cookies, f)
-            
-            print(f"Cookies saved to {cookies_path}")
-            
-            # First navigate to the Services page
-            print("Navigating to the main Services page...")
-            services_loaded = navigate_with_timeout(driver, "https://prenotami.esteri.it/Services", 30)
+                        print(f"Could not reuse saved session: {e}")
+                        restored = False
+                    result["session_reused"] = restored
+                    # A restored session is already on the Services page
+                    phase = "booking" if restored else "login"
+                    continue
+                
+                print(f"Phase {phase}, attempt {result['attempts']}/{max_retries}")
+                if phase == "login":
+                    failure = login_with_form(driver, email, password, failures, config, budget)
+                    next_phase = "services"
+                elif phase == "services":
+                    failure = open_services_page(driver, config, budget, failures)
+                    next_phase = "booking"
+                else:
+                    failure = check_remaining_services()
+                    next_phase = "done"
+                error = f"{failure} in phase {phase}"
+            except Exception as e:
+                print(f"Error in phase {phase}: {e}")
+                failure = type(e).__name__
+                error = str(e)
+                save_screenshot(driver, f"error_{phase}_attempt_{failures}", "error")
             
-            if not services_loaded:
-                print("Services page timed out, logging out and retrying...")
-                logout_success = logout_and_retry(driver)
-                # Only continue with the same driver, don't increment retry counter
-                # We want to try again with the same session, not reinitialize
+            if failure is None:
+                phase = next_phase
                 continue
-                
-            human_delay()
-            screenshot_path = os.path.join(ARTIFACTS_DIR, f"services_page_attempt_{current_retry}.png")
-            driver.save_screenshot(screenshot_path)
-            print("Services page accessed, saved screenshot")
             
-            # Then navigate to the first booking page
-            print("Navigating to the first booking service page (1151)...")
-            booking_loaded = navigate_with_timeout(driver, "https://prenotami.esteri.it/Services/Booking/1151", 30)
+            failures += 1
+            action = failure_action(failure)
+            print(f"Phase {phase} failed: {failure} ({failures}/{max_retries} failures, action: {action})")
+            if action == "abort":
+                result["error"] = error
+                result["error_class"] = failure
+                break
+            if failures >= max_retries:
+                result["error"] = f"Retries exhausted, last failure: {error}"
+                result["error_class"] = "RetriesExhausted"
+                break
             
-            if not booking_loaded:
-                print("Booking page 1151 timed out, logging out and retrying...")
-                logout_success = logout_and_retry(driver)
-                # Only continue with the same driver, don't increment retry counter
-                continue
-                
-            human_delay()
+            result["attempts"] += 1
+            if action == "relogin":
+                logout_and_retry(driver, config, budget.timeout(15))
+                phase = "login"
+            delay = min(backoff_delay(failures, config["retry_backoff_base"], config["retry_backoff_max"]),
+                        budget.remaining())
+            print(f"Retrying from phase {phase} in {delay:.1f}s")
+            time.sleep(delay)
+        
+        result["completed"] = phase == "done"
+        if phase == "done" and result["session_reused"]:
+            # The site refreshes the session cookies as they are used; keep the fresh ones
+            try:
+                save_session(driver)
+            except Exception as e:
+                print(f"Could not save the refreshed session: {e}")
+        unknown = [service_id for service_id, status in result["services"].items() if status == "unknown"]
+        if result["completed"] and unknown and "available" not in result["services"].values():
+            # A page that could not be classified may hide slots, so the services were not all checked
+            result["completed"] = False
+            result["error"] = f"Unknown booking page layout for service {', '.join(str(i) for i in unknown)}"
+            result["error_class"] = "UnknownPage"
             
-            # Check for the "fully booked" message
-            page_source = driver.page_source
-            if "Sorry, all appointments for this service are currently booked" in page_source:
-                print("RESULT: No appointments available for service 1151 - all slots are booked.")
-                
-                # Try the second booking page with delay
-                print("Trying alternative booking service page (1258)...")
-                human_delay()  # Additional delay before trying next service
-                
-                booking2_loaded = navigate_with_timeout(driver, "https://prenotami.esteri.it/Services/Booking/1258", 30)
-                
-                if not booking2_loaded:
-                    print("Booking page 1258 timed out, logging out and retrying...")
-                    logout_success = logout_and_retry(driver)
-                    # Only continue with the same driver, don't increment retry counter
-                    continue
-                    
-                human_delay()
-                
-                # Check the second service for availability
-                page_source = driver.page_source
-                if "Sorry, all appointments for this service are currently booked" in page_source:
-                    print("RESULT: No appointments available for service 1258 either - all slots are booked.")
+    except Exception as e:
+        print(f"An error occurred in phase {phase}: {e}")
+        result["error"] = f"{e} in phase {phase}"
+        result["error_class"] = type(e).__name__
+        
+    finally:
+        limit_hit = None
+        if supervisor is not None:
+            limit_hit = supervisor.stop()
+            print(f"Browser peak RSS: {supervisor.peak_rss / (1024 * 1024):.0f} MB")
+        try:
+            if driver is None and browser is None:
+                # The browser did not start; the next check reaps whatever it left behind
+                pass
+            elif driver is None:
+                # Do not keep a warm browser that failed its health check
+                print("Recycling the warm browser (it could not be acquired)")
+                browser.shutdown()
+            elif browser is not None:
+                if limit_hit:
+                    print(f"Recycling the warm browser ({limit_hit} limit reached)")
+                    browser.shutdown()
                 else:
-                    print("RESULT: Appointments might be available for service 1258!")
-                    
-                    # Save for inspection
-                    screenshot_path = os.path.join(ARTIFACTS_DIR, "booking_page_1258.png")
-                    driver.save_screenshot(screenshot_path)
-                    html_path = os.path.join(ARTIFACTS_DIR, "booking_page_1258.html")
-                    with open(html_path, "w", encoding="utf-8") as f:
-                        f.write(page_source)
+                    # Keep the warm browser for the next check
+                    browser.release()
+            elif service_lock is not None:
+                # Attached to the warm browser: stop our chromedriver but leave Chrome running
+                service.stop()
             else:
-                print("RESULT: Appointments might be available for service 1151!")
-                
-                # Save for inspection
-                screenshot_path = os.path.join(ARTIFACTS_DIR, "booking_page_1151.png")
-                driver.save_screenshot(screenshot_path)
-                html_path = os.path.join(ARTIFACTS_DIR, "booking_page_1151.html")
-                with open(html_path, "w", encoding="utf-8") as f:
-                    f.write(page_source)
-                    
-            # Success! Break out of retry loop
-            break
-                
+                # Close the browser
+                driver.quit()
         except Exception as e:
-            print(f"Error during process attempt {current_retry}: {e}")
-            screenshot_path = os.path.join(ARTIFACTS_DIR, f"error_attempt_{current_retry}.png")
-            driver.save_screenshot(screenshot_path)
-            current_retry += 1
+            print(f"Error closing the browser: {e}")
         
-except Exception as e:
-    print(f"An error occurred: {e}")
+        # Cleanup
+        try:
+            if browser is None and supervisor is not None:
+                # Kill whatever quit() left running
+                supervisor.cleanup()
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir)
+            if service_lock is not None:
+                # The daemon may recycle its browser again
+                service_lock.release()
+        except Exception as cleanup_error:
+            print(f"Error during cleanup: {cleanup_error}")
     
-finally:
-    # Close the browser
-    driver.quit()
+    return finish_check(result, start_time, on_record)
+
+# Function to fill in the final fields of a check result and emit its check record
+def finish_check(result, start_time, on_record=None):
+    for record in result["records"]:
+        if record["status"] == "available":
+            result["available_service"] = record["service_id"]
+            break
+    if result["completed"]:
+        result["error"] = None
+        result["error_class"] = None
+    elif result["error"] is None:
+        result["error"] = "Retries exhausted"
+        result["error_class"] = "RetriesExhausted"
+    result["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    result["duration"] = round(time.monotonic() - start_time, 3)
+    metrics_entry = finish_check_metrics(result)
+    if metrics_entry is not None:
+        result["bytes_transferred"] = metrics_entry["bytes_transferred"]
     
-    # Cleanup
-    try:
-        import shutil
-        shutil.rmtree(temp_dir)
-    except Exception as cleanup_error:
-        print(f"Error during cleanup: {cleanup_error}")
-        pass
\ No newline at end of file
+    check_record = {
+        "type": "check",
+        "check_id": result["check_id"],
+        "completed": result["completed"],
+        "available_service": result["available_service"],
+        "attempts": result["attempts"],
+        "session_reused": result["session_reused"],
+        "started_at": result["started_at"],
+        "finished_at": result["finished_at"],
+        "duration": result["duration"],
+        "bytes_transferred": result["bytes_transferred"],
+        "error_class": result["error_class"],
+        "error": result["error"],
+    }
+    emit_record(check_record, on_record)
+    return result
+
+def main():
+    """Run a single check from the command line"""
+    email, password = read_credentials()
+    if not email or not password:
+        print("Error: Email or password missing in credentials file.")
+        sys.exit(1)
+    
+    if "--json" in sys.argv[1:]:
+        # Print result records as JSON lines on stderr, keeping stdout for the log
+        result = run_check(email, password, on_record=lambda record: print(json.dumps(record), file=sys.stderr, flush=True))
+    else:
+        result = run_check(email, password)
+    # Wait for the background artifact writer before exiting
+    flush_artifacts()
+    sys.exit(0 if result["completed"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# One JSON line with all phase spans per check
+METRICS_FILE = os.path.join(ARTIFACTS_DIR, "metrics.jsonl")
+# Prometheus textfile-collector file describing the last check
+PROMETHEUS_FILE = os.path.join(ARTIFACTS_DIR, "prenotami_check.prom")
+
+# Metrics of the check that is currently running, if any
+_current = None
+
+class CheckMetrics:
+    """Timed phase spans collected during one check"""
+
+    def __init__(self, check_id):
+        self.check_id = check_id
+        self.started_at = time.time()
+        self.spans = []
+
+    def add_span(self, phase, duration, **tags):
+        span = {"phase": phase, "duration": round(duration, 3)}
+        span.update(tags)
+        self.spans.append(span)
+        return span
+
+    def phase_totals(self):
+        """Return the total duration of each phase"""
+        totals = {}
+        for span in self.spans:
+            totals[span["phase"]] = totals.get(span["phase"], 0.0) + span["duration"]
+        return totals
+
+    def timeouts(self):
+        return sum(1 for span in self.spans if span.get("timed_out"))
+
+    def bytes_transferred(self):
+        return sum(span.get("bytes", 0) for span in self.spans)
+
+def start_check_metrics(check_id):
+    """Start collecting spans for a new check"""
+    global _current
+    _current = CheckMetrics(check_id)
+    return _current
+
+@contextmanager
+def span(phase, **tags):
+    """Time a phase of the current check.
+
+    The yielded dict holds the span's tags, so the caller can add some
+    (e.g. ``timed_out``) before the block ends. Outside a check nothing
+    is recorded.
+    """
+    start = time.monotonic()
+    try:
+        yield tags
+    except Exception as e:
+        tags["error_class"] = type(e).__name__
+        raise
+    finally:
+        if _current is not None:
+            _current.add_span(phase, time.monotonic() - start, **tags)
+
+def record_span(phase, duration, **tags):
+    """Record a phase timed by the caller, for work that does not fit a with block"""
+    if _current is not None:
+        _current.add_span(phase, duration, **tags)
+
+def finish_check_metrics(result):
+    """Write the current check's spans to the JSONL and Prometheus files"""
+    global _current
+    metrics, _current = _current, None
+    if metrics is None:
+        return None
+
+    if not os.path.exists(ARTIFACTS_DIR):
+        os.makedirs(ARTIFACTS_DIR)
+    entry = {
+        "check_id": metrics.check_id,
+        "timestamp": datetime.fromtimestamp(metrics.started_at).strftime("%Y-%m-%d %H:%M:%S"),
+        "duration": result["duration"],
+        "completed": result["completed"],
+        "attempts": result["attempts"],
+        "retries": max(0, result["attempts"] - 1),
+        "timeouts": metrics.timeouts(),
+        "bytes_transferred": metrics.bytes_transferred(),
+        "spans": metrics.spans,
+    }
+    with open(METRICS_FILE, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    write_prometheus_file(entry, metrics.phase_totals())
+    return entry
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+def read_recent_metrics(limit=200, path=METRICS_FILE):
+    """Return the entries of the last ``limit`` checks from the metrics file"""
+    entries = deque(maxlen=limit)
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return list(entries)
+
+def phase_percentiles(entries, percentiles=(50, 95, 99)):
+    """Return {phase: {"count": n, "p50": s, ...}} over the spans of the given checks"""
+    durations = {}
+    for entry in entries:
+        for span in entry.get("spans", []):
+            durations.setdefault(span["phase"], []).append(span["duration"])
+    return {phase: dict({"count": len(values)}, **{f"p{pct}": percentile(values, pct) for pct in percentiles})
+            for phase, values in durations.items()}
+
+def write_prometheus_file(entry, phase_totals):
+    """Write the last check's metrics in the Prometheus text format"""
+    lines = [
+        "# HELP prenotami_check_phase_seconds Time spent in each phase of the last check.",
+        "# TYPE prenotami_check_phase_seconds gauge",
+    ]
+    for phase, total in sorted(phase_totals.items()):
+        lines.append(f'prenotami_check_phase_seconds{{phase="{phase}"}} {total:.3f}')
+    lines += [
+        "# HELP prenotami_check_duration_seconds Wall time of the last check.",
+        "# TYPE prenotami_check_duration_seconds gauge",
+        f"prenotami_check_duration_seconds {entry['duration']:.3f}",
+        "# HELP prenotami_check_completed Whether the last check checked every service.",
+        "# TYPE prenotami_check_completed gauge",
+        f"prenotami_check_completed {1 if entry['completed'] else 0}",
+        "# HELP prenotami_check_retries Retries used by the last check.",
+        "# TYPE prenotami_check_retries gauge",
+        f"prenotami_check_retries {entry['retries']}",
+        "# HELP prenotami_check_timeouts Page load timeouts in the last check.",
+        "# TYPE prenotami_check_timeouts gauge",
+        f"prenotami_check_timeouts {entry['timeouts']}",
+        "# HELP prenotami_check_bytes_transferred Network bytes of the pages loaded by the last check.",
+        "# TYPE prenotami_check_bytes_transferred gauge",
+        f"prenotami_check_bytes_transferred {entry['bytes_transferred']}",
+        "# HELP prenotami_check_last_run_timestamp_seconds Unix time the last check started.",
+        "# TYPE prenotami_check_last_run_timestamp_seconds gauge",
+        f"prenotami_check_last_run_timestamp_seconds {int(datetime.strptime(entry['timestamp'], '%Y-%m-%d %H:%M:%S').timestamp())}",
+    ]
+    # The textfile collector may read at any time, so replace the file atomically
+    temp_file = PROMETHEUS_FILE + ".tmp"
+    with open(temp_file, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_file, PROMETHEUS_FILE)
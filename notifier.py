@@ -0,0 +1,305 @@
+import json
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from email.message import EmailMessage
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configuration file path
+CONFIG_FILE = "telegram_config.json"
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# Messages waiting to be delivered, one JSON file per message and channel
+OUTBOX_DIR = os.path.join(ARTIFACTS_DIR, "outbox")
+# Messages that could not be delivered after MAX_ATTEMPTS
+DEAD_LETTER_DIR = os.path.join(OUTBOX_DIR, "dead")
+
+# Delivery attempts before a message is moved to the dead-letter directory
+MAX_ATTEMPTS = 8
+# Retry backoff: BACKOFF_BASE * 2^attempt seconds, capped at BACKOFF_MAX, plus jitter
+BACKOFF_BASE = 5
+BACKOFF_MAX = 15 * 60
+# Timeout for every HTTP or SMTP call, in seconds
+SEND_TIMEOUT = 10
+PHOTO_CAPTION_LIMIT = 1024
+
+# Shared notifier, created on first use
+_notifier = None
+
+class TelegramChannel:
+    """Send messages through the Telegram Bot API"""
+
+    name = "telegram"
+
+    def __init__(self, bot_token, chat_id, api_url="https://api.telegram.org"):
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.api_url = api_url.rstrip("/")
+
+    def send(self, session, message):
+        if message.get("photo"):
+            return self.send_photo(session, message)
+        url = f"{self.api_url}/bot{self.bot_token}/sendMessage"
+        payload = {
+            "chat_id": self.chat_id,
+            "text": message["text"],
+            "parse_mode": "HTML"
+        }
+        response = session.post(url, data=payload, timeout=SEND_TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"Telegram returned {response.status_code}: {response.text}")
+
+    def send_photo(self, session, message):
+        url = f"{self.api_url}/bot{self.bot_token}/sendPhoto"
+        payload = {
+            "chat_id": self.chat_id,
+            # Photo captions are limited to 1024 characters
+            "caption": message["text"][:PHOTO_CAPTION_LIMIT],
+            "parse_mode": "HTML"
+        }
+        with open(message["photo"], 'rb') as photo:
+            response = session.post(url, data=payload, files={"photo": photo}, timeout=SEND_TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"Telegram returned {response.status_code}: {response.text}")
+
+class WebhookChannel:
+    """POST messages as JSON to a generic webhook"""
+
+    name = "webhook"
+
+    def __init__(self, url, headers=None):
+        self.url = url
+        self.headers = headers or {}
+
+    def send(self, session, message):
+        payload = {"text": message["text"], "created_at": message["created_at"], "id": message["id"]}
+        if message.get("photo"):
+            payload["photo"] = message["photo"]
+        response = session.post(self.url, json=payload, headers=self.headers, timeout=SEND_TIMEOUT)
+        if response.status_code >= 300:
+            raise RuntimeError(f"Webhook returned {response.status_code}: {response.text}")
+
+class SmtpChannel:
+    """Send messages as plain-text email"""
+
+    name = "smtp"
+
+    def __init__(self, host, port, sender, recipients, username=None, password=None, use_tls=False,
+                 subject="Prenotami appointment monitor"):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.subject = subject
+
+    def send(self, session, message):
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = ", ".join(self.recipients)
+        email["Subject"] = self.subject
+        email.set_content(message["text"])
+        if message.get("photo"):
+            with open(message["photo"], 'rb') as photo:
+                email.add_attachment(photo.read(), maintype="image", subtype="png",
+                                     filename=os.path.basename(message["photo"]))
+        with smtplib.SMTP(self.host, self.port, timeout=SEND_TIMEOUT) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(email)
+
+def load_channels(file_path=CONFIG_FILE):
+    """Build the notification channels from the config file.
+
+    ``bot_token``/``chat_id`` enable Telegram; optional ``webhook`` and
+    ``smtp`` sections enable the other channels.
+    """
+    try:
+        with open(file_path, 'r') as file:
+            config = json.load(file)
+    except FileNotFoundError:
+        print(f"Error: Config file '{file_path}' not found.")
+        return []
+    except json.JSONDecodeError:
+        print(f"Error: Config file '{file_path}' is not valid JSON.")
+        return []
+    except Exception as e:
+        print(f"Error reading config: {e}")
+        return []
+
+    channels = []
+    if config.get("bot_token") and config.get("chat_id"):
+        channels.append(TelegramChannel(config["bot_token"], config["chat_id"],
+                                        config.get("api_url", "https://api.telegram.org")))
+    webhook = config.get("webhook")
+    if webhook and webhook.get("url"):
+        channels.append(WebhookChannel(webhook["url"], webhook.get("headers")))
+    smtp = config.get("smtp")
+    if smtp and smtp.get("host") and smtp.get("to"):
+        recipients = smtp["to"] if isinstance(smtp["to"], list) else [smtp["to"]]
+        channels.append(SmtpChannel(smtp["host"], smtp.get("port", 25), smtp.get("from", recipients[0]),
+                                    recipients, smtp.get("username"), smtp.get("password"),
+                                    smtp.get("use_tls", False)))
+    return channels
+
+def backoff_delay(attempts):
+    """Exponential backoff with full jitter for the given number of failed attempts"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempts)))
+
+class Notifier:
+    """Deliver messages to every channel from a durable on-disk outbox.
+
+    ``notify()`` writes one outbox file per channel and returns at once.
+    A background thread delivers due messages to all channels concurrently
+    over a pooled HTTP session, retrying failures with backoff. Messages
+    still in the outbox after a crash are delivered on the next start.
+    """
+
+    def __init__(self, channels, outbox_dir=OUTBOX_DIR):
+        self.channels = {channel.name: channel for channel in channels}
+        self.outbox_dir = outbox_dir
+        self.dead_letter_dir = os.path.join(outbox_dir, "dead")
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.channels)), thread_name_prefix="notify")
+        self.wakeup = threading.Event()
+        self.busy = False
+        self.thread = threading.Thread(target=self.run, name="notifier", daemon=True)
+        self.thread.start()
+
+    def notify(self, text, photo=None):
+        """Queue a message for every channel and return its id.
+
+        ``photo`` is the path of a PNG image sent with the text as its
+        caption; it is read when the message is delivered.
+        """
+        message_id = uuid.uuid4().hex
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for channel_name in self.channels:
+            message = {
+                "id": message_id,
+                "channel": channel_name,
+                "text": text,
+                "photo": photo,
+                "created_at": created_at,
+                "attempts": 0,
+                "next_attempt_at": 0,
+                "last_error": None,
+            }
+            self.write_message(self.message_path(message), message)
+        self.wakeup.set()
+        return message_id
+
+    def message_path(self, message):
+        return os.path.join(self.outbox_dir, f"{message['created_at'].replace(' ', '_').replace(':', '')}"
+                                             f"_{message['id']}_{message['channel']}.json")
+
+    def write_message(self, path, message):
+        # Write atomically so a crash never leaves a truncated message
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(message, f)
+        os.replace(temp_path, path)
+
+    def pending(self):
+        """Return (path, message) for every message in the outbox, oldest first"""
+        messages = []
+        for name in sorted(os.listdir(self.outbox_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.outbox_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    messages.append((path, json.load(f)))
+            except (OSError, json.JSONDecodeError):
+                continue
+        return messages
+
+    def queue_depth(self):
+        """Number of messages waiting to be delivered"""
+        return len(self.pending())
+
+    def due(self):
+        now = time.time()
+        return [(path, message) for path, message in self.pending() if message["next_attempt_at"] <= now]
+
+    def deliver(self, path, message):
+        channel = self.channels.get(message["channel"])
+        if channel is None:
+            # Channel was removed from the config; keep the message for inspection
+            os.replace(path, os.path.join(self.dead_letter_dir, os.path.basename(path)))
+            return
+        try:
+            channel.send(self.session, message)
+            os.remove(path)
+            print(f"Message sent successfully to {channel.name} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        except Exception as e:
+            message["attempts"] += 1
+            message["last_error"] = f"{type(e).__name__}: {e}"
+            if message["attempts"] >= MAX_ATTEMPTS:
+                print(f"Giving up on {channel.name} message after {message['attempts']} attempts: {e}")
+                self.write_message(os.path.join(self.dead_letter_dir, os.path.basename(path)), message)
+                os.remove(path)
+                return
+            delay = backoff_delay(message["attempts"])
+            message["next_attempt_at"] = time.time() + delay
+            self.write_message(path, message)
+            print(f"Failed to send {channel.name} message ({e}), retrying in {delay:.0f}s")
+
+    def run(self):
+        while True:
+            self.wakeup.clear()
+            self.busy = True
+            try:
+                due = self.due()
+                if due:
+                    wait([self.executor.submit(self.deliver, path, message) for path, message in due])
+                pending = self.pending()
+            except Exception as e:
+                print(f"Notifier error: {e}")
+                pending = []
+            finally:
+                self.busy = False
+            # Sleep until the next retry is due or a new message arrives
+            next_due = min((m["next_attempt_at"] for _, m in pending), default=None)
+            timeout = 60 if next_due is None else max(0.1, next_due - time.time())
+            self.wakeup.wait(timeout)
+
+    def flush(self, timeout=30):
+        """Wait until no message is due for delivery; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        self.wakeup.set()
+        while time.monotonic() < deadline:
+            if not self.busy and not self.due():
+                return True
+            time.sleep(0.1)
+        return False
+
+def get_notifier():
+    """Return the shared notifier, creating it from the config file on first use"""
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier(load_channels())
+    return _notifier
+
+def set_notifier(notifier):
+    """Replace the shared notifier, e.g. with a recording stand-in; returns the previous one"""
+    global _notifier
+    previous, _notifier = _notifier, notifier
+    return previous
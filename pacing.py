@@ -0,0 +1,30 @@
+import random
+import time
+
+# Human-like pauses, kept apart from the waits that make the check correct.
+# Each step has a [min, max] range in seconds; [0, 0] disables it.
+DEFAULT_PACING = {
+    # Around filling in each login form field
+    "typing": [1.0, 3.0],
+    # Between two keystrokes
+    "keystroke": [0.05, 0.15],
+    # After a page has loaded, before acting on it
+    "between_pages": [1.0, 3.0],
+    # Before moving on to the next booking page
+    "between_services": [1.0, 3.0],
+}
+
+# Pacing of the check that is currently running
+_pacing = dict(DEFAULT_PACING)
+
+def configure(pacing):
+    """Set the pacing ranges, keeping the defaults for steps not given"""
+    global _pacing
+    _pacing = dict(DEFAULT_PACING)
+    _pacing.update(pacing or {})
+
+def pause(step):
+    """Sleep for a random time in the step's range"""
+    low, high = _pacing.get(step, (0, 0))
+    if high > 0:
+        time.sleep(random.uniform(low, high))
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from check_config import load_check_config
+from history import get_history
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# The plans of the last few days by date, kept so they stay stable and can be inspected
+PLAN_FILE = os.path.join(ARTIFACTS_DIR, "check_plan.json")
+# How many days of plans the file keeps (the scheduler looks up to two days ahead)
+PLAN_DAYS_KEPT = 4
+
+# Pseudo-counts pulling sparse hours towards the overall availability rate
+PRIOR_WEIGHT = 5
+# Weight of the weekday-specific rate versus the all-days rate for the same hour
+WEEKDAY_SHARE = 0.5
+# Minimum time between two planned checks, in seconds
+MIN_GAP = 5 * 60
+
+def hourly_weights(rows, weekday):
+    """Estimate how likely slots are released in each hour of a given weekday.
+
+    ``rows`` come from HistoryStore.availability_by_hour(). Each hour's rate
+    is smoothed towards the overall rate, and the weekday-specific rate is
+    blended with the rate of that hour on all days.
+    """
+    total_checks = sum(r["checks"] for r in rows)
+    total_available = sum(r["available"] or 0 for r in rows)
+    overall = (total_available + 1) / (total_checks + 2)
+
+    def smoothed(selected):
+        checks = sum(r["checks"] for r in selected)
+        available = sum(r["available"] or 0 for r in selected)
+        return (available + PRIOR_WEIGHT * overall) / (checks + PRIOR_WEIGHT)
+
+    weights = []
+    for hour in range(24):
+        same_hour = [r for r in rows if r["hour"] == hour]
+        same_weekday = [r for r in same_hour if r["weekday"] == weekday]
+        weights.append(WEEKDAY_SHARE * smoothed(same_weekday) + (1 - WEEKDAY_SHARE) * smoothed(same_hour))
+    return weights
+
+def cap_density(density, cap):
+    """Clip each hour's share to ``cap``, handing the excess to the uncapped hours"""
+    if cap * len(density) < 1:
+        return density
+    density = list(density)
+    while True:
+        excess = sum(d - cap for d in density if d > cap)
+        if excess <= 1e-12:
+            return density
+        density = [min(d, cap) for d in density]
+        free = [i for i, d in enumerate(density) if d < cap]
+        free_total = sum(density[i] for i in free)
+        for i in free:
+            density[i] += excess * density[i] / free_total
+
+def plan_day(day, weights, budget, uniform_share, jitter_minutes=5, rng=random):
+    """Spread ``budget`` checks over one day, denser in hours with higher weight.
+
+    The check density is a mix of the normalised weights and a uniform
+    share, so quiet hours are still covered. No hour gets more than half
+    the checks MIN_GAP allows in it; the excess goes to the other hours.
+    Checks are placed at evenly spaced quantiles of that density, then
+    jittered.
+    """
+    total = sum(weights) or 1.0
+    density = [(1 - uniform_share) * w / total + uniform_share / 24 for w in weights]
+    density = cap_density(density, 0.5 * 3600 / MIN_GAP / max(budget, 1))
+    cumulative = []
+    running = 0.0
+    for value in density:
+        running += value
+        cumulative.append(running)
+
+    start = datetime.strptime(day, "%Y-%m-%d")
+    times = []
+    for k in range(budget):
+        quantile = (k + 0.5) / budget * running
+        hour = next(h for h, c in enumerate(cumulative) if c >= quantile)
+        before = cumulative[hour - 1] if hour else 0.0
+        fraction = (quantile - before) / density[hour]
+        offset = (hour + fraction) * 3600 + rng.uniform(-jitter_minutes, jitter_minutes) * 60
+        offset = min(max(offset, 0), 24 * 3600 - 1)
+        times.append(start + timedelta(seconds=offset))
+
+    # Keep the checks at least MIN_GAP apart without leaving the day
+    times.sort()
+    spaced = []
+    end = start + timedelta(days=1)
+    for t in times:
+        if spaced:
+            t = max(t, spaced[-1] + timedelta(seconds=MIN_GAP))
+        if t < end:
+            spaced.append(t)
+    return spaced
+
+def build_plan(day, config=None, history=None):
+    """Build the check plan of a day from the check history"""
+    config = config or load_check_config()
+    history = history or get_history()
+    since = (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=config["planner_history_days"])).strftime("%Y-%m-%d")
+    # SQLite counts weekdays from Sunday, Python from Monday
+    weekday = (datetime.strptime(day, "%Y-%m-%d").weekday() + 1) % 7
+    weights = hourly_weights(history.availability_by_hour(since), weekday)
+    times = plan_day(day, weights, config["daily_check_budget"], config["planner_uniform_share"])
+    return {
+        "day": day,
+        "budget": config["daily_check_budget"],
+        "weights": [round(w, 4) for w in weights],
+        "times": [t.strftime("%Y-%m-%d %H:%M:%S") for t in times],
+    }
+
+def read_plans():
+    """Return the saved plans as a dict of day -> plan"""
+    try:
+        with open(PLAN_FILE, 'r') as f:
+            saved = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if "day" in saved:
+        # Older files held a single day's plan
+        return {saved["day"]: saved}
+    return saved.get("plans", {})
+
+def load_plan(day):
+    """Return the saved plan of a day, building and saving it if needed.
+
+    Plans are saved by date, so looking ahead at tomorrow never replaces
+    today's plan and a day's times stay the same from call to call.
+    """
+    plans = read_plans()
+    if day in plans:
+        return plans[day]
+    plan = build_plan(day)
+    plans[day] = plan
+    # Dates sort as strings; only the latest days are kept
+    plans = {d: plans[d] for d in sorted(plans)[-PLAN_DAYS_KEPT:]}
+    if not os.path.exists(ARTIFACTS_DIR):
+        os.makedirs(ARTIFACTS_DIR)
+    temp_file = PLAN_FILE + ".tmp"
+    with open(temp_file, 'w') as f:
+        json.dump({"plans": plans}, f, indent=2)
+    os.replace(temp_file, PLAN_FILE)
+    return plan
+
+def next_planned_check(now):
+    """Return the timestamp of the next planned check after ``now`` (a timestamp)"""
+    current = datetime.fromtimestamp(now)
+    for days_ahead in (0, 1, 2):
+        day = (current + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
+        for t in load_plan(day)["times"]:
+            timestamp = datetime.strptime(t, "%Y-%m-%d %H:%M:%S").timestamp()
+            if timestamp >= now + MIN_GAP:
+                return timestamp
+    # Empty plans (zero budget): fall back to an hour from now
+    return now + 3600
+
+def main():
+    """Print the planned check schedule of a day"""
+    parser = argparse.ArgumentParser(description="Show the adaptive check plan")
+    parser.add_argument("--day", default=datetime.now().strftime("%Y-%m-%d"), help="day to plan (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    plan = load_plan(args.day)
+    counts = [0] * 24
+    for t in plan["times"]:
+        counts[int(t[11:13])] += 1
+    print(f"Check plan for {plan['day']} ({len(plan['times'])} of {plan['budget']} checks)")
+    print("hour  weight  checks")
+    for hour in range(24):
+        print(f"{hour:02d}:00 {plan['weights'][hour]:7.4f}  {'#' * counts[hour]}")
+    print()
+    print("\n".join(plan["times"]))
+
+if __name__ == "__main__":
+    main()
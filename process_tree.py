@@ -0,0 +1,101 @@
+import os
+import signal
+import time
+
+# Helpers that read process information from /proc (Linux only)
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def read_stat(pid):
+    """Return the fields of /proc/<pid>/stat after the command name, or None"""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, so split after its closing bracket
+    return data[data.rindex(")") + 2:].split()
+
+def list_descendants(pid):
+    """Return the pids of all descendants of a process"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        fields = read_stat(entry)
+        if fields is not None:
+            parents.setdefault(int(fields[1]), []).append(int(entry))
+
+    descendants = []
+    pending = [pid]
+    while pending:
+        for child in parents.get(pending.pop(), []):
+            descendants.append(child)
+            pending.append(child)
+    return descendants
+
+def cpu_seconds(pid):
+    """Return the user + system CPU time of a process in seconds"""
+    fields = read_stat(pid)
+    if fields is None:
+        return 0.0
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def rss_bytes(pid):
+    """Return the resident set size of a process in bytes"""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def tree_cpu_seconds(pid):
+    """Return the CPU time of a process and all its live descendants"""
+    return sum(cpu_seconds(p) for p in [pid] + list_descendants(pid))
+
+def tree_rss_bytes(pid):
+    """Return the total RSS of a process and all its live descendants"""
+    return sum(rss_bytes(p) for p in [pid] + list_descendants(pid))
+
+def command_line(pid):
+    """Return the command line of a process as a list of arguments"""
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            return [arg.decode("utf-8", "replace") for arg in f.read().split(b"\0") if arg]
+    except OSError:
+        return []
+
+def list_processes():
+    """Return the pids of all processes"""
+    return [int(entry) for entry in os.listdir("/proc") if entry.isdigit()]
+
+def parent_pid(pid):
+    """Return the parent pid of a process, or None if it has exited"""
+    fields = read_stat(pid)
+    return int(fields[1]) if fields is not None else None
+
+def kill_processes(pids, timeout=5):
+    """Terminate processes, then kill the ones still alive after ``timeout`` seconds"""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        alive = []
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+                alive.append(pid)
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        while alive and time.monotonic() < deadline:
+            alive = [pid for pid in alive if read_stat(pid) is not None and read_stat(pid)[0] != "Z"]
+            time.sleep(0.1)
+        pids = alive
+        if not pids:
+            return
+
+def kill_tree(pid, timeout=5):
+    """Kill a process and all its descendants, children first"""
+    kill_processes(list(reversed(list_descendants(pid))) + [pid], timeout)
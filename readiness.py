@@ -0,0 +1,83 @@
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+import time
+
+# Explicit readiness conditions for each page of the check. Each wait
+# returns as soon as the page shows what the check needs to decide, rather
+# than after a fixed sleep.
+
+PASSWORD_FIELD = (By.XPATH, "//input[@id='Password' or @name='Password']")
+LOGIN_ERRORS = (By.CSS_SELECTOR, ".validation-summary-errors, .field-validation-error, .alert-danger")
+BOOKING_LINKS = (By.XPATH, "//a[contains(@href, '/Services/Booking/')]")
+# Elements that only appear when a booking page offers slots
+AVAILABILITY_ELEMENTS = (By.CSS_SELECTOR, "#datetimepicker, .calendar, form#booking-form")
+
+def is_document_complete(driver):
+    return driver.execute_script("return document.readyState") == "complete"
+
+def wait_for(driver, condition, timeout):
+    """Poll ``condition(driver)`` until it returns a value; None on timeout"""
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.1).until(condition)
+    except Exception:
+        return None
+
+def wait_for_login_result(driver, timeout=15):
+    """Wait until the login either left the form or showed an error.
+
+    Returns "logged_in", "rejected" or None on timeout.
+    """
+    def login_result(d):
+        if d.find_elements(*LOGIN_ERRORS):
+            return "rejected"
+        if is_document_complete(d) and not d.find_elements(*PASSWORD_FIELD):
+            return "logged_in"
+        return False
+    return wait_for(driver, login_result, timeout)
+
+def wait_for_services_list(driver, timeout=15):
+    """Wait for the services list, or the login form if the session has gone.
+
+    Returns "ready", "login" or None on timeout.
+    """
+    def services_state(d):
+        if d.find_elements(*PASSWORD_FIELD):
+            return "login"
+        if d.find_elements(*BOOKING_LINKS):
+            return "ready"
+        return False
+    return wait_for(driver, services_state, timeout)
+
+def booking_condition(service_config, settle=1.0):
+    """Return a condition that tells what a booking page shows (see wait_for_booking_result).
+
+    The settle time counts from when the condition is created, so create it
+    when the navigation starts.
+    """
+    marker = service_config["booked_marker"]
+    start = time.monotonic()
+
+    def booking_state(d):
+        if d.execute_script("return document.body ? document.body.innerText.includes(arguments[0]) : false", marker):
+            return "booked"
+        if d.find_elements(*AVAILABILITY_ELEMENTS):
+            return "available"
+        if d.find_elements(*PASSWORD_FIELD):
+            return "login"
+        if is_document_complete(d) and time.monotonic() - start >= settle:
+            return "available"
+        return False
+    return booking_state
+
+def wait_for_booking_result(driver, service_config, timeout=15, settle=1.0):
+    """Wait until a booking page can be classified.
+
+    Returns "booked" as soon as the service's booked marker is on the page,
+    "available" as soon as a calendar or booking form appears, "login" if
+    the page is the login form, and None on timeout. A fully loaded page
+    with none of these counts as "available" after ``settle`` seconds, to
+    give late-rendered markers a chance. The page is then handed to the
+    classifier. Without the marker it comes out as "available" or
+    "unknown", and the check alerts on both as possibly available.
+    """
+    return wait_for(driver, booking_condition(service_config, settle), timeout)
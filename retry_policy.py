@@ -0,0 +1,63 @@
+import random
+import time
+
+# How the check reacts to each failure class:
+#   retry    run the failed phase again
+#   relogin  log out and resume from the login phase
+#   abort    stop the check; retrying cannot help
+FAILURE_ACTIONS = {
+    "PageLoadTimeout": "retry",
+    "PageNotReady": "retry",
+    "LoginFormMissing": "retry",
+    "SessionExpired": "relogin",
+    # Submitting rejected credentials again cannot help and risks locking the account
+    "LoginRejected": "abort",
+    "SiteMaintenance": "abort",
+    "MissingCredentials": "abort",
+    # The browser itself has gone away
+    "InvalidSessionIdException": "abort",
+    "NoSuchWindowException": "abort",
+}
+
+def failure_action(error_class):
+    """Return the action for a failure class; unexpected exceptions are retried"""
+    return FAILURE_ACTIONS.get(error_class, "retry")
+
+def backoff_delay(failures, base=2.0, cap=30.0):
+    """Exponential backoff with full jitter after the given number of failures"""
+    return random.uniform(0, min(cap, base * (2 ** max(0, failures - 1))))
+
+class CheckBudget:
+    """Deadlines for a whole check and for the phase that is running.
+
+    ``timeout(limit)`` shrinks a page or wait timeout so that it never
+    runs past either deadline, which puts a hard bound on the check.
+    """
+
+    def __init__(self, check_seconds, phase_seconds=None):
+        self.deadline = time.monotonic() + check_seconds
+        self.phase_seconds = phase_seconds or {}
+        self.phase = None
+        self.phase_deadline = self.deadline
+
+    def start_phase(self, phase):
+        """Start a phase, with its own deadline if one is configured"""
+        self.phase = phase
+        limit = self.phase_seconds.get(phase)
+        self.phase_deadline = self.deadline if limit is None else min(self.deadline, time.monotonic() + limit)
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def phase_remaining(self):
+        return max(0.0, self.phase_deadline - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def phase_expired(self):
+        return self.phase_remaining() <= 0
+
+    def timeout(self, limit):
+        """Return limit, cut down to what is left of the phase (at least one second)"""
+        return max(1, int(min(limit, self.phase_remaining())))
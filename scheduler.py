@@ -1,13 +1,29 @@
-import schedule
-import time
-import subprocess
+import contextlib
+import json
 import logging
-import random
 import os
+import random
+import sched
+import tempfile
+import threading
 from datetime import datetime, timedelta
+import appointment_monitor
+from browser_service import BrowserService, PROFILE_DIR
+from browser_supervisor import reap_orphans
+from check_config import load_check_config
+from clock import get_clock
+from health_server import HealthMonitor, start_health_server
+from leader_lease import LeaderElector, get_lease
+from planner import next_planned_check
+from thread_stdout import redirect_thread_stdout
 
 # Define artifacts directory
 ARTIFACTS_DIR = "artifacts"
+# Persisted schedule: next check time and last summary day
+STATE_FILE = os.path.join(ARTIFACTS_DIR, "scheduler_state.json")
+# Daily summary time
+SUMMARY_HOUR = 17
+SUMMARY_MINUTE = 0
 
 # Function to ensure the artifacts directory exists
 def ensure_artifacts_dir():
@@ -16,84 +32,311 @@ def ensure_artifacts_dir():
         os.makedirs(ARTIFACTS_DIR)
         print(f"Created artifacts directory: {ARTIFACTS_DIR}")
 
-# Configure logging
-ensure_artifacts_dir()
-log_file = os.path.join(ARTIFACTS_DIR, "scheduler.log")
+logger = logging.getLogger("appointment_scheduler")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+def configure_logging():
+    """Log to artifacts/scheduler.log and the console; done by main(), so importing writes nothing"""
+    ensure_artifacts_dir()
+    log_file = os.path.join(ARTIFACTS_DIR, "scheduler.log")
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler()
+        ]
+    )
 
-logger = logging.getLogger("appointment_scheduler")
+# Warm browser kept alive between checks, created by main()
+browser = None
+
+class LoggerWriter:
+    """File-like object that sends each printed line to the logger"""
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.buffer = ""
+
+    def write(self, data):
+        self.buffer += data
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            if line.strip():
+                self.logger.info(line.strip())
+
+    def flush(self):
+        if self.buffer.strip():
+            self.logger.info(self.buffer.strip())
+        self.buffer = ""
 
 def run_appointment_monitor():
-    """Run the appointment_monitor.py script"""
-    logger.info(f"Starting scheduled appointment check at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    """Run the appointment monitor in-process, reusing the warm browser"""
+    logger.info(f"Starting scheduled appointment check at {get_clock().now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     try:
-        # Run the appointment_monitor.py script
-        process = subprocess.Popen(['python3', 'appointment_monitor.py'], 
-                                  stdout=subprocess.PIPE, 
-                                  stderr=subprocess.STDOUT,
-                                  universal_newlines=True)
+        # Log the monitor output line by line; other threads keep printing to the console
+        with redirect_thread_stdout(LoggerWriter(logger)):
+            appointment_monitor.main(browser=browser)
         
-        # Log output in real-time
-        for line in process.stdout:
-            logger.info(line.strip())
-            
-        process.wait()
-        
-        logger.info(f"Appointment check completed with exit code {process.returncode}")
-        return process.returncode
+        logger.info("Appointment check completed")
+        return 0
     except Exception as e:
         logger.error(f"Error running appointment check: {e}")
         return -1
 
-def schedule_with_random_interval():
-    """Clear existing jobs and schedule a new job with random interval"""
+def random_check_interval():
+    """Return the delay until the next check: one hour plus a random offset of up to ±10 minutes"""
     # Generate random minutes offset between -10 and +10
     minutes_offset = random.randint(-10, 10)
     # Base interval is 60 minutes (1 hour) plus the random offset
-    interval_minutes = 60 + minutes_offset
-    
-    # Clear any existing scheduled jobs
-    schedule.clear()
-    
-    # Schedule the next run
-    schedule.every(interval_minutes).minutes.do(run_and_reschedule)
-    
-    # Calculate and log the next run time
-    next_run = datetime.now() + timedelta(minutes=interval_minutes)
-    logger.info(f"Next check scheduled for {next_run.strftime('%Y-%m-%d %H:%M:%S')} "
-                f"(standard hour {minutes_offset:+d} minutes)")
+    return (60 + minutes_offset) * 60
+
+def next_fixed_check(now):
+    """Return the next check time for the fixed hourly cadence"""
+    return now + random_check_interval()
+
+def next_summary_time(now):
+    """Return the next daily summary time after ``now`` (a timestamp)"""
+    current = datetime.fromtimestamp(now)
+    target = current.replace(hour=SUMMARY_HOUR, minute=SUMMARY_MINUTE, second=0, microsecond=0)
+    if target.timestamp() <= now:
+        target += timedelta(days=1)
+    return target.timestamp()
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+class CheckScheduler:
+    """Heap-based scheduler with independent check and daily summary jobs.
+
+    Jobs sit in a ``sched`` queue and the loop sleeps exactly until the
+    next one is due. Checks run in a worker thread so a long check never
+    delays the summary. The next check is only scheduled when the previous
+    one has finished, so checks never overlap. The next check time and the
+    last summary day are persisted, so a restart resumes the schedule
+    instead of checking immediately.
 
-def run_and_reschedule():
-    """Run the monitor and schedule the next run"""
-    run_appointment_monitor()
-    schedule_with_random_interval()
+    With a ``lease`` (see leader_lease.py), checks and summaries only run
+    while this node is the leader. A standby looks at the lease every
+    renew interval and, once it leads, continues the schedule the previous
+    leader published. ``on_standby`` is called when leadership is lost.
+    """
+
+    def __init__(self, check_job, summary_job, next_check=next_fixed_check, state_file=STATE_FILE, lease=None,
+                 on_standby=None, clock=None):
+        self.check_job = check_job
+        self.summary_job = summary_job
+        # Function returning the next check time after a given timestamp
+        self.next_check = next_check
+        self.state_file = state_file
+        self.clock = clock or get_clock()
+        self.lease = lease
+        self.on_standby = on_standby
+        self.leading = False
+        self.wakeup = threading.Event()
+        self.queue = sched.scheduler(self.clock.time, self.wait)
+        self.check_lock = threading.Lock()
+        # The check thread and the main loop both update the state
+        self.state_lock = threading.Lock()
+        self.state = self.load_state()
+
+    def wait(self, delay):
+        # Sleep until the next job is due, waking early when a job is added
+        self.clock.wait(self.wakeup, delay)
+        self.wakeup.clear()
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_state(self):
+        # A temp file of its own, so an interrupted write never leaves a half-written state
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(self.state_file) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(temp_file, self.state_file)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_file)
+            raise
+
+    def update_state(self, **changes):
+        """Update and persist the state; a failed write is logged so the schedule goes on"""
+        with self.state_lock:
+            self.state.update(changes)
+            try:
+                self.save_state()
+            except Exception as e:
+                logger.error(f"Could not save the scheduler state: {e}")
+
+    def schedule_check(self, when, announce=True):
+        self.update_state(next_check_at=when)
+        self.queue.enterabs(when, 1, self.start_check)
+        self.wakeup.set()
+        if announce:
+            logger.info(f"Next check scheduled for {format_time(when)}")
+
+    def schedule_summary(self, when):
+        self.queue.enterabs(when, 0, self.run_summary)
+        self.wakeup.set()
+        logger.info(f"Next daily summary scheduled for {format_time(when)}")
+
+    def role(self):
+        if self.lease is None:
+            return "single"
+        return "leader" if self.lease.is_leader() else "standby"
+
+    def is_standby(self):
+        """Check the lease; returns True if this node must not run checks now"""
+        if self.lease is None:
+            return False
+        if not self.lease.is_leader():
+            # Try at once rather than waiting for the elector, to keep the takeover bound tight
+            self.lease.try_acquire()
+        return not self.lease.is_leader()
+
+    def start_check(self):
+        if self.is_standby():
+            if self.leading:
+                # No check is running here, so the browser can go
+                logger.warning("Lost the leader lease, standing by")
+                self.leading = False
+                if self.on_standby is not None:
+                    self.on_standby()
+            self.schedule_check(self.clock.time() + self.lease.renew_interval, announce=False)
+            return
+        if self.lease is not None and not self.leading:
+            self.leading = True
+            logger.info(f"Leading as {self.lease.node_id} (term {self.lease.term})")
+            # Continue the previous leader's schedule rather than checking again at once
+            shared_next = self.lease.get_shared("next_check_at")
+            if shared_next is not None and shared_next > self.clock.time():
+                self.schedule_check(shared_next)
+                return
+        if not self.check_lock.acquire(blocking=False):
+            # Should not happen, since the next check is only scheduled after the last one
+            logger.warning("Previous check still running, skipping this one")
+            return
+        self.clock.start_thread(self.run_check, "check")
+
+    def run_check(self):
+        try:
+            self.update_state(last_check_at=self.clock.time())
+            self.check_job()
+        finally:
+            self.check_lock.release()
+            try:
+                next_check = self.next_check(self.clock.time())
+            except Exception as e:
+                logger.error(f"Error planning the next check, using the fixed cadence: {e}")
+                next_check = next_fixed_check(self.clock.time())
+            self.schedule_check(next_check)
+            if self.lease is not None:
+                try:
+                    self.lease.set_shared("next_check_at", next_check)
+                except Exception as e:
+                    logger.error(f"Could not publish the next check time: {e}")
+
+    def run_summary(self):
+        today = self.clock.now().strftime("%Y-%m-%d")
+        if self.is_standby():
+            # The leader sends the summary
+            logger.info("Standing by, leaving the daily summary to the leader")
+        elif self.state.get("last_summary_day") != today:
+            try:
+                self.summary_job()
+            except Exception as e:
+                logger.error(f"Error sending daily summary: {e}")
+            self.update_state(last_summary_day=today)
+        self.schedule_summary(next_summary_time(self.clock.time()))
+
+    def start(self):
+        """Schedule the first check and summary from the persisted state"""
+        now = self.clock.time()
+        next_check = self.state.get("next_check_at")
+        if next_check and next_check > now:
+            logger.info("Resuming the schedule from the previous run")
+            self.schedule_check(next_check)
+        else:
+            logger.info("Running initial check...")
+            self.schedule_check(now)
+
+        # Catch up on today's summary if the scheduler was down at summary time
+        today_summary = self.clock.now().replace(hour=SUMMARY_HOUR, minute=SUMMARY_MINUTE, second=0, microsecond=0)
+        if now >= today_summary.timestamp() and self.state.get("last_summary_day") != today_summary.strftime("%Y-%m-%d"):
+            self.schedule_summary(now)
+        else:
+            self.schedule_summary(next_summary_time(now))
+
+    def run(self, until=None):
+        """Run jobs until interrupted, or until the clock reaches ``until`` (a timestamp)"""
+        while until is None or self.clock.time() < until:
+            delay = self.queue.run(blocking=False)
+            if delay is None:
+                # The queue is only empty if a job failed to reschedule itself
+                delay = 60
+            if until is not None:
+                delay = min(delay, until - self.clock.time())
+            self.wait(delay)
+
+def run_daily_summary():
+    """Send the daily summary"""
+    # Redirecting this thread only leaves a running check's output alone
+    with redirect_thread_stdout(LoggerWriter(logger)):
+        sent = appointment_monitor.send_daily_summary()
+    if sent:
+        logger.info("Daily summary sent successfully")
 
 def main():
     """Main scheduler function"""
+    configure_logging()
     logger.info("Appointment scheduler starting...")
     
-    # Run immediately on startup
-    logger.info("Running initial check...")
-    run_appointment_monitor()
+    global browser
+    config = load_check_config()
+    # Clean up browsers and profiles left behind by a previous run that was killed
+    reap_orphans(os.path.abspath(PROFILE_DIR))
+    browser = BrowserService(lean=config["lean_mode"], max_rss_mb=config["browser_max_rss_mb"],
+                             profiling=config["profiling"])
     
-    # Schedule next run with random interval
-    schedule_with_random_interval()
+    # With a shared lease only the leader checks; a standby does not even keep a browser
+    lease = get_lease()
+    elector = None
+    if lease is not None:
+        elector = LeaderElector(lease).start()
+        logger.info(f"Node {lease.node_id} joined the election in {config['lease_db']} "
+                    f"({'leader' if elector.leader else 'standby'})")
+    next_check = next_planned_check if config["cadence"] == "adaptive" else next_fixed_check
+    scheduler = CheckScheduler(run_appointment_monitor, run_daily_summary, next_check, lease=lease,
+                               on_standby=browser.shutdown)
+    scheduler.start()
+    if config["cadence"] == "adaptive":
+        logger.info(f"Scheduler active. Will spread {config['daily_check_budget']} checks a day "
+                    f"following the adaptive plan (python planner.py shows it).")
+    else:
+        logger.info("Scheduler active. Will check for appointments approximately every hour (±10 minutes).")
     
-    logger.info("Scheduler active. Will check for appointments approximately every hour (±10 minutes).")
+    if config["health_port"]:
+        try:
+            start_health_server(HealthMonitor(scheduler, browser, config["check_deadline"]),
+                                config["health_host"], config["health_port"])
+            logger.info(f"Health endpoint at http://{config['health_host']}:{config['health_port']}/healthz and /metrics")
+        except OSError as e:
+            logger.error(f"Could not start the health endpoint: {e}")
     
     # Keep the scheduler running
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check for pending tasks every minute
+    try:
+        scheduler.run()
+    finally:
+        browser.shutdown()
+        if elector is not None:
+            # Hand over to a standby at once
+            elector.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
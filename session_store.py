@@ -0,0 +1,83 @@
+from selenium.webdriver.common.by import By
+import json
+import os
+import time
+from datetime import datetime
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# Cookies of the last session that was verified to be logged in
+SESSION_FILE = os.path.join(ARTIFACTS_DIR, "session_cookies.json")
+
+def save_session(driver):
+    """Save the cookies of a verified logged-in session"""
+    if not os.path.exists(ARTIFACTS_DIR):
+        os.makedirs(ARTIFACTS_DIR)
+    session = {
+        "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "cookies": driver.get_cookies(),
+    }
+    # Write to a temporary file first so a crash never leaves half a session behind
+    temp_file = SESSION_FILE + ".tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(session, f)
+    os.replace(temp_file, SESSION_FILE)
+    print(f"Session saved to {SESSION_FILE}")
+
+def load_session():
+    """Load the saved session cookies, dropping any that have expired"""
+    try:
+        with open(SESSION_FILE, 'r') as f:
+            session = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    now = time.time()
+    cookies = [c for c in session.get("cookies", []) if c.get("expiry") is None or c["expiry"] > now]
+    if not cookies:
+        return None
+    print(f"Loaded {len(cookies)} session cookies saved at {session.get('saved_at')}")
+    return cookies
+
+def clear_session():
+    """Forget the saved session, e.g. after logging out"""
+    if os.path.exists(SESSION_FILE):
+        os.remove(SESSION_FILE)
+
+def is_logged_in(driver):
+    """Check that the current page is not the login form"""
+    if "/Account/Login" in driver.current_url or "/Home/Login" in driver.current_url:
+        return False
+    return len(driver.find_elements(By.XPATH, "//input[@id='Password' or @name='Password']")) == 0
+
+def restore_session(driver, base_url, navigate, timeout=30):
+    """Restore the saved session and verify it by loading /Services.
+
+    ``navigate`` is the caller's navigation helper, called as
+    ``navigate(driver, url, timeout)`` and returning True on success.
+    Returns True when the browser is logged in and on the Services page.
+    """
+    cookies = load_session()
+    if not cookies:
+        return False
+
+    # Cookies can only be added for the domain of the current page
+    if not navigate(driver, base_url, timeout):
+        return False
+    driver.delete_all_cookies()
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            print(f"Could not restore cookie {cookie.get('name')}: {e}")
+
+    print("Checking saved session on the Services page...")
+    if not navigate(driver, f"{base_url}/Services", timeout):
+        return False
+    if not is_logged_in(driver):
+        print("Saved session has expired, falling back to the login form")
+        clear_session()
+        return False
+
+    print("Saved session is still valid, skipping the login form")
+    return True
@@ -0,0 +1,351 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import appointment_monitor
+import scheduler
+from check_config import CHECK_CONFIG_FILE, load_check_config, get_services
+from clock import SimulatedClock, set_clock
+from metrics import percentile
+from notifier import set_notifier
+from planner import next_planned_check
+
+# Replay of the scheduler, monitor and daily summary against simulated time.
+#
+# The real CheckScheduler, appointment_monitor.main() and check history run
+# on a SimulatedClock, with login.run_check() replaced by StubCheck, which
+# answers from a trace of slot releases, and the notifier replaced by a
+# recorder. Months of scheduling take seconds. The report counts the checks
+# that ran, compares the summaries sent with those due, and measures how
+# long each release took to be alerted.
+#
+# Everything is written to a scratch directory, never to ./artifacts.
+
+DEFAULT_DAYS = 90
+# Hours in which synthetic releases happen, with their relative weights
+RELEASE_HOURS = {8: 3, 9: 3, 10: 1, 14: 2, 15: 1, 20: 1}
+# How long a synthetic release stays open, in minutes
+RELEASE_MINUTES = (10, 60)
+# Simulated durations of a check: logging in, then each booking page (seconds)
+LOGIN_SECONDS = (20, 60)
+PAGE_SECONDS = (3, 8)
+# An alert counts for a release if it comes this long after the release closed (a check in flight)
+ALERT_GRACE = 5 * 60
+
+class RecordingNotifier:
+    """Stands in for the notifier and records every message with its simulated time"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.channels = {"simulated": None}
+        self.messages = []
+
+    def notify(self, text, photo=None):
+        self.messages.append({"time": self.clock.time(), "text": text, "photo": photo})
+        return len(self.messages)
+
+    def queue_depth(self):
+        return 0
+
+    def flush(self, timeout=30):
+        return True
+
+def generate_trace(start, days, service_ids, releases_per_week, rng, release_minutes=RELEASE_MINUTES):
+    """Synthetic slot releases: about ``releases_per_week`` per service, in RELEASE_HOURS"""
+    hours, weights = zip(*RELEASE_HOURS.items())
+    trace = []
+    for day in range(days):
+        midnight = start + timedelta(days=day)
+        for service_id in service_ids:
+            # Up to three releases a day, so busy weeks cluster like the real site's
+            for _ in range(3):
+                if rng.random() >= releases_per_week / 21:
+                    continue
+                opens = midnight + timedelta(hours=rng.choices(hours, weights)[0], minutes=rng.uniform(0, 60))
+                closes = opens + timedelta(minutes=rng.uniform(*release_minutes))
+                trace.append({"service_id": service_id, "opens_at": opens.timestamp(), "closes_at": closes.timestamp()})
+    return sorted(trace, key=lambda release: release["opens_at"])
+
+def load_trace(path):
+    """Read a trace file: a JSON list of {"service_id", "opens_at", "closes_at"} with local times"""
+    with open(path, 'r') as f:
+        releases = json.load(f)
+    return sorted(({
+        "service_id": release["service_id"],
+        "opens_at": datetime.strptime(release["opens_at"], "%Y-%m-%d %H:%M:%S").timestamp(),
+        "closes_at": datetime.strptime(release["closes_at"], "%Y-%m-%d %H:%M:%S").timestamp(),
+    } for release in releases), key=lambda release: release["opens_at"])
+
+def format_trace(trace):
+    return [{"service_id": r["service_id"],
+             "opens_at": datetime.fromtimestamp(r["opens_at"]).strftime("%Y-%m-%d %H:%M:%S"),
+             "closes_at": datetime.fromtimestamp(r["closes_at"]).strftime("%Y-%m-%d %H:%M:%S")} for r in trace]
+
+class StubCheck:
+    """Stands in for login.run_check(), answering from a slot-release trace.
+
+    Each call takes simulated time like a real check: the login, then one
+    booking page per service in priority order, stopping at the first one
+    with slots. It emits the same records and returns the same result
+    dict. A share of the checks fails at the login, as real ones do.
+    """
+
+    def __init__(self, clock, trace, services, rng, failure_rate=0.0):
+        self.clock = clock
+        self.trace = trace
+        self.services = services
+        self.rng = rng
+        self.failure_rate = failure_rate
+        # Every check: start time, whether it completed and the service found open
+        self.checks = []
+
+    def is_open(self, service_id, moment):
+        return any(r["service_id"] == service_id and r["opens_at"] <= moment < r["closes_at"] for r in self.trace)
+
+    def emit(self, record, on_record):
+        if on_record is not None:
+            on_record(record)
+
+    def __call__(self, browser=None, on_record=None):
+        started = self.clock.time()
+        check_id = datetime.fromtimestamp(started).strftime("%Y%m%d_%H%M%S_%f")
+        result = {
+            "check_id": check_id,
+            "completed": False,
+            "services": {},
+            "available_service": None,
+            "records": [],
+            "attempts": 1,
+            "session_reused": False,
+            "error": None,
+            "error_class": None,
+            "started_at": self.clock.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "finished_at": None,
+            "duration": None,
+            "bytes_transferred": 0,
+        }
+        self.clock.sleep(self.rng.uniform(*LOGIN_SECONDS))
+        if self.rng.random() < self.failure_rate:
+            result["error"] = "Retries exhausted, last failure: PageLoadTimeout in phase login"
+            result["error_class"] = "RetriesExhausted"
+        else:
+            for service in self.services:
+                page_started = self.clock.now()
+                page_seconds = self.rng.uniform(*PAGE_SECONDS)
+                self.clock.sleep(page_seconds)
+                status = "available" if self.is_open(service["id"], self.clock.time()) else "booked"
+                record = {
+                    "type": "service",
+                    "check_id": check_id,
+                    "attempt": 1,
+                    "service_id": service["id"],
+                    "service_name": service["name"],
+                    "method": "simulated",
+                    "url": f"https://prenotami.esteri.it/Services/Booking/{service['id']}",
+                    "status": status,
+                    "started_at": page_started.strftime("%Y-%m-%d %H:%M:%S"),
+                    "duration": round(page_seconds, 3),
+                    "error_class": None,
+                    "artifacts": [],
+                }
+                if status == "available":
+                    self.emit({"type": "availability", "check_id": check_id, "service_id": service["id"],
+                               "service_name": service["name"], "url": record["url"], "method": "simulated",
+                               "fingerprint": None, "detected_at": self.clock.now().strftime("%Y-%m-%d %H:%M:%S")}, on_record)
+                result["records"].append(record)
+                result["services"][service["id"]] = status
+                self.emit(record, on_record)
+                if status == "available":
+                    result["available_service"] = service["id"]
+                    break
+            result["completed"] = True
+        result["finished_at"] = self.clock.now().strftime("%Y-%m-%d %H:%M:%S")
+        result["duration"] = round(self.clock.time() - started, 3)
+        self.emit({"type": "check", "check_id": check_id, "completed": result["completed"],
+                   "available_service": result["available_service"], "attempts": 1, "session_reused": False,
+                   "started_at": result["started_at"], "finished_at": result["finished_at"],
+                   "duration": result["duration"], "bytes_transferred": 0,
+                   "error_class": result["error_class"], "error": result["error"]}, on_record)
+        self.checks.append({"started": started, "completed": result["completed"],
+                            "available": result["available_service"]})
+        return result
+
+def summaries_due(checks, start, days):
+    """Days whose summary should go out: checked before the summary time, and no slots found by then"""
+    due = []
+    for day in range(days):
+        midnight = start + timedelta(days=day)
+        summary_at = midnight.replace(hour=scheduler.SUMMARY_HOUR, minute=scheduler.SUMMARY_MINUTE).timestamp()
+        before = [c for c in checks if midnight.timestamp() <= c["started"] < summary_at]
+        if before and not any(c["available"] is not None for c in before):
+            due.append(midnight.strftime("%Y-%m-%d"))
+    return due
+
+def build_report(stub, notifier, trace, start, days, wall_seconds):
+    """Count checks, compare summaries sent with those due, and measure detection latency"""
+    per_day = {}
+    for check in stub.checks:
+        day = datetime.fromtimestamp(check["started"]).strftime("%Y-%m-%d")
+        per_day[day] = per_day.get(day, 0) + 1
+    counts = [per_day.get((start + timedelta(days=d)).strftime("%Y-%m-%d"), 0) for d in range(days)]
+
+    sent = {}
+    alerts = []
+    for message in notifier.messages:
+        if "DAILY SUMMARY" in message["text"]:
+            day = message["text"].split("Date: ", 1)[1][:10]
+            sent[day] = sent.get(day, 0) + 1
+        elif "APPOINTMENT AVAILABLE" in message["text"]:
+            service_id = int(message["text"].split("(code ", 1)[1].split(")", 1)[0])
+            alerts.append((message["time"], service_id))
+    due = summaries_due(stub.checks, start, days)
+
+    latencies, missed = [], []
+    for release in trace:
+        hits = [t for t, service_id in alerts if service_id == release["service_id"]
+                and release["opens_at"] <= t <= release["closes_at"] + ALERT_GRACE]
+        if hits:
+            latencies.append((min(hits) - release["opens_at"]) / 60)
+        else:
+            missed.append(release)
+    return {
+        "days": days,
+        "start": start.strftime("%Y-%m-%d"),
+        "checks": len(stub.checks),
+        "failed_checks": sum(1 for c in stub.checks if not c["completed"]),
+        "checks_per_day": {"min": min(counts, default=0), "mean": round(sum(counts) / max(days, 1), 2),
+                           "max": max(counts, default=0)},
+        "days_without_checks": [(start + timedelta(days=d)).strftime("%Y-%m-%d") for d, n in enumerate(counts) if not n],
+        "summaries_due": len(due),
+        "summaries_sent": sum(sent.values()),
+        "summaries_missed": sorted(set(due) - set(sent)),
+        "summaries_unexpected": sorted(set(sent) - set(due)),
+        "summaries_duplicated": sorted(day for day, n in sent.items() if n > 1),
+        "releases": len(trace),
+        "releases_detected": len(latencies),
+        "releases_missed": len(missed),
+        "availability_alerts": len(alerts),
+        "detection_latency_minutes": {
+            "p50": round(percentile(latencies, 50), 1) if latencies else None,
+            "p90": round(percentile(latencies, 90), 1) if latencies else None,
+            "max": round(max(latencies), 1) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 1) if latencies else None,
+        },
+        "wall_seconds": round(wall_seconds, 2),
+        "simulated_days_per_second": round(days / wall_seconds, 1) if wall_seconds else None,
+    }
+
+def simulate(days=DEFAULT_DAYS, start=None, cadence="fixed", trace=None, releases_per_week=3.0,
+             failure_rate=0.02, seed=1, workdir=None):
+    """Run the scheduler for ``days`` simulated days and return the report.
+
+    ``start`` is a midnight datetime (default: the coming Monday). Without a
+    ``trace``, one is generated from ``releases_per_week``. The run takes
+    place in ``workdir`` (a scratch directory by default), with the check
+    configuration of the current directory minus leader election.
+    """
+    start = start or (datetime.now() + timedelta(days=7 - datetime.now().weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    rng = random.Random(seed)
+    # The scheduler's and planner's jitter come from the global generator
+    random.seed(seed)
+    config = dict(load_check_config(), cadence=cadence, lease_db=None)
+    services = get_services(config)
+    if trace is None:
+        trace = generate_trace(start, days, [s["id"] for s in services], releases_per_week, rng)
+
+    workdir = workdir or tempfile.mkdtemp(prefix="prenotami_sim_")
+    original_dir = os.getcwd()
+    clock = SimulatedClock(start)
+    notifier = RecordingNotifier(clock)
+    stub = StubCheck(clock, trace, services, rng, failure_rate)
+    previous_clock = set_clock(clock)
+    previous_notifier = set_notifier(notifier)
+    log_level = scheduler.logger.level
+    wall_start = time.monotonic()
+    try:
+        os.chdir(workdir)
+        os.makedirs(scheduler.ARTIFACTS_DIR, exist_ok=True)
+        with open(CHECK_CONFIG_FILE, 'w') as f:
+            json.dump(config, f)
+        scheduler.logger.setLevel(logging.WARNING)
+        next_check = next_planned_check if cadence == "adaptive" else scheduler.next_fixed_check
+        check_scheduler = scheduler.CheckScheduler(lambda: appointment_monitor.main(check=stub),
+                                                   scheduler.run_daily_summary, next_check, clock=clock)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            check_scheduler.start()
+            check_scheduler.run(until=(start + timedelta(days=days)).timestamp())
+    finally:
+        os.chdir(original_dir)
+        scheduler.logger.setLevel(log_level)
+        set_clock(previous_clock)
+        set_notifier(previous_notifier)
+    report = build_report(stub, notifier, trace, start, days, time.monotonic() - wall_start)
+    report["cadence"] = cadence
+    report["workdir"] = workdir
+    return report
+
+def main():
+    """Run a simulation from the command line and print the report"""
+    parser = argparse.ArgumentParser(description="Run the scheduler, monitor and daily summary on simulated time")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS)
+    parser.add_argument("--start", help="first simulated day (YYYY-MM-DD, default: next Monday)")
+    parser.add_argument("--cadence", choices=["fixed", "adaptive"], default="fixed")
+    parser.add_argument("--trace", help="replay slot releases from a JSON file instead of generating them")
+    parser.add_argument("--write-trace", help="save the slot releases used to a JSON file")
+    parser.add_argument("--releases-per-week", type=float, default=3.0, help="synthetic releases per service and week")
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="share of checks that fail")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory with the simulated artifacts")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, "%Y-%m-%d") if args.start else None
+    trace = load_trace(args.trace) if args.trace else None
+    if trace is not None and start is None:
+        start = datetime.fromtimestamp(trace[0]["opens_at"]).replace(hour=0, minute=0, second=0, microsecond=0)
+    if args.write_trace and trace is None:
+        # Generate here so the trace can be saved; simulate() would draw the same one
+        start = start or (datetime.now() + timedelta(days=7 - datetime.now().weekday())).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        services = get_services(load_check_config())
+        trace = generate_trace(start, args.days, [s["id"] for s in services], args.releases_per_week,
+                               random.Random(args.seed))
+    if args.write_trace:
+        with open(args.write_trace, 'w') as f:
+            json.dump(format_trace(trace), f, indent=2)
+
+    report = simulate(args.days, start, args.cadence, trace, args.releases_per_week, args.failure_rate, args.seed)
+    if not args.keep:
+        shutil.rmtree(report["workdir"], ignore_errors=True)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    latency = report["detection_latency_minutes"]
+    print(f"Simulated {report['days']} days from {report['start']} ({report['cadence']} cadence) "
+          f"in {report['wall_seconds']}s ({report['simulated_days_per_second']} days/s)")
+    print(f"Checks: {report['checks']} ({report['failed_checks']} failed), per day "
+          f"{report['checks_per_day']['min']}..{report['checks_per_day']['max']} (mean {report['checks_per_day']['mean']})")
+    if report["days_without_checks"]:
+        print(f"Days without checks: {', '.join(report['days_without_checks'])}")
+    print(f"Summaries: {report['summaries_sent']} sent, {report['summaries_due']} due")
+    for key, label in (("summaries_missed", "Missed"), ("summaries_unexpected", "Sent but not due"),
+                       ("summaries_duplicated", "Sent twice")):
+        if report[key]:
+            print(f"  {label}: {', '.join(report[key])}")
+    print(f"Releases: {report['releases']}, detected {report['releases_detected']}, missed {report['releases_missed']}")
+    if latency["p50"] is not None:
+        print(f"Detection latency (minutes): p50 {latency['p50']}, p90 {latency['p90']}, "
+              f"mean {latency['mean']}, max {latency['max']}")
+    if args.keep:
+        print(f"Simulated artifacts kept in {report['workdir']}")
+
+if __name__ == "__main__":
+    main()
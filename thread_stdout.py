@@ -0,0 +1,50 @@
+import sys
+import threading
+from contextlib import contextmanager
+
+# Per-thread stdout redirection. contextlib.redirect_stdout swaps sys.stdout
+# for the whole process, so while a check thread was redirected, output of
+# the scheduler loop, the health server and the notifier ended up in the
+# check log. Here sys.stdout is replaced once by a proxy that writes to the
+# stream the calling thread redirected to, and to the original stdout for
+# every other thread.
+
+_install_lock = threading.Lock()
+
+class ThreadStdout:
+    """Stands in for sys.stdout and sends each thread's output to its own stream"""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, "stream", None) or self.default
+
+    def write(self, data):
+        return self.target().write(data)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+def current_stdout():
+    """Return the stream the calling thread's output goes to"""
+    stdout = sys.stdout
+    return stdout.target() if isinstance(stdout, ThreadStdout) else stdout
+
+@contextmanager
+def redirect_thread_stdout(stream):
+    """Like contextlib.redirect_stdout, but only for the calling thread"""
+    with _install_lock:
+        if not isinstance(sys.stdout, ThreadStdout):
+            sys.stdout = ThreadStdout(sys.stdout)
+        proxy = sys.stdout
+    previous = getattr(proxy.local, "stream", None)
+    proxy.local.stream = stream
+    try:
+        yield stream
+    finally:
+        proxy.local.stream = previous
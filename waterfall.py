@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from metrics import percentile
+
+# Network waterfall of every page load, for finding out why a check is slow.
+#
+# With "profiling" on, the driver records Chrome's performance log (the
+# DevTools Network domain). After each page load its requests are reduced
+# to one compact line in WATERFALLS_FILE: per request the time spent queued,
+# resolving DNS, connecting, in TLS, sending, waiting for the first byte
+# and receiving, plus its size and status. Requests still open when the
+# load gave up are marked pending, which is usually the culprit of a
+# timeout. Performance.getMetrics of the page is stored alongside.
+
+# Define artifacts directory
+ARTIFACTS_DIR = "artifacts"
+# One JSON line per profiled page load
+WATERFALLS_FILE = os.path.join(ARTIFACTS_DIR, "waterfalls.jsonl")
+# Parts of a request, in the order they happen
+TIMING_PHASES = ("queued", "dns", "connect", "ssl", "send", "wait", "receive")
+
+# Profiling context of the check that is currently running
+_enabled = False
+_check_id = None
+
+def begin_check(check_id, enabled):
+    """Set the check id and whether page loads are profiled"""
+    global _enabled, _check_id
+    _enabled, _check_id = enabled, check_id
+
+def read_events(driver):
+    """Drain the driver's performance log; returns the Network events as (method, params)"""
+    try:
+        entries = driver.get_log("performance")
+    except Exception as e:
+        print(f"Could not read the performance log: {e}")
+        return []
+    events = []
+    for entry in entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, TypeError, json.JSONDecodeError):
+            continue
+        if message.get("method", "").startswith("Network."):
+            events.append((message["method"], message.get("params", {})))
+    return events
+
+def start_page_load(driver):
+    """Forget the events of earlier pages and make sure page metrics are collected"""
+    if not _enabled:
+        return
+    read_events(driver)
+    try:
+        driver.execute_cdp_cmd("Performance.enable", {})
+    except Exception as e:
+        print(f"Could not enable performance metrics: {e}")
+
+def performance_metrics(driver):
+    """Return Performance.getMetrics of the current page as {name: value}"""
+    try:
+        metrics = driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]
+    except Exception:
+        return {}
+    return {metric["name"]: round(metric["value"], 3) for metric in metrics}
+
+def span_ms(timing, start, end):
+    """Milliseconds between two ResourceTiming marks, or None if the step did not happen"""
+    if timing.get(start, -1) < 0 or timing.get(end, -1) < 0:
+        return None
+    return round(timing[end] - timing[start], 1)
+
+def new_request(params):
+    request = params["request"]
+    return {
+        "url": request["url"],
+        "host": urlsplit(request["url"]).hostname,
+        "type": params.get("type"),
+        "method": request.get("method"),
+        "started": params["timestamp"],
+        "status": None,
+        "bytes": 0,
+        "pending": True,
+    }
+
+def apply_response(entry, response):
+    entry["status"] = response.get("status")
+    entry["protocol"] = response.get("protocol")
+    entry["cached"] = bool(response.get("fromDiskCache") or response.get("fromServiceWorker"))
+    timing = response.get("timing")
+    if not timing:
+        return
+    request_time = timing["requestTime"]
+    entry["queued"] = round(max(0.0, request_time - entry["started"]) * 1000, 1)
+    entry["dns"] = span_ms(timing, "dnsStart", "dnsEnd")
+    ssl = span_ms(timing, "sslStart", "sslEnd")
+    connect = span_ms(timing, "connectStart", "connectEnd")
+    entry["ssl"] = ssl
+    entry["connect"] = None if connect is None else round(connect - (ssl or 0), 1)
+    entry["send"] = span_ms(timing, "sendStart", "sendEnd")
+    entry["wait"] = span_ms(timing, "sendEnd", "receiveHeadersEnd")
+    entry["headers_at"] = request_time + timing.get("receiveHeadersEnd", 0) / 1000
+
+def finish_request(entry, timestamp):
+    entry["pending"] = False
+    if entry.get("headers_at") is not None:
+        entry["receive"] = round(max(0.0, timestamp - entry["headers_at"]) * 1000, 1)
+    entry["total"] = round((timestamp - entry["started"]) * 1000, 1)
+
+def build_waterfall(events, duration=None):
+    """Reduce Network events to one compact dict per request, in start order.
+
+    A redirect ends one request and starts the next under the same id.
+    Requests without a finish event are pending; their total runs to the
+    end of the page load, ``duration`` seconds after the first request, or
+    to the last event seen.
+    """
+    requests, current = [], {}
+    last_timestamp = None
+    for method, params in events:
+        request_id = params.get("requestId")
+        timestamp = params.get("timestamp")
+        if timestamp is not None:
+            last_timestamp = timestamp if last_timestamp is None else max(last_timestamp, timestamp)
+        entry = current.get(request_id)
+        if method == "Network.requestWillBeSent":
+            if entry is not None and params.get("redirectResponse"):
+                apply_response(entry, params["redirectResponse"])
+                finish_request(entry, timestamp)
+            entry = current[request_id] = new_request(params)
+            requests.append(entry)
+        elif entry is None:
+            continue
+        elif method == "Network.responseReceived":
+            apply_response(entry, params["response"])
+        elif method == "Network.loadingFinished":
+            entry["bytes"] = int(params.get("encodedDataLength", 0))
+            finish_request(entry, timestamp)
+        elif method == "Network.loadingFailed":
+            entry["error"] = params.get("blockedReason") or params.get("errorText")
+            entry["canceled"] = params.get("canceled", False)
+            finish_request(entry, timestamp)
+
+    first = min((entry["started"] for entry in requests), default=0)
+    ended_at = first + duration if duration is not None else last_timestamp
+    waterfall = []
+    for entry in requests:
+        if entry["pending"] and ended_at is not None:
+            entry["total"] = round(max(0.0, ended_at - entry["started"]) * 1000, 1)
+        entry["start"] = round((entry.pop("started") - first) * 1000, 1)
+        entry.pop("headers_at", None)
+        # Steps that did not happen are left out to keep the lines short
+        waterfall.append({key: value for key, value in entry.items() if value is not None})
+    return waterfall
+
+def capture_page_load(driver, phase, url, duration, timed_out=False, **tags):
+    """Store the waterfall and page metrics of the load that just ended; None when not profiling"""
+    if not _enabled:
+        return None
+    requests = build_waterfall(read_events(driver), duration)
+    entry = {
+        "check_id": _check_id,
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "phase": phase,
+        "url": url,
+        "duration": round(duration, 3),
+        "timed_out": timed_out,
+        "requests": requests,
+        "pending": sum(1 for request in requests if request["pending"]),
+        "bytes": sum(request["bytes"] for request in requests),
+        "metrics": performance_metrics(driver),
+    }
+    entry.update(tags)
+    if not os.path.exists(ARTIFACTS_DIR):
+        os.makedirs(ARTIFACTS_DIR)
+    with open(WATERFALLS_FILE, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    if timed_out and entry["pending"]:
+        slowest = max((r for r in requests if r["pending"]), key=lambda r: r.get("total", 0))
+        print(f"{entry['pending']} requests still open when {phase} gave up, the oldest {slowest['url']} "
+              f"({slowest.get('total', 0) / 1000:.1f}s)")
+    return entry
+
+def read_waterfalls(limit=500, path=WATERFALLS_FILE):
+    """Return the last ``limit`` page loads from the waterfalls file"""
+    entries = deque(maxlen=limit)
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return list(entries)
+
+def resource_key(url):
+    """A resource across runs: its URL without the query string"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+def build_report(entries, top=15):
+    """Rank page loads, resources, hosts and request steps across the given page loads"""
+    loads, resources, hosts = {}, {}, {}
+    step_totals = dict.fromkeys(TIMING_PHASES, 0.0)
+    for entry in entries:
+        load = loads.setdefault(entry["phase"], {"durations": [], "timeouts": 0, "pending": 0})
+        load["durations"].append(entry["duration"])
+        load["timeouts"] += int(entry["timed_out"])
+        load["pending"] += entry["pending"]
+        for request in entry["requests"]:
+            resource = resources.setdefault(resource_key(request["url"]), {
+                "totals": [], "waits": [], "bytes": 0, "failures": 0, "pending": 0,
+                "steps": dict.fromkeys(TIMING_PHASES, 0.0)})
+            resource["totals"].append(request.get("total", 0))
+            if "wait" in request:
+                resource["waits"].append(request["wait"])
+            resource["bytes"] += request["bytes"]
+            resource["failures"] += int("error" in request)
+            resource["pending"] += int(request["pending"])
+            host = hosts.setdefault(request.get("host") or "?", {"requests": 0, "ms": 0.0, "bytes": 0})
+            host["requests"] += 1
+            host["ms"] += request.get("total", 0)
+            host["bytes"] += request["bytes"]
+            for step in TIMING_PHASES:
+                resource["steps"][step] += request.get(step, 0)
+                step_totals[step] += request.get(step, 0)
+
+    page_loads = sorted(({
+        "phase": phase,
+        "count": len(load["durations"]),
+        "p50": percentile(load["durations"], 50),
+        "p95": percentile(load["durations"], 95),
+        "max": max(load["durations"]),
+        "timeouts": load["timeouts"],
+        "pending_requests": load["pending"],
+    } for phase, load in loads.items()), key=lambda row: row["p95"], reverse=True)
+    slowest = sorted(({
+        "resource": key,
+        "count": len(resource["totals"]),
+        "p50_ms": percentile(resource["totals"], 50),
+        "p95_ms": percentile(resource["totals"], 95),
+        "max_ms": max(resource["totals"]),
+        "wait_p95_ms": percentile(resource["waits"], 95),
+        "mean_kb": round(resource["bytes"] / len(resource["totals"]) / 1024, 1),
+        "failures": resource["failures"],
+        "pending": resource["pending"],
+        # Where most of this resource's time goes
+        "dominant_step": max(resource["steps"], key=resource["steps"].get) if any(resource["steps"].values()) else None,
+    } for key, resource in resources.items()), key=lambda row: row["p95_ms"], reverse=True)
+    step_sum = sum(step_totals.values())
+    return {
+        "page_loads_profiled": len(entries),
+        "page_loads": page_loads,
+        "resources": slowest[:top],
+        "hosts": sorted(({"host": host, "requests": stats["requests"], "seconds": round(stats["ms"] / 1000, 1),
+                          "kb": round(stats["bytes"] / 1024, 1)} for host, stats in hosts.items()),
+                        key=lambda row: row["seconds"], reverse=True)[:top],
+        "request_steps": [{"step": step, "seconds": round(total / 1000, 1),
+                           "share": round(total / step_sum, 3) if step_sum else None}
+                          for step, total in sorted(step_totals.items(), key=lambda item: item[1], reverse=True)],
+    }
+
+def main():
+    """Print the slowest page loads, resources, hosts and request steps across profiled checks"""
+    parser = argparse.ArgumentParser(description="Rank the slowest resources and phases of profiled checks")
+    parser.add_argument("--loads", type=int, default=500, help="most recent page loads to include")
+    parser.add_argument("--top", type=int, default=15, help="rows per ranking")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = build_report(read_waterfalls(args.loads), args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    if not report["page_loads_profiled"]:
+        print(f"No profiled page loads in {WATERFALLS_FILE}; set \"profiling\": true in check_config.json")
+        return
+    print(f"{report['page_loads_profiled']} profiled page loads\n")
+    print(f"{'phase':<20} {'loads':>5} {'p50 s':>7} {'p95 s':>7} {'max s':>7} {'timeouts':>8} {'pending':>7}")
+    for row in report["page_loads"]:
+        print(f"{row['phase']:<20} {row['count']:>5} {row['p50']:>7.2f} {row['p95']:>7.2f} {row['max']:>7.2f} "
+              f"{row['timeouts']:>8} {row['pending_requests']:>7}")
+    print(f"\n{'p95 ms':>8} {'p50 ms':>8} {'wait p95':>8} {'n':>4} {'kb':>7} {'fail':>4} {'pend':>4} {'mostly':<8} resource")
+    for row in report["resources"]:
+        wait = f"{row['wait_p95_ms']:.0f}" if row["wait_p95_ms"] is not None else "-"
+        print(f"{row['p95_ms']:>8.0f} {row['p50_ms']:>8.0f} {wait:>8} {row['count']:>4} {row['mean_kb']:>7} "
+              f"{row['failures']:>4} {row['pending']:>4} {row['dominant_step'] or '-':<8} {row['resource']}")
+    print(f"\n{'seconds':>8} {'requests':>8} {'kb':>9} host")
+    for row in report["hosts"]:
+        print(f"{row['seconds']:>8} {row['requests']:>8} {row['kb']:>9} {row['host']}")
+    print(f"\n{'seconds':>8} {'share':>6} request step")
+    for row in report["request_steps"]:
+        share = f"{row['share']:.0%}" if row["share"] is not None else "-"
+        print(f"{row['seconds']:>8} {share:>6} {row['step']}")
+
+if __name__ == "__main__":
+    main()